@@ -2,6 +2,8 @@
 ASGI config for Riderapp project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve the app through it (e.g. ``uvicorn Riderapp.asgi:application``) to use
+the ride event streams at /api/rides/<pk>/events/.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
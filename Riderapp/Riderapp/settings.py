@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Removes itself unless INSTRUMENTATION['ENABLED'] is set.
+    'ride_sharing.instrumentation.InstrumentationMiddleware',
+    'ride_sharing.replicas.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,13 +59,26 @@ MIDDLEWARE = [
 ROOT_URLCONF = 'Riderapp.urls'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'ride_sharing.authentication.CachedJWTAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'ride_sharing.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
 }
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    # Access tokens carry the user's role claim.
+    'TOKEN_OBTAIN_SERIALIZER': 'ride_sharing.authentication.RoleTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'ride_sharing.authentication.RoleTokenRefreshSerializer',
+}
+
+# In-process cache of authenticated users and their profiles (seconds, entries).
+JWT_USER_CACHE = {
+    'TTL': 60,
+    'SIZE': 10_000,
 }
 TEMPLATES = [
     {
@@ -81,14 +98,165 @@ TEMPLATES = [
 WSGI_APPLICATION = 'Riderapp.wsgi.application'
 GEOAPIFY_API_KEY = 'your-geoapify-api-key'
 
+# Reverse geocoding for ride locations, see ride_sharing/geocoding.py.
+# Set ASYNC to resolve uncached cities on a background worker instead of
+# inside the location request. CITY_BOUNDARIES may point at a GeoJSON file of
+# service-city polygons that is checked offline before calling the API.
+GEOCODING = {
+    'BACKEND': 'ride_sharing.geocoding.GeoapifyGeocoder',
+    'CACHE_SIZE': 10000,
+    'CACHE_TTL': 24 * 60 * 60,
+    'PRECISION': 3,
+    'ASYNC': False,
+    'CITY_BOUNDARIES': None,
+}
+
+# Assignment strategy used by the batch matcher (name or dotted path).
+RIDE_MATCHING_STRATEGY = 'greedy'
+
+# Buffering for the batched GPS ingestion endpoint, see ride_sharing/ingest.py.
+LOCATION_INGEST = {
+    'MAX_BATCH': 5000,
+    'MAX_DELAY': 1.0,
+    'BACKGROUND_FLUSH': True,
+    'MAX_POINT_AGE': 24 * 60 * 60,
+    'MAX_CLOCK_SKEW': 5 * 60,
+}
+# Driver presence used by matching; drivers drop out TTL seconds after
+# their last heartbeat. BACKEND may name a registry shared across processes.
+DRIVER_PRESENCE = {
+    'BACKEND': 'ride_sharing.presence.InMemoryPresenceRegistry',
+    'TTL': 30,
+}
+
+# Per-view timing, SQL and external-call metrics at /api/metrics/ (Prometheus
+# text format) plus sampled cProfile captures. Off by default.
+INSTRUMENTATION = {
+    'ENABLED': os.environ.get('RIDE_INSTRUMENTATION') == '1',
+    'PROFILE_SAMPLE_RATE': 0.0,
+    'PROFILE_HEADER': 'X-Profile',
+    'PROFILE_TOKEN': os.environ.get('RIDE_PROFILE_TOKEN'),
+    'PROFILE_DIR': None,
+}
+
+# Cache rendered rides for RideDetailView polls (seconds). ETag and
+# Last-Modified 304s work without it. Use a shared CACHES backend when
+# running more than one process, or other processes may serve a changed
+# ride for up to TIMEOUT.
+RIDE_DETAIL_CACHE = {
+    'ENABLED': False,
+    'CACHE': 'default',
+    'TIMEOUT': 30,
+}
+
+# GPS trails kept per ride in packed segments of SEGMENT_POINTS points,
+# simplified to within SIMPLIFY_TOLERANCE_M metres when the trip completes.
+RIDE_TRAILS = {
+    'SEGMENT_POINTS': 512,
+    'SIMPLIFY_TOLERANCE_M': 5.0,
+}
+
+# Trip estimates at /api/rides/estimate/ and in ride creation responses.
+# GRIDS are travel grid files from `manage.py build_travel_grid`; pairs they
+# do not cover are estimated from the great-circle distance, see
+# ride_sharing/estimates.py.
+RIDE_ESTIMATES = {
+    'GRIDS': [],
+    'FALLBACK_SPEED_KMH': 25.0,
+    'DETOUR_FACTOR': 1.3,
+    'BASE_FARE': 50.0,
+    'PER_KM': 12.0,
+    'PER_MINUTE': 1.5,
+    'MINIMUM_FARE': 80.0,
+    'CURRENCY': 'INR',
+    'MAX_BATCH': 1000,
+}
+
+# `manage.py archive_rides` moves COMPLETED/CANCELLED rides untouched for
+# AFTER_DAYS into the ArchivedRide table, CHUNK_SIZE rows per transaction
+# with PAUSE seconds between chunks. Ride detail reads fall back to it.
+RIDE_ARCHIVE = {
+    'AFTER_DAYS': 30,
+    'CHUNK_SIZE': 500,
+    'PAUSE': 0.05,
+}
+
+# Bulk registration at /api/users/register/bulk/ and `manage.py register_users`:
+# records per bulk insert, and password-hashing processes for the command
+# (None = one per CPU); the endpoint always hashes in-process.
+BULK_REGISTRATION = {
+    'CHUNK_SIZE': 1000,
+    'HASH_WORKERS': None,
+}
+
+# Sliding-window supply/demand counters served at /api/heatmap/.
+HEATMAP = {
+    'WINDOW': 15 * 60,
+    'BUCKETS': 15,
+    'CELL_PRECISION': 6,
+}
+
+# Pub/sub behind the ride event streams; swap for a shared broker when
+# running more than one process.
+RIDE_EVENTS_BROKER = 'ride_sharing.events.InProcessBroker'
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite unless POSTGRES_DB is set; PostgreSQL also reads POSTGRES_USER,
+# POSTGRES_PASSWORD, POSTGRES_HOST and POSTGRES_PORT, and
+# POSTGRES_REPLICA_HOSTS as a comma-separated list of read replicas.
+# Connections are kept for DB_CONN_MAX_AGE seconds instead of one per
+# request. Under ASGI set it to 0 and use DB_POOL_SIZE (psycopg 3's pool),
+# since async requests do not reuse a thread's connection.
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 0))
+
+if os.environ.get('POSTGRES_DB'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ['POSTGRES_DB'],
+            'USER': os.environ.get('POSTGRES_USER', ''),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', ''),
+            'PORT': os.environ.get('POSTGRES_PORT', ''),
+            # Django requires persistent connections off when pooling.
+            'CONN_MAX_AGE': 0 if DB_POOL_SIZE else DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {'pool': {'min_size': 1, 'max_size': DB_POOL_SIZE}} if DB_POOL_SIZE else {},
+        }
     }
+    replica_hosts = [host.strip() for host in os.environ.get('POSTGRES_REPLICA_HOSTS', '').split(',') if host.strip()]
+    for number, host in enumerate(replica_hosts, start=1):
+        DATABASES[f'replica{number}'] = {
+            **DATABASES['default'], 'HOST': host,
+            'OPTIONS': {**DATABASES['default']['OPTIONS']},
+            'TEST': {'MIRROR': 'default'},
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            # SQLITE_WAL=1 lets readers run alongside the writer; with WAL,
+            # NORMAL sync only risks the last commits on power loss, not
+            # corruption. Opt-in, since WAL is written into the file itself.
+            'OPTIONS': {
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            } if os.environ.get('SQLITE_WAL') == '1' else {},
+        }
+    }
+
+DATABASE_ROUTERS = ['ride_sharing.replicas.ReplicaRouter']
+
+# Replicas RideListView and RideDetailView may read from, see
+# ride_sharing/replicas.py. After a write, the user reads the primary for
+# STICKY_SECONDS.
+READ_REPLICAS = {
+    'DATABASES': [alias for alias in DATABASES if alias != 'default'],
+    'STICKY_SECONDS': 5,
 }
 
 
@@ -1,6 +1,7 @@
 from django.contrib import admin
-from .models import Ride,UserProfile
+from .models import ArchivedRide, Ride,UserProfile
 
 # Register your models here.
 admin.site.register(Ride)
-admin.site.register(UserProfile)
\ No newline at end of file
+admin.site.register(UserProfile)
+admin.site.register(ArchivedRide)
\ No newline at end of file
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class RideSharingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ride_sharing'
+
+    def ready(self):
+        # Connects the receivers that drop cached users on User/UserProfile
+        # changes and cached ride details on Ride saves.
+        from . import authentication, ride_cache  # noqa: F401
@@ -0,0 +1,72 @@
+# ride_sharing/archive.py
+"""
+Moves finished rides out of the Ride table into ArchivedRide.
+
+Operational queries only care about open and active rides, so COMPLETED and
+CANCELLED rides older than RIDE_ARCHIVE['AFTER_DAYS'] are copied to the
+archive and deleted from Ride in short CHUNK_SIZE transactions, pausing
+between chunks so live writers are never held up for long. Ride ids are
+kept, and ``read_through`` lets reads by id fall back to the archive.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import FINAL_STATUSES, ArchivedRide, Ride
+
+DEFAULTS = {
+    # Finished rides untouched for this many days are archived.
+    'AFTER_DAYS': 30,
+    'CHUNK_SIZE': 500,
+    # Seconds to sleep between chunks.
+    'PAUSE': 0.05,
+}
+
+
+def archive_settings():
+    return {**DEFAULTS, **getattr(settings, 'RIDE_ARCHIVE', {})}
+
+
+def archive_finished_rides(older_than=None, chunk_size=None, pause=None):
+    """
+    Archive finished rides last updated more than ``older_than`` (a timedelta)
+    ago; returns how many were moved.
+    """
+    config = archive_settings()
+    if older_than is None:
+        older_than = timedelta(days=config['AFTER_DAYS'])
+    chunk_size = chunk_size or config['CHUNK_SIZE']
+    pause = config['PAUSE'] if pause is None else pause
+    finished = Ride.objects.filter(status__in=FINAL_STATUSES, updated_at__lt=timezone.now() - older_than)
+
+    archived = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            # Walk the primary key so each chunk starts where the last ended.
+            rows = list(finished.filter(pk__gt=last_id).select_for_update().order_by('pk')
+                        .values_list(*ArchivedRide.RIDE_FIELDS)[:chunk_size])
+            if not rows:
+                return archived
+            ArchivedRide.objects.bulk_create([ArchivedRide(**dict(zip(ArchivedRide.RIDE_FIELDS, row)))
+                                              for row in rows])
+            last_id = rows[-1][0]
+            Ride.objects.filter(pk__in=[row[0] for row in rows]).delete()
+        archived += len(rows)
+        if pause:
+            time.sleep(pause)
+
+
+def read_through(query):
+    """``query(Ride)``, or ``query(ArchivedRide)`` when that finds nothing."""
+    result = query(Ride)
+    return query(ArchivedRide) if result is None else result
+
+
+async def aread_through(query):
+    """``read_through`` for a ``query`` returning an awaitable."""
+    result = await query(Ride)
+    return await query(ArchivedRide) if result is None else result
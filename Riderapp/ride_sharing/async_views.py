@@ -0,0 +1,164 @@
+# ride_sharing/async_views.py
+"""
+Async versions of the ride endpoints, mounted under /api/async/.
+
+DRF's APIView only runs synchronously, so these are plain Django views with
+async handlers. Served through Riderapp.asgi they wait on the database with
+the async ORM (``aget``, ``asave``, ``aupdate``) and on the geocoder with a
+pooled ``httpx.AsyncClient``, so a slow Geoapify response holds a coroutine
+rather than a worker thread. Requests and responses match the synchronous
+views; the shared bookkeeping after each write (events, presence, heatmap,
+trails) is the same code, run through ``sync_to_async``.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils import timezone
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+
+from .authentication import authenticate_request
+from .estimates import ride_estimate
+from .geocoding import geocoding_settings, get_geocoder
+from .heatmap import record_ride_event
+from .instrumentation import timed
+from .models import Ride, UserProfile
+from .renderers import FastJSONRenderer
+from .replicas import read_from_replicas
+from .ride_cache import aride_detail_response
+from .serializers import RideLocationSerializer, RideSerializer, render_ride
+from .views import ride_accepted, ride_located, ride_status_changed
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    return HttpResponse(FastJSONRenderer().render(data), status=status, content_type='application/json')
+
+
+class AsyncRideView(View):
+    """
+    JWT-authenticated async view. Handlers see the user as ``request.user``
+    and a JSON request body as ``self.data``; other bodies are ignored.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Authenticated by bearer token, never by session cookie.
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        user = await sync_to_async(authenticate_request)(request)
+        if user is None:
+            return json_response({"detail": "Authentication credentials were not provided or are invalid"},
+                                 status=status.HTTP_401_UNAUTHORIZED)
+        request.user = user
+        self.data = {}
+        if request.content_type == 'application/json' and request.body:
+            try:
+                self.data = json.loads(request.body)
+            except ValueError:
+                return json_response({"detail": "JSON parse error"}, status=status.HTTP_400_BAD_REQUEST)
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class AsyncRideCreateView(AsyncRideView):
+    async def post(self, request):
+        try:
+            if not request.user.profile.role == 'RIDER':
+                return json_response({"error": "Only users with the 'Rider' role can create rides"},
+                                     status=status.HTTP_403_FORBIDDEN)
+        except UserProfile.DoesNotExist:
+            return json_response({"error": "User profile not found"}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = RideSerializer(data=self.data)
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        ride = Ride(rider=request.user, **serializer.validated_data)
+        await ride.asave()
+        if ride.latitude is not None or ride.city:
+            await sync_to_async(record_ride_event)('request', ride)
+        data = render_ride(ride)
+        estimate = ride_estimate(self.data, ride)
+        if estimate is not None:
+            data['estimate'] = estimate
+        return json_response(data, status=status.HTTP_201_CREATED)
+
+
+class AsyncRideDetailView(AsyncRideView):
+    async def get(self, request, pk):
+        await sync_to_async(read_from_replicas)(request.user)
+        return await aride_detail_response(request, pk, json_response)
+
+
+class AsyncRideLocationUpdateView(AsyncRideView):
+    async def post(self, request, pk):
+        try:
+            ride = await Ride.objects.with_related().aget(pk=pk)
+        except Ride.DoesNotExist:
+            return json_response({"error": "Ride not found"}, status=status.HTTP_404_NOT_FOUND)
+        if ride.driver_id != request.user.id and ride.rider_id != request.user.id:
+            return json_response({"error": "Unauthorized to update this ride"}, status=status.HTTP_403_FORBIDDEN)
+        serializer = RideLocationSerializer(data=self.data)
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        first_fix = ride.latitude is None and not ride.city
+        ride.current_location = serializer.validated_data['current_location']
+        lng, lat = ride.current_location['coordinates']
+        resolve_later = False
+        with timed('geocode'):
+            if geocoding_settings()['ASYNC']:
+                city = get_geocoder().cached(lng, lat)
+                if city is not None:
+                    ride.city = city
+                resolve_later = city is None
+            else:
+                ride.city = await get_geocoder().areverse(lng, lat)
+        await ride.asave(update_fields=[*Ride.LOCATION_FIELDS, 'city', 'updated_at'])
+        data = await sync_to_async(ride_located)(ride, request.user, first_fix, resolve_later)
+        return json_response(data)
+
+
+class AsyncRideAcceptView(AsyncRideView):
+    async def post(self, request, pk):
+        try:
+            ride = await Ride.objects.with_related().aget(pk=pk)
+        except Ride.DoesNotExist:
+            return json_response({"error": "Ride not found"}, status=status.HTTP_404_NOT_FOUND)
+        if ride.status != 'REQUESTED':
+            return json_response({"error": "Ride cannot be accepted"}, status=status.HTTP_400_BAD_REQUEST)
+        if ride.rider_id == request.user.id:
+            return json_response({"error": "Rider cannot accept their own ride"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            if not request.user.profile.role == 'DRIVER':
+                return json_response({"error": "Only users with the 'Driver' role can accept rides"},
+                                     status=status.HTTP_403_FORBIDDEN)
+        except UserProfile.DoesNotExist:
+            return json_response({"error": "User profile not found"}, status=status.HTTP_400_BAD_REQUEST)
+        now = timezone.now()
+        # assign_driver locks the driver's row in a transaction, which the
+        # async ORM cannot hold open; it runs on the sync thread instead.
+        if not await sync_to_async(Ride.objects.assign_driver)(ride.pk, request.user, now=now):
+            await ride.arefresh_from_db(fields=['status'])
+            if ride.status != 'REQUESTED':
+                return json_response({"error": "Ride was accepted by another driver"},
+                                     status=status.HTTP_409_CONFLICT)
+            return json_response({"error": "Driver is already on another trip"}, status=status.HTTP_409_CONFLICT)
+        return json_response(await sync_to_async(ride_accepted)(ride, request.user, now))
+
+
+class AsyncRideStatusUpdateView(AsyncRideView):
+    async def patch(self, request, pk):
+        try:
+            ride = await Ride.objects.with_related().aget(pk=pk)
+        except Ride.DoesNotExist:
+            return json_response({"error": "Ride not found"}, status=status.HTTP_404_NOT_FOUND)
+        status_value = self.data.get('status') if isinstance(self.data, dict) else None
+        if status_value not in Ride.STATUS_VALUES:
+            return json_response({"error": "Invalid status"}, status=status.HTTP_400_BAD_REQUEST)
+        now = timezone.now()
+        if not await Ride.objects.filter(pk=pk).atransition(status_value, now=now):
+            await ride.arefresh_from_db(fields=['status'])
+            return json_response({"error": f"Cannot change status from {ride.status} to {status_value}"},
+                                 status=status.HTTP_409_CONFLICT)
+        return json_response(await sync_to_async(ride_status_changed)(ride, status_value, now))
@@ -0,0 +1,173 @@
+# ride_sharing/authentication.py
+"""
+JWT authentication that does not hit the database on the common path.
+
+Access tokens carry the user's role in a ``role`` claim. ``CachedJWTAuthentication``
+resolves ``request.user`` from a short-TTL in-process cache of the user row and
+its profile, so ``request.user.profile.role`` costs no query either. Saving or
+deleting a User or UserProfile drops the cached entry; a token whose role
+claim no longer matches the user's role is rejected and has to be refreshed.
+"""
+import threading
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .models import UserProfile
+from .ttl_cache import TTLCache
+
+ROLE_CLAIM = 'role'
+
+DEFAULTS = {
+    # Seconds a cached user is trusted. Invalidation is in-process, so this
+    # also bounds how long other processes may serve a changed user.
+    'TTL': 60,
+    'SIZE': 10_000,
+}
+
+_USER_FIELDS = [field.attname for field in User._meta.concrete_fields]
+_PROFILE_FIELDS = [field.attname for field in UserProfile._meta.concrete_fields]
+
+
+def user_cache_settings():
+    return {**DEFAULTS, **getattr(settings, 'JWT_USER_CACHE', {})}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_user_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = user_cache_settings()
+                _cache = TTLCache(maxsize=config['SIZE'], ttl=config['TTL'])
+    return _cache
+
+
+def get_cached_user(user_id):
+    """
+    A fresh ``User`` with ``profile`` attached, built from the cache or one
+    query; None if there is no such user.
+    """
+    cache = get_user_cache()
+    row = cache.get(str(user_id))
+    if row is None:
+        user = User.objects.select_related('profile').filter(pk=user_id).first()
+        if user is None:
+            return None
+        profile = getattr(user, 'profile', None)
+        row = (user._state.db, [getattr(user, name) for name in _USER_FIELDS],
+               None if profile is None else [getattr(profile, name) for name in _PROFILE_FIELDS])
+        cache.set(str(user_id), row)
+    # Each request gets its own instances so nothing is shared across threads.
+    db, user_values, profile_values = row
+    user = User.from_db(db, _USER_FIELDS, user_values)
+    if profile_values is None:
+        User.profile.related.set_cached_value(user, None)
+    else:
+        user.profile = UserProfile.from_db(db, _PROFILE_FIELDS, profile_values)
+    return user
+
+
+def invalidate_user(user_id):
+    get_user_cache().pop(str(user_id))
+    # Again after commit, in case a concurrent request re-cached the old row
+    # before this transaction finished.
+    transaction.on_commit(lambda: get_user_cache().pop(str(user_id)))
+
+
+def user_role(user):
+    try:
+        return user.profile.role
+    except UserProfile.DoesNotExist:
+        return None
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        user = get_cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        # Tokens issued before the role claim existed are still honoured.
+        if ROLE_CLAIM in validated_token and validated_token[ROLE_CLAIM] != user_role(user):
+            raise AuthenticationFailed(_("The user's role has changed."), code="role_changed")
+        return user
+
+
+def authenticate_request(request, query_token=False):
+    """
+    The user behind a plain Django request's JWT, or None, for views outside
+    DRF. With ``query_token`` a ``?token=`` parameter is accepted too, for
+    EventSource clients that cannot set headers.
+    """
+    authentication = CachedJWTAuthentication()
+    try:
+        raw_token = request.GET.get('token') if query_token else None
+        if raw_token:
+            return authentication.get_user(authentication.get_validated_token(raw_token))
+        result = authentication.authenticate(request)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    return result[0] if result else None
+
+
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token[ROLE_CLAIM] = user_role(user)
+        return token
+
+
+class RoleTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        # The refresh token may predate a role change; stamp the current role.
+        access = AccessToken(data['access'])
+        user = get_cached_user(access[api_settings.USER_ID_CLAIM])
+        access[ROLE_CLAIM] = user_role(user) if user is not None else None
+        data['access'] = str(access)
+        return data
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_cached_profile(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
+
+
+@receiver(setting_changed)
+def reset_user_cache(*, setting, **kwargs):
+    global _cache
+    if setting == 'JWT_USER_CACHE':
+        _cache = None
@@ -0,0 +1,140 @@
+# ride_sharing/city_index.py
+import json
+import logging
+import math
+import os
+import pickle
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def point_in_ring(lng, lat, ring):
+    """Even-odd ray casting test against a closed ring of (lng, lat) pairs."""
+    inside = False
+    x1, y1 = ring[-1]
+    for x2, y2 in ring:
+        if (y2 > lat) != (y1 > lat):
+            if lng < (x1 - x2) * (lat - y2) / (y1 - y2) + x2:
+                inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+class CityPolygon:
+    __slots__ = ('city', 'bbox', 'polygons')
+
+    def __init__(self, city, polygons):
+        self.city = city
+        # Each polygon is (exterior_ring, [hole_rings]).
+        self.polygons = polygons
+        xs = [x for exterior, _ in polygons for x, _ in exterior]
+        ys = [y for exterior, _ in polygons for _, y in exterior]
+        self.bbox = (min(xs), min(ys), max(xs), max(ys))
+
+    def contains(self, lng, lat):
+        min_x, min_y, max_x, max_y = self.bbox
+        if not (min_x <= lng <= max_x and min_y <= lat <= max_y):
+            return False
+        for exterior, holes in self.polygons:
+            if point_in_ring(lng, lat, exterior) and not any(point_in_ring(lng, lat, hole) for hole in holes):
+                return True
+        return False
+
+
+class CityIndex:
+    """
+    Point-in-polygon city lookup over a bounding-box grid.
+
+    Every city polygon is registered in each grid cell its bounding box
+    overlaps, so a lookup only tests the handful of cities near the point.
+    """
+
+    def __init__(self, cities, cell_size_deg=0.5):
+        self.cell_size_deg = cell_size_deg
+        self.cities = cities
+        self.cells = {}
+        for position, city in enumerate(cities):
+            min_x, min_y, max_x, max_y = city.bbox
+            for row in range(self._index(min_y), self._index(max_y) + 1):
+                for col in range(self._index(min_x), self._index(max_x) + 1):
+                    self.cells.setdefault((row, col), []).append(position)
+
+    def _index(self, degrees):
+        return math.floor(degrees / self.cell_size_deg)
+
+    def lookup(self, lng, lat):
+        """Return the city containing the point, or None when it is outside every polygon."""
+        for position in self.cells.get((self._index(lat), self._index(lng)), ()):
+            city = self.cities[position]
+            if city.contains(lng, lat):
+                return city.city
+        return None
+
+    @classmethod
+    def from_geojson(cls, data, name_properties=('city', 'name')):
+        cities = []
+        for feature in data.get('features', []):
+            geometry = feature.get('geometry') or {}
+            properties = feature.get('properties') or {}
+            name = next((properties[key] for key in name_properties if properties.get(key)), None)
+            if not name:
+                continue
+            if geometry.get('type') == 'Polygon':
+                raw_polygons = [geometry['coordinates']]
+            elif geometry.get('type') == 'MultiPolygon':
+                raw_polygons = geometry['coordinates']
+            else:
+                continue
+            polygons = [
+                (tuple(map(tuple, rings[0])), [tuple(map(tuple, hole)) for hole in rings[1:]])
+                for rings in raw_polygons if rings
+            ]
+            if polygons:
+                cities.append(CityPolygon(name, polygons))
+        return cls(cities)
+
+    @classmethod
+    def load(cls, path, cache_path=None):
+        """
+        Load an index for a GeoJSON file, reusing a pickled copy when it is
+        newer than the source so workers skip JSON parsing at startup.
+        """
+        cache_path = cache_path or f"{path}.pickle"
+        try:
+            if os.path.getmtime(cache_path) >= os.path.getmtime(path):
+                with open(cache_path, 'rb') as f:
+                    return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            pass
+        with open(path, encoding='utf-8') as f:
+            index = cls.from_geojson(json.load(f))
+        try:
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning("Could not write city index cache %s: %s", cache_path, e)
+        return index
+
+
+class LazyCityIndex:
+    """Defers loading the boundary file until the first lookup."""
+
+    def __init__(self, path, cache_path=None):
+        self.path = path
+        self.cache_path = cache_path
+        self._index = None
+        self._lock = threading.Lock()
+
+    @property
+    def index(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = CityIndex.load(self.path, self.cache_path)
+        return self._index
+
+    def lookup(self, lng, lat):
+        return self.index.lookup(lng, lat)
@@ -0,0 +1,137 @@
+# ride_sharing/driver_index.py
+import heapq
+import math
+import threading
+
+from .geo import KM_PER_DEGREE, haversine_km, point_coordinates
+
+
+class DriverIndex:
+    """
+    In-memory uniform grid over driver positions.
+
+    Drivers are bucketed into square lat/lng cells; a nearest lookup walks
+    rings of cells outward from the query cell and stops once no unvisited
+    ring can hold a closer driver than the k-th best found so far.
+    """
+
+    def __init__(self, cell_size_deg=0.005):
+        self.cell_size_deg = cell_size_deg
+        self._cells = {}
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, driver_id):
+        return driver_id in self._positions
+
+    def _cell(self, lng, lat):
+        return (math.floor(lat / self.cell_size_deg), math.floor(lng / self.cell_size_deg))
+
+    def update(self, driver_id, lng, lat):
+        cell = self._cell(lng, lat)
+        with self._lock:
+            previous = self._positions.get(driver_id)
+            if previous is not None:
+                old_cell = self._cell(*previous)
+                if old_cell != cell:
+                    bucket = self._cells[old_cell]
+                    bucket.discard(driver_id)
+                    if not bucket:
+                        del self._cells[old_cell]
+            self._positions[driver_id] = (lng, lat)
+            self._cells.setdefault(cell, set()).add(driver_id)
+
+    def update_from_geojson(self, driver_id, point):
+        coordinates = point_coordinates(point)
+        if coordinates is None:
+            return False
+        self.update(driver_id, *coordinates)
+        return True
+
+    def remove(self, driver_id):
+        with self._lock:
+            previous = self._positions.pop(driver_id, None)
+            if previous is None:
+                return
+            cell = self._cell(*previous)
+            bucket = self._cells[cell]
+            bucket.discard(driver_id)
+            if not bucket:
+                del self._cells[cell]
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+            self._positions.clear()
+
+    def position(self, driver_id):
+        return self._positions.get(driver_id)
+
+    def nearest(self, lng, lat, k=1, exclude=(), max_radius_km=None):
+        """Return up to k (driver_id, distance_km) pairs ordered by distance."""
+        if k <= 0:
+            return []
+        row, col = self._cell(lng, lat)
+        best = []  # max-heap of (-distance, driver_id)
+
+        def consider(driver_id, d_lng, d_lat):
+            if driver_id in exclude:
+                return
+            distance = haversine_km(lng, lat, d_lng, d_lat)
+            if max_radius_km is not None and distance > max_radius_km:
+                return
+            if len(best) < k:
+                heapq.heappush(best, (-distance, driver_id))
+            elif distance < -best[0][0]:
+                heapq.heapreplace(best, (-distance, driver_id))
+
+        with self._lock:
+            remaining = len(self._positions)
+            cells_visited = 0
+            ring = 0
+            while remaining > 0:
+                gap_km = max(ring - 1, 0) * self._ring_width_km(lat, ring)
+                if max_radius_km is not None and gap_km > max_radius_km:
+                    break
+                # Every driver in this ring or beyond is at least gap_km away.
+                if len(best) == k and gap_km > -best[0][0]:
+                    break
+                if cells_visited > 4 * len(self._cells):
+                    # Sparse neighbourhood: scanning every driver is cheaper
+                    # than walking more empty rings.
+                    best.clear()
+                    for driver_id, (d_lng, d_lat) in self._positions.items():
+                        consider(driver_id, d_lng, d_lat)
+                    break
+                for cell in self._ring_cells(row, col, ring):
+                    cells_visited += 1
+                    bucket = self._cells.get(cell)
+                    if not bucket:
+                        continue
+                    remaining -= len(bucket)
+                    for driver_id in bucket:
+                        consider(driver_id, *self._positions[driver_id])
+                ring += 1
+        return sorted(((driver_id, -neg) for neg, driver_id in best), key=lambda item: item[1])
+
+    def _ring_width_km(self, lat, ring):
+        # Longitude cells shrink towards the poles, so use the narrowest cell
+        # width inside the latitude band covered by this ring.
+        widest_lat = min(89.0, abs(lat) + (ring + 1) * self.cell_size_deg)
+        return self.cell_size_deg * KM_PER_DEGREE * math.cos(math.radians(widest_lat))
+
+    @staticmethod
+    def _ring_cells(row, col, ring):
+        if ring == 0:
+            yield (row, col)
+            return
+        for c in range(col - ring, col + ring + 1):
+            yield (row - ring, c)
+            yield (row + ring, c)
+        for r in range(row - ring + 1, row + ring):
+            yield (r, col - ring)
+            yield (r, col + ring)
+
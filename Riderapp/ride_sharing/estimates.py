@@ -0,0 +1,278 @@
+# ride_sharing/estimates.py
+"""
+Trip duration, distance and fare estimates.
+
+Estimates come from precomputed travel grids where possible: a grid splits
+a city's bounding box into square cells and stores the typical travel time
+and road distance from every cell to every other one, as two float32
+matrices in a file that is memory-mapped rather than read, so workers share
+the pages and start instantly. ``build_travel_grid`` fills one from the
+trails of completed rides. Pairs outside every grid, or between cells no
+trip has connected yet, fall back to the great-circle distance times
+DETOUR_FACTOR at FALLBACK_SPEED_KMH.
+
+Grid file: HEADER, then the seconds matrix, then the kilometres matrix,
+little-endian and row-major by origin cell; NaN marks an unknown pair.
+"""
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .geo import haversine_km, haversine_many, point_coordinates
+from .models import RideTrailSegment
+from .trails import decode_segment
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Grid files, consulted in order; the first one holding both ends wins.
+    'GRIDS': [],
+    'FALLBACK_SPEED_KMH': 25.0,
+    # Road distance over great-circle distance, for the fallback.
+    'DETOUR_FACTOR': 1.3,
+    'BASE_FARE': 50.0,
+    'PER_KM': 12.0,
+    'PER_MINUTE': 1.5,
+    'MINIMUM_FARE': 80.0,
+    'CURRENCY': 'INR',
+    # Most pairs one batch request may ask for.
+    'MAX_BATCH': 1000,
+}
+
+MAGIC = b'RIDEGRD1'
+# magic, min_lng, min_lat, cell_deg, cols, rows
+HEADER = struct.Struct('<8sdddII')
+VALUE = struct.Struct('<f')
+# Two cells**2 float32 matrices: 5000 cells is 200 MB.
+MAX_CELLS = 5000
+
+
+def estimate_settings():
+    return {**DEFAULTS, **getattr(settings, 'RIDE_ESTIMATES', {})}
+
+
+class GridShape:
+    """Square cells of ``cell_deg`` degrees, ``cols`` by ``rows`` from (min_lng, min_lat)."""
+
+    def __init__(self, min_lng, min_lat, cell_deg, cols, rows):
+        self.min_lng, self.min_lat, self.cell_deg = min_lng, min_lat, cell_deg
+        self.cols, self.rows = cols, rows
+        self.cells = cols * rows
+
+    @classmethod
+    def covering(cls, min_lng, min_lat, max_lng, max_lat, cell_deg):
+        return cls(min_lng, min_lat, cell_deg, max(1, math.ceil((max_lng - min_lng) / cell_deg)),
+                   max(1, math.ceil((max_lat - min_lat) / cell_deg)))
+
+    def cell(self, lng, lat):
+        """The index of the cell holding the point, or None outside the grid."""
+        col = math.floor((lng - self.min_lng) / self.cell_deg)
+        row = math.floor((lat - self.min_lat) / self.cell_deg)
+        if 0 <= col < self.cols and 0 <= row < self.rows:
+            return row * self.cols + col
+        return None
+
+
+class TravelGrid(GridShape):
+    """A cell-to-cell travel table, memory-mapped from ``path``."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, *layout = HEADER.unpack_from(self._map)
+        super().__init__(*layout)
+        if magic != MAGIC or len(self._map) != HEADER.size + 2 * self.cells ** 2 * VALUE.size:
+            self._map.close()
+            raise ValueError(f"{path} is not a travel grid")
+        self._km_offset = HEADER.size + self.cells ** 2 * VALUE.size
+
+    def lookup(self, origin, destination):
+        """(seconds, km) between two (lng, lat) points, or None if the grid cannot say."""
+        start, end = self.cell(*origin), self.cell(*destination)
+        if start is None or end is None:
+            return None
+        offset = (start * self.cells + end) * VALUE.size
+        seconds, = VALUE.unpack_from(self._map, HEADER.size + offset)
+        km, = VALUE.unpack_from(self._map, self._km_offset + offset)
+        if math.isnan(seconds) or math.isnan(km):
+            return None
+        return seconds, km
+
+    def close(self):
+        self._map.close()
+
+
+def write_grid(path, shape, travel):
+    """
+    Write a grid file laid out as ``shape`` from ``travel``, {(origin cell,
+    destination cell): (seconds, km)}; other pairs are unknown. The file is
+    replaced atomically so processes that have the old one mapped keep
+    reading it.
+    """
+    if not 0 < shape.cells <= MAX_CELLS:
+        raise ValueError(f"A grid must have between 1 and {MAX_CELLS} cells, not {shape.cells}")
+    by_start = {}
+    for (start, end), values in travel.items():
+        by_start.setdefault(start, []).append((end, values))
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, shape.min_lng, shape.min_lat, shape.cell_deg, shape.cols, shape.rows))
+        for item in (0, 1):
+            for start in range(shape.cells):
+                row = array('f', [math.nan]) * shape.cells
+                for end, values in by_start.get(start, ()):
+                    row[end] = values[item]
+                if sys.byteorder == 'big':
+                    row.byteswap()
+                f.write(row.tobytes())
+    os.replace(tmp_path, path)
+
+
+def trail_travel(grid):
+    """
+    {(origin cell, destination cell): (seconds, km)} averaged over the
+    simplified (completed) trails that start and end inside ``grid``.
+    """
+    totals = {}
+
+    def add(points):
+        if len(points) < 2 or points[-1][2] <= points[0][2]:
+            return
+        key = (grid.cell(*points[0][:2]), grid.cell(*points[-1][:2]))
+        if None in key:
+            return
+        km = sum(haversine_km(*a[:2], *b[:2]) for a, b in zip(points, points[1:]))
+        total = totals.setdefault(key, [0, 0.0, 0.0])
+        total[0] += 1
+        total[1] += points[-1][2] - points[0][2]
+        total[2] += km
+
+    ride_id, points = None, []
+    segments = RideTrailSegment.objects.filter(simplified=True).order_by('ride_id', 'id')
+    for segment in segments.only('ride_id', 'start_ms', 'points').iterator(chunk_size=500):
+        if segment.ride_id != ride_id:
+            add(points)
+            ride_id, points = segment.ride_id, []
+        points.extend(decode_segment(segment))
+    add(points)
+    return {key: (seconds / count, km / count) for key, (count, seconds, km) in totals.items()}
+
+
+def build_grid(path, min_lng, min_lat, max_lng, max_lat, cell_deg):
+    """Build a grid over the box from completed rides' trails; returns how many cell pairs are known."""
+    shape = GridShape.covering(min_lng, min_lat, max_lng, max_lat, cell_deg)
+    if shape.cells > MAX_CELLS:
+        raise ValueError(f"{shape.cells} cells is more than {MAX_CELLS}; use a larger cell size")
+    travel = trail_travel(shape)
+    write_grid(path, shape, travel)
+    return len(travel)
+
+
+class Estimator:
+    def __init__(self, grids, config):
+        self.grids = grids
+        self.config = config
+
+    def lookup(self, origin, destination):
+        for grid in self.grids:
+            found = grid.lookup(origin, destination)
+            if found is not None:
+                return found
+        return None
+
+    def quote(self, seconds, km, source):
+        config = self.config
+        fare = max(config['MINIMUM_FARE'],
+                   config['BASE_FARE'] + config['PER_KM'] * km + config['PER_MINUTE'] * seconds / 60)
+        return {'distance_km': round(km, 2), 'duration_seconds': round(seconds), 'fare': round(fare, 2),
+                'currency': config['CURRENCY'], 'source': source}
+
+    def estimate(self, origin, destination):
+        return self.estimate_many([(origin, destination)])[0]
+
+    def estimate_many(self, pairs):
+        """Estimates for ((lng, lat), (lng, lat)) pairs, in order."""
+        estimates = [None] * len(pairs)
+        fallback = []
+        for index, (origin, destination) in enumerate(pairs):
+            found = self.lookup(origin, destination)
+            if found is None:
+                fallback.append(index)
+            else:
+                estimates[index] = self.quote(*found, 'grid')
+        if fallback:
+            distances = haversine_many([(*pairs[index][0], *pairs[index][1]) for index in fallback])
+            for index, km in zip(fallback, distances):
+                km *= self.config['DETOUR_FACTOR']
+                estimates[index] = self.quote(km / self.config['FALLBACK_SPEED_KMH'] * 3600, km, 'haversine')
+        return estimates
+
+
+def parse_point(value):
+    """(lng, lat) from a GeoJSON Point with valid coordinates, else None."""
+    try:
+        coordinates = point_coordinates(value)
+    except (TypeError, ValueError):
+        return None
+    if coordinates is None or not (-180 <= coordinates[0] <= 180 and -90 <= coordinates[1] <= 90):
+        return None
+    return coordinates
+
+
+def parse_pair(value):
+    """(origin, destination) from {"pickup": Point, "dropoff": Point}, else None."""
+    if not isinstance(value, dict):
+        return None
+    origin, destination = parse_point(value.get('pickup')), parse_point(value.get('dropoff'))
+    return None if origin is None or destination is None else (origin, destination)
+
+
+def ride_estimate(data, ride):
+    """
+    The estimate for a ride being created from request ``data``: its
+    ``dropoff_point`` and its ``pickup_point`` or else its current location.
+    None unless both ends are known.
+    """
+    if not isinstance(data, dict):
+        return None
+    origin = parse_point(data.get('pickup_point')) or parse_point(ride.current_location)
+    destination = parse_point(data.get('dropoff_point'))
+    if origin is None or destination is None:
+        return None
+    return get_estimator().estimate(origin, destination)
+
+
+_estimator = None
+_lock = threading.Lock()
+
+
+def get_estimator():
+    global _estimator
+    if _estimator is None:
+        with _lock:
+            if _estimator is None:
+                config = estimate_settings()
+                grids = []
+                for path in config['GRIDS']:
+                    try:
+                        grids.append(TravelGrid(path))
+                    except (OSError, ValueError, struct.error) as e:
+                        logger.warning("Skipping travel grid %s: %s", path, e)
+                _estimator = Estimator(grids, config)
+    return _estimator
+
+
+@receiver(setting_changed)
+def reset_estimator(*, setting, **kwargs):
+    global _estimator
+    if setting == 'RIDE_ESTIMATES':
+        _estimator = None
@@ -0,0 +1,115 @@
+# ride_sharing/events.py
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+def ride_channel(ride_id):
+    return f"ride:{ride_id}"
+
+
+class Subscription:
+    """
+    One subscriber's bounded event queue, bound to the event loop that created it.
+
+    ``deliver`` may be called from any thread; when the queue is full the
+    oldest event is dropped so a slow client cannot hold memory or block
+    publishers.
+    """
+
+    def __init__(self, broker, channel, maxsize=100):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def deliver(self, event):
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        """Wait for the next event; returns None if ``timeout`` elapses first."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """Fan-out pub/sub inside one process; subscribers only see events published in it."""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel, maxsize=100):
+        subscription = Subscription(self, channel, maxsize)
+        with self._lock:
+            self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def subscriber_count(self, channel):
+        return len(self._subscribers.get(channel, ()))
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.deliver(event)
+            except RuntimeError:
+                # The subscriber's event loop has gone away.
+                self.unsubscribe(subscription)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """
+    Return the process-wide broker. RIDE_EVENTS_BROKER may name another class
+    with the same publish/subscribe/unsubscribe interface, e.g. one backed by
+    a shared message bus for multi-process deployments.
+    """
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                path = getattr(settings, 'RIDE_EVENTS_BROKER', 'ride_sharing.events.InProcessBroker')
+                _broker = import_string(path)()
+    return _broker
+
+
+def publish_ride_event(ride_id, event_type, data):
+    """Publish an event to a ride's subscribers once the current transaction commits."""
+    event = {'type': event_type, 'ride_id': ride_id, 'data': data}
+    transaction.on_commit(lambda: get_broker().publish(ride_channel(ride_id), event))
+
+
+@receiver(setting_changed)
+def reset_broker(*, setting, **kwargs):
+    global _broker
+    if setting == 'RIDE_EVENTS_BROKER':
+        _broker = None
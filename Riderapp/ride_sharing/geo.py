@@ -0,0 +1,125 @@
+# ride_sharing/geo.py
+import math
+
+try:
+    import numpy
+except ImportError:  # optional speed-up for haversine_many
+    numpy = None
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def point_coordinates(point):
+    """Return (lng, lat) from a GeoJSON Point dict, or None if it is not one."""
+    if not isinstance(point, dict) or point.get('type') != 'Point':
+        return None
+    coordinates = point.get('coordinates') or []
+    if len(coordinates) != 2:
+        return None
+    lng, lat = coordinates
+    return float(lng), float(lat)
+
+
+def haversine_km(lng1, lat1, lng2, lat2):
+    """Great-circle distance in kilometres between two lng/lat pairs."""
+    lng1, lat1, lng2, lat2 = map(math.radians, (lng1, lat1, lng2, lat2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def haversine_many(pairs):
+    """
+    ``haversine_km`` for a sequence of (lng1, lat1, lng2, lat2) tuples, as a
+    list. Computed as arrays in one pass when numpy is installed.
+    """
+    if numpy is None or len(pairs) < 16:
+        return [haversine_km(*pair) for pair in pairs]
+    lng1, lat1, lng2, lat2 = numpy.radians(numpy.asarray(pairs, dtype=float)).T
+    a = (numpy.sin((lat2 - lat1) / 2) ** 2
+         + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lng2 - lng1) / 2) ** 2)
+    return (2 * EARTH_RADIUS_KM * numpy.arcsin(numpy.minimum(1.0, numpy.sqrt(a)))).tolist()
+
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9  # ~5 m cells
+
+
+def geohash_encode(lng, lat, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        interval, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (interval[0] + interval[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            interval[0] = mid
+        else:
+            bits <<= 1
+            interval[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def bounding_box(lng, lat, radius_km):
+    """
+    Return (min_lng, min_lat, max_lng, max_lat) enclosing a circle.
+
+    When the box crosses the antimeridian min_lng is greater than max_lng.
+    """
+    lat_delta = radius_km / KM_PER_DEGREE
+    min_lat, max_lat = max(-90.0, lat - lat_delta), min(90.0, lat + lat_delta)
+    if min_lat == -90.0 or max_lat == 90.0:
+        return -180.0, min_lat, 180.0, max_lat
+    lng_delta = math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(lat)))))
+    min_lng, max_lng = lng - lng_delta, lng + lng_delta
+    if lng_delta >= 180.0:
+        return -180.0, min_lat, 180.0, max_lat
+    if min_lng < -180.0:
+        min_lng += 360.0
+    if max_lng > 180.0:
+        max_lng -= 360.0
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def simplify_path(points, tolerance_m):
+    """
+    Douglas–Peucker simplification of (lng, lat, ...) points: drop every point
+    within ``tolerance_m`` metres of the line through the points kept around
+    it. The first and last points are always kept; extra tuple items ride along.
+    """
+    if len(points) < 3:
+        return list(points)
+    # Equirectangular metres around the path's first point; plenty accurate
+    # over the few kilometres between kept points.
+    metres_per_degree = KM_PER_DEGREE * 1000
+    lng_scale = metres_per_degree * math.cos(math.radians(points[0][1]))
+    xy = [(point[0] * lng_scale, point[1] * metres_per_degree) for point in points]
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = xy[first], xy[last]
+        dx, dy = x2 - x1, y2 - y1
+        length = math.hypot(dx, dy)
+        farthest, distance = None, tolerance_m
+        for index in range(first + 1, last):
+            x, y = xy[index]
+            if length == 0:
+                offset = math.hypot(x - x1, y - y1)
+            else:
+                offset = abs(dy * (x - x1) - dx * (y - y1)) / length
+            if offset > distance:
+                farthest, distance = index, offset
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [point for point, kept in zip(points, keep) if kept]
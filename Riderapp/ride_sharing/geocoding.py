@@ -0,0 +1,248 @@
+# ride_sharing/geocoding.py
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+
+from .city_index import LazyCityIndex
+from .instrumentation import external_call
+from .models import Ride
+from .ride_cache import invalidate_ride
+from .ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_CITY = 'Unknown'
+
+DEFAULTS = {
+    'BACKEND': 'ride_sharing.geocoding.GeoapifyGeocoder',
+    'OPTIONS': {},
+    'CACHE_SIZE': 10_000,
+    'CACHE_TTL': 24 * 60 * 60,
+    # Decimal places kept in the cache key; 3 places is roughly 110 m.
+    'PRECISION': 3,
+    'ASYNC': False,
+    'WORKERS': 4,
+    # Optional GeoJSON of service-city polygons answered offline before any
+    # HTTP lookup; CITY_INDEX_CACHE defaults to '<CITY_BOUNDARIES>.pickle'.
+    'CITY_BOUNDARIES': None,
+    'CITY_INDEX_CACHE': None,
+}
+
+
+class Geocoder:
+    """Resolves a city name for a coordinate pair."""
+
+    def reverse(self, longitude, latitude):
+        raise NotImplementedError
+
+    async def areverse(self, longitude, latitude):
+        """``reverse`` for async views; backends that can, override it to avoid a thread."""
+        return await sync_to_async(self.reverse, thread_sensitive=False)(longitude, latitude)
+
+
+class GeoapifyGeocoder(Geocoder):
+    url = 'https://api.geoapify.com/v1/geocode/reverse'
+
+    def __init__(self, api_key=None, timeout=5, pool_size=10):
+        self.api_key = api_key or settings.GEOAPIFY_API_KEY
+        self.timeout = timeout
+        self.pool_size = pool_size
+        # One pooled session per process keeps TLS connections to the API warm.
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        # httpx clients belong to the event loop that opened them; one per loop.
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def params(self, longitude, latitude):
+        return {'lat': latitude, 'lon': longitude, 'apiKey': self.api_key}
+
+    def city_from(self, data):
+        # Extract city from the first result
+        features = data.get('features', [])
+        if features:
+            city = features[0].get('properties', {}).get('city', '')
+            return city if city else UNKNOWN_CITY
+        return UNKNOWN_CITY
+
+    def reverse(self, longitude, latitude):
+        try:
+            with external_call('geoapify'):
+                response = self.session.get(self.url, params=self.params(longitude, latitude),
+                                            timeout=self.timeout)
+            response.raise_for_status()
+            return self.city_from(response.json())
+        except requests.RequestException as e:
+            logger.warning("Reverse geocoding error: %s", e)
+            return None
+
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            client = self._async_clients[loop] = httpx.AsyncClient(timeout=self.timeout, limits=limits)
+        return client
+
+    async def areverse(self, longitude, latitude):
+        try:
+            with external_call('geoapify'):
+                response = await self.async_client().get(self.url, params=self.params(longitude, latitude))
+            response.raise_for_status()
+            return self.city_from(response.json())
+        except (httpx.HTTPError, ValueError) as e:
+            logger.warning("Reverse geocoding error: %s", e)
+            return None
+
+
+class FakeGeocoder(Geocoder):
+    """Offline geocoder for tests and local development."""
+
+    def __init__(self, city='Testville', cities=None, delay=0):
+        self.city = city
+        # Optional {(round(lng, 3), round(lat, 3)): city} overrides.
+        self.cities = cities or {}
+        # Seconds each lookup takes, to stand in for a slow API in benchmarks.
+        self.delay = delay
+        self.calls = 0
+
+    def reverse(self, longitude, latitude):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return self.cities.get((round(longitude, 3), round(latitude, 3)), self.city)
+
+    async def areverse(self, longitude, latitude):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return self.cities.get((round(longitude, 3), round(latitude, 3)), self.city)
+
+
+class CachedGeocoder(Geocoder):
+    """
+    Wraps a backend with a TTL/LRU cache keyed on rounded coordinates.
+
+    When a local city index is given it is consulted first, so points inside
+    known service cities never reach the cache or the backend.
+    """
+
+    def __init__(self, backend, maxsize, ttl, precision, city_index=None):
+        self.backend = backend
+        self.precision = precision
+        self.cache = TTLCache(maxsize, ttl)
+        self.city_index = city_index
+
+    def key(self, longitude, latitude):
+        return (round(longitude, self.precision), round(latitude, self.precision))
+
+    def cached(self, longitude, latitude):
+        """Return the city from the local index or cache, or None without calling the backend."""
+        if self.city_index is not None:
+            city = self.city_index.lookup(longitude, latitude)
+            if city is not None:
+                return city
+        return self.cache.get(self.key(longitude, latitude))
+
+    def fill(self, longitude, latitude):
+        """Call the backend and cache its answer, skipping the cache lookup."""
+        return self.store(longitude, latitude, self.backend.reverse(longitude, latitude))
+
+    async def afill(self, longitude, latitude):
+        return self.store(longitude, latitude, await self.backend.areverse(longitude, latitude))
+
+    def store(self, longitude, latitude, city):
+        if city is None:
+            # Transient failure: answer Unknown but let the next ping retry.
+            return UNKNOWN_CITY
+        self.cache.set(self.key(longitude, latitude), city)
+        return city
+
+    def reverse(self, longitude, latitude):
+        city = self.cached(longitude, latitude)
+        if city is None:
+            city = self.fill(longitude, latitude)
+        return city
+
+    async def areverse(self, longitude, latitude):
+        city = self.cached(longitude, latitude)
+        if city is None:
+            city = await self.afill(longitude, latitude)
+        return city
+
+
+class BackgroundCityResolver:
+    """Resolves cities on a thread pool and writes them to Ride.city afterwards."""
+
+    def __init__(self, geocoder, workers):
+        self.geocoder = geocoder
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='geocoding')
+
+    def submit(self, ride_id, longitude, latitude):
+        return self.executor.submit(self._resolve, ride_id, longitude, latitude)
+
+    def _resolve(self, ride_id, longitude, latitude):
+        close_old_connections()
+        try:
+            city = self.geocoder.fill(longitude, latitude)
+            Ride.objects.filter(pk=ride_id).update(city=city, updated_at=timezone.now())
+            invalidate_ride(ride_id)
+            return city
+        except Exception:
+            logger.exception("Background city resolution failed for ride %s", ride_id)
+        finally:
+            close_old_connections()
+
+
+def geocoding_settings():
+    return {**DEFAULTS, **getattr(settings, 'GEOCODING', {})}
+
+
+_geocoder = None
+_resolver = None
+_lock = threading.Lock()
+
+
+def get_geocoder():
+    global _geocoder
+    if _geocoder is None:
+        with _lock:
+            if _geocoder is None:
+                config = geocoding_settings()
+                backend = import_string(config['BACKEND'])(**config['OPTIONS'])
+                city_index = None
+                if config['CITY_BOUNDARIES']:
+                    city_index = LazyCityIndex(config['CITY_BOUNDARIES'], config['CITY_INDEX_CACHE'])
+                _geocoder = CachedGeocoder(backend, config['CACHE_SIZE'], config['CACHE_TTL'], config['PRECISION'],
+                                           city_index=city_index)
+    return _geocoder
+
+
+def get_city_resolver():
+    global _resolver
+    if _resolver is None:
+        with _lock:
+            if _resolver is None:
+                _resolver = BackgroundCityResolver(get_geocoder(), geocoding_settings()['WORKERS'])
+    return _resolver
+
+
+@receiver(setting_changed)
+def reset_geocoder(*, setting, **kwargs):
+    global _geocoder, _resolver
+    if setting in ('GEOCODING', 'GEOAPIFY_API_KEY'):
+        _geocoder = None
+        _resolver = None
@@ -0,0 +1,204 @@
+# ride_sharing/heatmap.py
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+
+from .geo import geohash_encode
+
+DEFAULTS = {
+    # Sliding window length in seconds and the number of ring-buffer slots in it.
+    'WINDOW': 15 * 60,
+    'BUCKETS': 15,
+    # Geohash length of a heatmap cell; 6 is roughly 1.2 km x 0.6 km.
+    'CELL_PRECISION': 6,
+}
+
+UNKNOWN = 'Unknown'
+
+
+class SlidingWindowCounter:
+    """Event count over the last ``window`` seconds, kept in a fixed ring of time buckets."""
+
+    __slots__ = ('width', 'counts', 'stamps')
+
+    def __init__(self, window, buckets):
+        self.width = window / buckets
+        self.counts = [0] * buckets
+        self.stamps = [-1] * buckets
+
+    def add(self, now, amount=1):
+        tick = int(now // self.width)
+        slot = tick % len(self.counts)
+        if self.stamps[slot] != tick:
+            self.stamps[slot] = tick
+            self.counts[slot] = 0
+        self.counts[slot] += amount
+
+    def total(self, now):
+        oldest = int(now // self.width) - len(self.counts)
+        return sum(count for count, stamp in zip(self.counts, self.stamps) if stamp > oldest)
+
+
+class DemandHeatmap:
+    """
+    Incremental supply/demand counters per city and per geocell.
+
+    Ride requests and acceptances go into sliding-window ring buffers. Driver
+    supply is the number of distinct available drivers last seen in each area
+    within the window. Reading a snapshot costs O(areas), never O(rides).
+    """
+
+    def __init__(self, window, buckets, cell_precision, clock=time.time):
+        self.window = window
+        self.buckets = buckets
+        self.cell_precision = cell_precision
+        self.clock = clock
+        self._requested = {}
+        self._accepted = {}
+        self._supply = defaultdict(int)
+        # driver_id -> (areas, last_seen), oldest sighting first.
+        self._drivers = OrderedDict()
+        # Last city seen for each cell, so cells can be filtered by city and
+        # city-less events (e.g. driver heartbeats) still land in a city.
+        self._cell_city = {}
+        self._lock = threading.Lock()
+
+    def cell(self, lng, lat):
+        return geohash_encode(lng, lat, self.cell_precision)
+
+    def _areas(self, city, lng=None, lat=None):
+        if lng is None or lat is None:
+            return [('city', city or UNKNOWN)]
+        cell = self.cell(lng, lat)
+        if city:
+            self._cell_city[cell] = city
+        else:
+            city = self._cell_city.get(cell, UNKNOWN)
+        return [('city', city), ('cell', cell)]
+
+    def _bump(self, counters, areas, now):
+        for area in areas:
+            counter = counters.get(area)
+            if counter is None:
+                counter = counters[area] = SlidingWindowCounter(self.window, self.buckets)
+            counter.add(now)
+
+    def record_request(self, city, lng=None, lat=None):
+        with self._lock:
+            self._bump(self._requested, self._areas(city, lng, lat), self.clock())
+
+    def record_acceptance(self, city, lng=None, lat=None):
+        with self._lock:
+            self._bump(self._accepted, self._areas(city, lng, lat), self.clock())
+
+    def record_driver(self, driver_id, lng, lat, available, city=None):
+        """Place a driver in the area of their latest position; busy drivers are not supply."""
+        now = self.clock()
+        with self._lock:
+            self._forget_driver(driver_id)
+            if available:
+                areas = self._areas(city, lng, lat)
+                self._drivers[driver_id] = (areas, now)
+                for area in areas:
+                    self._supply[area] += 1
+
+    def _forget_driver(self, driver_id):
+        previous = self._drivers.pop(driver_id, None)
+        if previous is None:
+            return
+        for area in previous[0]:
+            self._supply[area] -= 1
+            if not self._supply[area]:
+                del self._supply[area]
+
+    def _expire_drivers(self, now):
+        cutoff = now - self.window
+        while self._drivers:
+            driver_id, (_, last_seen) = next(iter(self._drivers.items()))
+            if last_seen > cutoff:
+                break
+            self._forget_driver(driver_id)
+
+    def snapshot(self, level='cell', city=None):
+        """Current counters for every area of ``level``; optionally only cells seen in ``city``."""
+        now = self.clock()
+        with self._lock:
+            self._expire_drivers(now)
+            names = {name for kind, name in (*self._requested, *self._accepted, *self._supply) if kind == level}
+            rows = []
+            for name in names:
+                area = (level, name)
+                requested = self._total(self._requested, area, now)
+                accepted = self._total(self._accepted, area, now)
+                drivers = self._supply.get(area, 0)
+                if not (requested or accepted or drivers):
+                    continue
+                open_requests = max(requested - accepted, 0)
+                rows.append({
+                    'city': name if level == 'city' else self._cell_city.get(name, UNKNOWN),
+                    **({'cell': name} if level == 'cell' else {}),
+                    'requested': requested,
+                    'accepted': accepted,
+                    'open_requests': open_requests,
+                    'available_drivers': drivers,
+                    'demand_ratio': round(open_requests / max(drivers, 1), 3),
+                })
+        if city:
+            rows = [row for row in rows if row['city'] == city]
+        return sorted(rows, key=lambda row: row['demand_ratio'], reverse=True)
+
+    def _total(self, counters, area, now):
+        counter = counters.get(area)
+        if counter is None:
+            return 0
+        total = counter.total(now)
+        if not total:
+            # Every bucket has aged out; drop the area so reads stay O(live areas).
+            del counters[area]
+        return total
+
+    def clear(self):
+        with self._lock:
+            self._requested.clear()
+            self._accepted.clear()
+            self._supply.clear()
+            self._drivers.clear()
+            self._cell_city.clear()
+
+
+def heatmap_settings():
+    return {**DEFAULTS, **getattr(settings, 'HEATMAP', {})}
+
+
+_heatmap = None
+_heatmap_lock = threading.Lock()
+
+
+def get_heatmap():
+    global _heatmap
+    if _heatmap is None:
+        with _heatmap_lock:
+            if _heatmap is None:
+                config = heatmap_settings()
+                _heatmap = DemandHeatmap(config['WINDOW'], config['BUCKETS'], config['CELL_PRECISION'])
+    return _heatmap
+
+
+def record_ride_event(kind, ride):
+    """Count a 'request' or 'acceptance' for the ride's city and cell once the transaction commits."""
+    city, lng, lat = ride.city, ride.longitude, ride.latitude
+    heatmap = get_heatmap()
+    record = heatmap.record_request if kind == 'request' else heatmap.record_acceptance
+    transaction.on_commit(lambda: record(city, lng, lat))
+
+
+@receiver(setting_changed)
+def reset_heatmap(*, setting, **kwargs):
+    global _heatmap
+    if setting == 'HEATMAP':
+        _heatmap = None
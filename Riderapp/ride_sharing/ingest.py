@@ -0,0 +1,271 @@
+# ride_sharing/ingest.py
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.db.models import Q
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .events import publish_ride_event
+from .geocoding import get_city_resolver, get_geocoder
+from .heatmap import get_heatmap
+from .models import ACTIVE_STATUSES, Ride
+from .presence import BUSY, ONLINE, get_presence_registry
+from .ride_cache import invalidate_rides
+from .serializers import render_ride
+from .trails import append_trails, simplify_trail
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Flush once this many rides have a pending position...
+    'MAX_BATCH': 5000,
+    # ...or once the oldest pending position is this many seconds old.
+    'MAX_DELAY': 1.0,
+    # Run a daemon thread that enforces MAX_DELAY while traffic is quiet.
+    'BACKGROUND_FLUSH': True,
+    # Points timestamped more than this many seconds in the past, or ahead
+    # of the server clock, are rejected.
+    'MAX_POINT_AGE': 24 * 60 * 60,
+    'MAX_CLOCK_SKEW': 5 * 60,
+}
+
+
+class LocationBuffer:
+    """
+    Coalesces GPS pings in memory and writes only the newest position per
+    ride, in one bulk_update per flush. Every point still reaches the ride's
+    trail, appended in bulk at the same flush.
+    """
+
+    def __init__(self, max_batch, max_delay, background_flush=False):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.background_flush = background_flush
+        self._pending = {}
+        # Every buffered point per ride, for the trail store.
+        self._trail = {}
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, points):
+        """
+        Buffer (ride_id, lng, lat, ts) tuples, keeping the latest ts per ride.
+        Flushes inline when a threshold is crossed.
+        """
+        with self._lock:
+            for ride_id, lng, lat, ts in points:
+                self._trail.setdefault(ride_id, []).append((lng, lat, ts))
+                current = self._pending.get(ride_id)
+                if current is None or ts >= current[0]:
+                    self._pending[ride_id] = (ts, lng, lat)
+            if self._pending and self._oldest is None:
+                self._oldest = time.monotonic()
+            due = self._due()
+        if self.background_flush:
+            self._ensure_thread()
+        if due:
+            self.flush()
+
+    def clear(self):
+        """Drop the buffered points without writing them."""
+        with self._lock:
+            self._pending, self._trail, self._oldest = {}, {}, None
+
+    def _due(self):
+        return bool(self._pending) and (
+            len(self._pending) >= self.max_batch
+            or time.monotonic() - self._oldest >= self.max_delay
+        )
+
+    def flush(self, ride_ids=None):
+        """
+        Write the buffered positions, or only those of ``ride_ids``; returns
+        the number of rides updated.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if ride_ids is None:
+                    pending, self._pending, self._oldest = self._pending, {}, None
+                    trail, self._trail = self._trail, {}
+                else:
+                    pending = {ride_id: self._pending.pop(ride_id) for ride_id in ride_ids
+                               if ride_id in self._pending}
+                    trail = {ride_id: self._trail.pop(ride_id) for ride_id in pending}
+                    if not self._pending:
+                        self._oldest = None
+            if not pending:
+                return 0
+            geocoder = get_geocoder()
+            resolve_later = []
+            # Full rows, so the location event carries the same ride dict as
+            # RideLocationUpdateView's; only the location columns are written.
+            rides = list(Ride.objects.with_related().filter(pk__in=list(pending)))
+            now = timezone.now()
+            for ride in rides:
+                _, lng, lat = pending[ride.pk]
+                ride.set_location(lng, lat)
+                ride.updated_at = now
+                # Never block a flush on HTTP: take the city from the local
+                # index or cache and resolve misses in the background.
+                city = geocoder.cached(lng, lat)
+                if city is not None:
+                    ride.city = city
+                else:
+                    resolve_later.append((ride.pk, lng, lat))
+            Ride.objects.bulk_update(rides, [*Ride.LOCATION_FIELDS, 'city', 'updated_at'])
+            invalidate_rides([ride.pk for ride in rides])
+            append_trails({ride.pk: trail[ride.pk] for ride in rides})
+            for ride in rides:
+                publish_ride_event(ride.pk, 'location', render_ride(ride))
+            if resolve_later:
+                resolver = get_city_resolver()
+                for ride_id, lng, lat in resolve_later:
+                    resolver.submit(ride_id, lng, lat)
+            return len(rides)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='location-flush', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.max_delay)
+            with self._lock:
+                due = self._due()
+            if not due:
+                continue
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Location buffer flush failed")
+            finally:
+                close_old_connections()
+
+
+def ingest_settings():
+    return {**DEFAULTS, **getattr(settings, 'LOCATION_INGEST', {})}
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_location_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                config = ingest_settings()
+                _buffer = LocationBuffer(config['MAX_BATCH'], config['MAX_DELAY'], config['BACKGROUND_FLUSH'])
+    return _buffer
+
+
+def parse_point(raw, now, earliest, latest):
+    """
+    Turn one {ride_id, lng, lat, ts} dict into a tuple, or None if it is
+    malformed or its ts falls outside [earliest, latest]. A missing ts is
+    ``now``.
+    """
+    try:
+        ride_id = raw['ride_id']
+        lng, lat = float(raw['lng']), float(raw['lat'])
+        ts = now if raw.get('ts') is None else float(raw['ts'])
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
+    if isinstance(ride_id, bool) or not isinstance(ride_id, int):
+        return None
+    if not (-180 <= lng <= 180 and -90 <= lat <= 90):
+        return None
+    # Also rejects NaN and infinity, which the trail store cannot pack.
+    if not earliest <= ts <= latest:
+        return None
+    return ride_id, lng, lat, ts
+
+
+def parse_points(raw_points):
+    """The well-formed points of a batch as (ride_id, lng, lat, ts) tuples."""
+    config = ingest_settings()
+    now = time.time()
+    earliest, latest = now - config['MAX_POINT_AGE'], now + config['MAX_CLOCK_SKEW']
+    points = (parse_point(raw, now, earliest, latest) for raw in raw_points)
+    return [point for point in points if point is not None]
+
+
+def ingest_points(user, points):
+    """
+    Buffer the points that belong to rides ``user`` is riding or driving.
+
+    Ownership is checked with one query for the whole batch. Returns the
+    number of points accepted.
+    """
+    ride_ids = {point[0] for point in points}
+    rides = dict(
+        (ride_id, (driver_id, ride_status)) for ride_id, driver_id, ride_status in
+        Ride.objects.filter(Q(driver=user) | Q(rider=user), pk__in=ride_ids)
+        .values_list('id', 'driver_id', 'status')
+    )
+    accepted = [point for point in points if point[0] in rides]
+    if not accepted:
+        return 0
+    # The latest ping from a ride's driver doubles as their presence heartbeat.
+    latest = max((point for point in accepted if rides[point[0]][0] == user.id), key=lambda p: p[3], default=None)
+    if latest is not None:
+        state = BUSY if rides[latest[0]][1] in ACTIVE_STATUSES else ONLINE
+        get_presence_registry().heartbeat(user.id, latest[1], latest[2], state=state)
+        get_heatmap().record_driver(user.id, latest[1], latest[2], available=state == ONLINE)
+    get_location_buffer().add(accepted)
+    return len(accepted)
+
+
+_trail_executor = None
+
+
+def get_trail_executor():
+    """One background thread for trail simplification, so completed trips queue rather than compete."""
+    global _trail_executor
+    if _trail_executor is None:
+        with _buffer_lock:
+            if _trail_executor is None:
+                _trail_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='trails')
+    return _trail_executor
+
+
+def _simplify_trail(ride_id):
+    close_old_connections()
+    try:
+        return simplify_trail(ride_id)
+    except Exception:
+        logger.exception("Trail simplification failed for ride %s", ride_id)
+    finally:
+        close_old_connections()
+
+
+def finish_trail(ride_id):
+    """
+    Write the ride's buffered points, then simplify its trail in the
+    background; run once the trip is COMPLETED.
+    """
+    get_location_buffer().flush(ride_ids=[ride_id])
+    return get_trail_executor().submit(_simplify_trail, ride_id)
+
+
+@receiver(setting_changed)
+def reset_location_buffer(*, setting, **kwargs):
+    global _buffer
+    if setting == 'LOCATION_INGEST':
+        _buffer = None
@@ -0,0 +1,320 @@
+# ride_sharing/instrumentation.py
+"""
+Opt-in request instrumentation.
+
+``InstrumentationMiddleware`` records per-view wall time, SQL query count and
+time, and the time spent in sections marked with ``timed()`` or
+``external_call()``. The numbers are kept in ``metrics`` and served in the
+Prometheus text format by ``MetricsView``. With ``INSTRUMENTATION['ENABLED']``
+off the middleware removes itself and the hooks cost one context-variable
+lookup.
+"""
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views import View
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    # Fraction of requests run under cProfile.
+    'PROFILE_SAMPLE_RATE': 0.0,
+    # A request carrying this header is profiled when the value matches
+    # PROFILE_TOKEN; without a token the header is ignored.
+    'PROFILE_HEADER': 'X-Profile',
+    'PROFILE_TOKEN': None,
+    # Where .prof files go; without it the top functions are logged instead.
+    'PROFILE_DIR': None,
+    'PROFILE_TOP': 25,
+    'METRICS_ALLOWED_IPS': ['127.0.0.1', '::1'],
+}
+
+# Seconds; spans sub-millisecond cache hits to multi-second external calls.
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+
+def instrumentation_settings():
+    return {**DEFAULTS, **getattr(settings, 'INSTRUMENTATION', {})}
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = defaultdict(float)
+        self._histograms = {}
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name, labels=(), amount=1):
+        with self._lock:
+            self._counters[name, labels] += amount
+
+    def observe(self, name, value, labels=(), buckets=DURATION_BUCKETS):
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[name, labels] = Histogram(buckets)
+            histogram.observe(value)
+
+    def value(self, name, labels=()):
+        """Counter value, or a histogram's observation count."""
+        with self._lock:
+            if (name, labels) in self._histograms:
+                return self._histograms[name, labels].count
+            return self._counters.get((name, labels), 0)
+
+    def render(self):
+        with self._lock:
+            series = defaultdict(list)
+            for (name, labels), value in self._counters.items():
+                series[name].append(f'{name}{_labels(labels)} {value:g}')
+            for (name, labels), histogram in self._histograms.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    series[name].append(f'{name}_bucket{_labels(labels, [("le", f"{bound:g}")])} {cumulative}')
+                series[name].append(f'{name}_bucket{_labels(labels, [("le", "+Inf")])} {histogram.count}')
+                series[name].append(f'{name}_sum{_labels(labels)} {histogram.sum:g}')
+                series[name].append(f'{name}_count{_labels(labels)} {histogram.count}')
+        lines = []
+        for name in sorted(series):
+            kind, help_text = self._help.get(name, ('untyped', ''))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(sorted(series[name]))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+metrics = MetricsRegistry()
+metrics.describe('ride_http_requests_total', 'counter', 'Requests by view, method and status code.')
+metrics.describe('ride_http_request_duration_seconds', 'histogram', 'Wall time per request by view.')
+metrics.describe('ride_db_queries_per_request', 'histogram', 'SQL queries issued per request by view.')
+metrics.describe('ride_db_query_seconds_total', 'counter', 'Time spent executing SQL by view.')
+metrics.describe('ride_section_duration_seconds', 'histogram', 'Time in timed() sections by view and section.')
+metrics.describe('ride_external_call_duration_seconds', 'histogram', 'Time in calls to external services.')
+metrics.describe('ride_profiled_requests_total', 'counter', 'Requests captured with cProfile by view.')
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_seconds', 'sections')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.sections = defaultdict(float)
+
+
+_current = ContextVar('ride_request_stats', default=None)
+_NOOP = nullcontext()
+
+
+class _Section:
+    __slots__ = ('stats', 'name', 'service', 'started')
+
+    def __init__(self, stats, name, service=None):
+        self.stats = stats
+        self.name = name
+        self.service = service
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.started
+        self.stats.sections[self.name] += elapsed
+        if self.service is not None:
+            metrics.observe('ride_external_call_duration_seconds', elapsed, (('service', self.service),))
+
+
+def timed(section):
+    """Context manager adding the block's wall time to ``section`` of the current request."""
+    stats = _current.get()
+    if stats is None:
+        return _NOOP
+    return _Section(stats, section)
+
+
+def external_call(service):
+    """Like ``timed`` for a call to an external service; also feeds the per-service histogram."""
+    stats = _current.get()
+    if stats is None:
+        return _NOOP
+    return _Section(stats, f'external:{service}', service)
+
+
+def _time_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_seconds += time.perf_counter() - started
+
+
+def _install_query_timer(sender=None, connection=connection, **kwargs):
+    # The wrapper lives on the thread's DatabaseWrapper and survives
+    # reconnects, so installing it once per connection object is enough.
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+def _view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unresolved'
+
+
+class InstrumentationMiddleware:
+    """
+    Record wall time, SQL and timed sections for every request, and run a
+    sample of requests (or those asking via the profile header) under cProfile.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = instrumentation_settings()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.config = config
+        self.header = 'HTTP_' + config['PROFILE_HEADER'].upper().replace('-', '_')
+        connection_created.connect(_install_query_timer, dispatch_uid='ride_instrumentation')
+        _install_query_timer()
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            if self.should_profile(request):
+                response = self.profile(request)
+            else:
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        # cProfile only sees the calling thread, so async requests are timed but never profiled.
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def should_profile(self, request):
+        requested = request.META.get(self.header)
+        if requested:
+            expected = self.config['PROFILE_TOKEN']
+            if expected and hmac.compare_digest(requested, expected):
+                return True
+        rate = self.config['PROFILE_SAMPLE_RATE']
+        return rate > 0 and random.random() < rate
+
+    def profile(self, request):
+        profiler = cProfile.Profile()
+        response = profiler.runcall(self.get_response, request)
+        view = _view_label(request)
+        metrics.inc('ride_profiled_requests_total', (('view', view),))
+        directory = self.config['PROFILE_DIR']
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{view.replace(':', '_')}-{time.time_ns()}.prof")
+            profiler.dump_stats(path)
+            response['X-Profile-File'] = os.path.basename(path)
+        else:
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(self.config['PROFILE_TOP'])
+            logger.info("Profile of %s %s:\n%s", request.method, request.path, out.getvalue())
+        return response
+
+    def record(self, request, response, stats, elapsed):
+        view = (('view', _view_label(request)),)
+        metrics.inc('ride_http_requests_total', (*view, ('method', request.method),
+                                                 ('status', response.status_code)))
+        metrics.observe('ride_http_request_duration_seconds', elapsed, view)
+        metrics.observe('ride_db_queries_per_request', stats.queries, view, buckets=QUERY_COUNT_BUCKETS)
+        metrics.inc('ride_db_query_seconds_total', view, stats.db_seconds)
+        timings = [f'total;dur={elapsed * 1000:.1f}', f'db;dur={stats.db_seconds * 1000:.1f}']
+        for section, seconds in stats.sections.items():
+            metrics.observe('ride_section_duration_seconds', seconds, (*view, ('section', section)))
+            timings.append(f'{section.replace(":", "-").replace(".", "-")};dur={seconds * 1000:.1f}')
+        response['Server-Timing'] = ', '.join(timings)
+
+
+class MetricsView(View):
+    """Prometheus scrape endpoint; only answers INSTRUMENTATION['METRICS_ALLOWED_IPS']."""
+
+    def get(self, request):
+        if request.META.get('REMOTE_ADDR') not in instrumentation_settings()['METRICS_ALLOWED_IPS']:
+            return HttpResponseForbidden()
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
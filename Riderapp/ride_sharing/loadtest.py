@@ -0,0 +1,357 @@
+# ride_sharing/loadtest.py
+"""
+In-process load generator for the ride_sharing API.
+
+Workers replay a weighted mix of register/create/list/accept/match/location
+calls through Django's WSGI (``Client``) or ASGI (``AsyncClient``) handler,
+so a run needs nothing but a database. Under ASGI the calls can also go to
+the async views in async_views.py. Each request records its latency and
+the number of SQL queries it issued; ``summarize`` turns the samples into
+p50/p95/p99 latency, throughput and queries-per-request per endpoint.
+"""
+import asyncio
+import contextvars
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import (
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import Ride, UserProfile
+from .presence import get_presence_registry
+
+DEFAULT_MIX = {'list': 35, 'location': 25, 'create': 15, 'accept': 10, 'match': 10, 'register': 5}
+
+CITY_CENTRES = {
+    'Bengaluru': (77.59, 12.97),
+    'Mumbai': (72.88, 19.08),
+    'Delhi': (77.21, 28.61),
+    'Pune': (73.86, 18.52),
+}
+
+# History is mostly finished trips; REQUESTED rides seed the open pool that
+# accept/match/location calls draw from.
+SEED_STATUS_WEIGHTS = {'COMPLETED': 80, 'CANCELLED': 10, 'REQUESTED': 10}
+
+Call = namedtuple('Call', 'name method path data token on_response')
+Sample = namedtuple('Sample', 'name status elapsed_ms queries')
+
+_query_counter = contextvars.ContextVar('loadtest_query_counter', default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _query_counter.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter():
+    """Count queries on this thread's connection into the current request's counter."""
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+@contextmanager
+def throwaway_database(directory):
+    """
+    Create and drop a test database as the test runner does. SQLite gets a
+    file in ``directory`` so threads share it, and BEGIN IMMEDIATE
+    transactions so concurrent writers queue on the lock instead of failing.
+    """
+    if connection.vendor == 'sqlite':
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = str(Path(directory) / 'bench.sqlite3')
+        connection.settings_dict['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+def parse_mix(value):
+    """Parse ``"list=40,create=10"`` into a weight dict over the known operations."""
+    mix = {}
+    for part in filter(None, (item.strip() for item in value.split(','))):
+        name, _, weight = part.partition('=')
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Unknown operation {name!r}; choose from {', '.join(DEFAULT_MIX)}")
+        mix[name] = int(weight or 1)
+    if not any(mix.values()):
+        raise ValueError("The mix needs at least one operation with a positive weight")
+    return mix
+
+
+def random_point(rng, city):
+    lng, lat = CITY_CENTRES[city]
+    return round(lng + rng.uniform(-0.05, 0.05), 6), round(lat + rng.uniform(-0.05, 0.05), 6)
+
+
+def seed_population(riders, drivers, rides, seed=42):
+    """
+    Create riders, drivers with ONLINE presence, and a ride history.
+
+    Returns ``(rider_ids, driver_ids, open_rides)`` where ``open_rides`` lists
+    ``(ride_id, rider_id)`` for the REQUESTED rides.
+    """
+    rng = random.Random(seed)
+    users = User.objects.bulk_create([
+        User(username=f'load-seed-{n}', email=f'load-seed-{n}@example.com', password='!')
+        for n in range(riders + drivers)
+    ])
+    rider_users, driver_users = users[:riders], users[riders:]
+    UserProfile.objects.bulk_create(
+        [UserProfile(user=user, role='RIDER') for user in rider_users]
+        + [UserProfile(user=user, role='DRIVER') for user in driver_users]
+    )
+    registry = get_presence_registry()
+    for user in driver_users:
+        registry.heartbeat(user.id, *random_point(rng, rng.choice(list(CITY_CENTRES))))
+
+    statuses, weights = zip(*SEED_STATUS_WEIGHTS.items())
+    batch = []
+    for _ in range(rides):
+        city = rng.choice(list(CITY_CENTRES))
+        ride_status = rng.choices(statuses, weights)[0]
+        ride = Ride(
+            rider=rng.choice(rider_users),
+            driver=None if ride_status == 'REQUESTED' else rng.choice(driver_users),
+            pickup_location='A', dropoff_location='B', status=ride_status, city=city,
+        )
+        ride.set_location(*random_point(rng, city))
+        batch.append(ride)
+    Ride.objects.bulk_create(batch, batch_size=2000)
+    open_rides = list(Ride.objects.filter(status='REQUESTED').values_list('id', 'rider_id'))
+    return [user.id for user in rider_users], [user.id for user in driver_users], open_rides
+
+
+class Workload:
+    """Thread-safe source of the next API call, drawn from ``mix`` and the live open-ride pool."""
+
+    def __init__(self, rider_ids, driver_ids, open_rides, mix=None, seed=42, label='load', async_views=False):
+        self.rng = random.Random(seed)
+        self.mix = mix or DEFAULT_MIX
+        self.label = label
+        # Send create/location/accept calls to the async views under /api/async/.
+        self.prefix = '/api/async' if async_views else '/api'
+        self.tokens = {user_id: str(AccessToken.for_user(User(id=user_id)))
+                       for user_id in (*rider_ids, *driver_ids)}
+        self.rider_ids = rider_ids
+        self.driver_ids = driver_ids
+        self.open_rides = list(open_rides)
+        self.registered = 0
+        self.lock = threading.Lock()
+
+    def next_call(self):
+        names, weights = zip(*self.mix.items())
+        with self.lock:
+            name = self.rng.choices(names, weights)[0]
+            if name in ('accept', 'match', 'location') and not self.open_rides:
+                name = 'create'
+            return getattr(self, f'call_{name}')()
+
+    def _take_open_ride(self):
+        # Swap-remove keeps taking a random ride O(1).
+        index = self.rng.randrange(len(self.open_rides))
+        self.open_rides[index], self.open_rides[-1] = self.open_rides[-1], self.open_rides[index]
+        return self.open_rides.pop()
+
+    def _add_open_ride(self, rider_id):
+        def on_response(response):
+            if response.status_code == 201:
+                with self.lock:
+                    self.open_rides.append((json.loads(response.content)['id'], rider_id))
+        return on_response
+
+    def call_register(self):
+        self.registered += 1
+        username = f'{self.label}-{self.registered}'
+        return Call('register', 'post', '/api/users/register/', {
+            'username': username, 'email': f'{username}@example.com',
+            'password': 'load-test-password', 'profile': {'role': 'RIDER'},
+        }, None, None)
+
+    def call_create(self):
+        rider_id = self.rng.choice(self.rider_ids)
+        city = self.rng.choice(list(CITY_CENTRES))
+        return Call('create', 'post', f'{self.prefix}/rides/', {
+            'pickup_location': 'A', 'dropoff_location': 'B', 'city': city,
+            'current_location': {'type': 'Point', 'coordinates': list(random_point(self.rng, city))},
+        }, self.tokens[rider_id], self._add_open_ride(rider_id))
+
+    def call_list(self):
+        user_id = self.rng.choice((self.rng.choice(self.rider_ids), self.rng.choice(self.driver_ids)))
+        params = self.rng.choice(({}, {'status': 'REQUESTED'}, {'city': self.rng.choice(list(CITY_CENTRES))}))
+        return Call('list', 'get', '/api/rides/list/', params, self.tokens[user_id], None)
+
+    def call_location(self):
+        ride_id, rider_id = self.rng.choice(self.open_rides)
+        city = self.rng.choice(list(CITY_CENTRES))
+        return Call('location', 'post', f'{self.prefix}/rides/location/{ride_id}', {
+            'current_location': {'type': 'Point', 'coordinates': list(random_point(self.rng, city))},
+        }, self.tokens[rider_id], None)
+
+    def call_accept(self):
+        ride_id, _ = self._take_open_ride()
+        driver_id = self.rng.choice(self.driver_ids)
+        return Call('accept', 'post', f'{self.prefix}/rides/{ride_id}/accept/', {}, self.tokens[driver_id], None)
+
+    def call_match(self):
+        _, rider_id = self._take_open_ride()
+        return Call('match', 'post', '/api/rides/match_driver/', {}, self.tokens[rider_id], None)
+
+
+def _request_kwargs(call):
+    headers = {'Authorization': f'Bearer {call.token}'} if call.token else {}
+    if call.method == 'get':
+        return {'data': call.data, 'headers': headers}
+    return {'data': call.data, 'content_type': 'application/json', 'headers': headers}
+
+
+def run_wsgi(workload, requests, concurrency):
+    """Replay ``requests`` calls through the WSGI handler from ``concurrency`` threads."""
+    remaining = iter(range(requests))
+    remaining_lock = threading.Lock()
+    samples = []
+
+    def worker():
+        install_query_counter()
+        client = Client(raise_request_exception=False)
+        local = []
+        try:
+            while True:
+                with remaining_lock:
+                    if next(remaining, None) is None:
+                        break
+                call = workload.next_call()
+                counter = [0]
+                _query_counter.set(counter)
+                started = time.perf_counter()
+                response = getattr(client, call.method)(call.path, **_request_kwargs(call))
+                local.append(Sample(call.name, response.status_code,
+                                    (time.perf_counter() - started) * 1000, counter[0]))
+                _query_counter.set(None)
+                if call.on_response:
+                    call.on_response(response)
+        finally:
+            connection.close()
+        return local
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for result in [pool.submit(worker) for _ in range(concurrency)]:
+            samples.extend(result.result())
+    return samples, time.perf_counter() - started
+
+
+def run_asgi(workload, requests, concurrency):
+    """Replay ``requests`` calls through the ASGI handler from ``concurrency`` coroutines."""
+    # async_to_sync keeps thread-sensitive sync code (the views) on this
+    # thread, the way an ASGI server runs Django.
+    return async_to_sync(_run_asgi)(workload, requests, concurrency)
+
+
+async def _run_asgi(workload, requests, concurrency):
+    await sync_to_async(install_query_counter)()
+    remaining = iter(range(requests))
+    samples = []
+
+    async def worker():
+        client = AsyncClient(raise_request_exception=False)
+        while next(remaining, None) is not None:
+            call = workload.next_call()
+            counter = [0]
+            _query_counter.set(counter)
+            started = time.perf_counter()
+            response = await getattr(client, call.method)(call.path, **_request_kwargs(call))
+            samples.append(Sample(call.name, response.status_code,
+                                  (time.perf_counter() - started) * 1000, counter[0]))
+            if call.on_response:
+                call.on_response(response)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, time.perf_counter() - started
+
+
+RUNNERS = {'wsgi': run_wsgi, 'asgi': run_asgi}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def _stats(samples, elapsed):
+    latencies = sorted(sample.elapsed_ms for sample in samples)
+    queries = [sample.queries for sample in samples]
+    return {
+        'requests': len(samples),
+        'errors': sum(sample.status >= 500 for sample in samples),
+        'status_codes': {str(code): count for code, count in sorted(Counter(s.status for s in samples).items())},
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 3),
+            'p95': round(percentile(latencies, 95), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'mean': round(sum(latencies) / len(latencies), 3),
+            'max': round(latencies[-1], 3),
+        },
+        'queries_per_request': {
+            'mean': round(sum(queries) / len(queries), 2),
+            'max': max(queries),
+        },
+    }
+
+
+def summarize(samples, elapsed):
+    """Overall and per-endpoint statistics for one run."""
+    by_name = defaultdict(list)
+    for sample in samples:
+        by_name[sample.name].append(sample)
+    return {
+        'elapsed_s': round(elapsed, 3),
+        'overall': _stats(samples, elapsed) if samples else None,
+        'endpoints': {name: _stats(group, elapsed) for name, group in sorted(by_name.items())},
+    }
+
+
+def compare(report, baseline):
+    """
+    Rows of ``(interface, endpoint, metric, before, after, change_pct)`` for the
+    p95 latency, throughput and queries per request of runs present in both reports.
+    """
+    rows = []
+    for interface, run in report['runs'].items():
+        previous = baseline.get('runs', {}).get(interface)
+        if not previous:
+            continue
+        for endpoint, stats in run['endpoints'].items():
+            before = previous['endpoints'].get(endpoint)
+            if not before:
+                continue
+            for metric, get in (('p95_ms', lambda s: s['latency_ms']['p95']),
+                                ('throughput_rps', lambda s: s['throughput_rps']),
+                                ('queries', lambda s: s['queries_per_request']['mean'])):
+                old, new = get(before), get(stats)
+                change = round((new - old) / old * 100, 1) if old else None
+                rows.append((interface, endpoint, metric, old, new, change))
+    return rows
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from ride_sharing.archive import archive_finished_rides
+
+
+class Command(BaseCommand):
+    help = ("Move COMPLETED and CANCELLED rides untouched for --days into the archive table, "
+            "in small transactions (defaults from RIDE_ARCHIVE).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float)
+        parser.add_argument('--chunk-size', type=int)
+        parser.add_argument('--pause', type=float, help="Seconds to sleep between chunks.")
+
+    def handle(self, *args, **options):
+        older_than = timedelta(days=options['days']) if options['days'] is not None else None
+        archived = archive_finished_rides(older_than, options['chunk_size'], options['pause'])
+        self.stdout.write(f"Archived {archived} finished rides")
@@ -0,0 +1,133 @@
+import json
+import platform
+import subprocess
+import tempfile
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from ride_sharing.heatmap import get_heatmap
+from ride_sharing.loadtest import (
+    RUNNERS, Workload, compare, parse_mix, seed_population, summarize, throwaway_database,
+)
+from ride_sharing.models import Ride
+
+
+# interface: (runner, async_views)
+INTERFACES = {'wsgi': ('wsgi', False), 'asgi': ('asgi', False), 'asgi-async': ('asgi', True)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True, cwd=settings.BASE_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Replay a mixed API workload in-process against a throwaway database and report "
+            "p50/p95/p99 latency, throughput and queries per request for each endpoint.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interface', choices=[*INTERFACES, 'both', 'all'], default='both',
+                            help="'asgi-async' serves create/location/accept from the async views; "
+                                 "'both' is wsgi and asgi, 'all' adds asgi-async.")
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--riders', type=int, default=1000)
+        parser.add_argument('--drivers', type=int, default=300)
+        parser.add_argument('--rides', type=int, default=20_000)
+        parser.add_argument('--mix', default=None,
+                            help="Operation weights, e.g. 'list=40,location=25,create=15'.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--geocoder-delay', type=float, default=0.0,
+                            help="Seconds each reverse geocode takes, to simulate a slow API.")
+        parser.add_argument('--json', action='store_true', help="Print one JSON document instead of a report.")
+        parser.add_argument('--output', help="Also write the JSON report to this file.")
+        parser.add_argument('--baseline', help="JSON report of an earlier run to compare against.")
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix']) if options['mix'] else None
+        except ValueError as exc:
+            raise CommandError(exc)
+        baseline = json.loads(Path(options['baseline']).read_text()) if options['baseline'] else None
+        interfaces = {'both': list(RUNNERS), 'all': list(INTERFACES)}.get(options['interface'],
+                                                                         [options['interface']])
+
+        report = {
+            'meta': {
+                'commit': git_commit(),
+                'timestamp': timezone.now().isoformat(),
+                'vendor': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'options': {key: options[key] for key in
+                            ('requests', 'concurrency', 'riders', 'drivers', 'rides', 'mix', 'seed',
+                             'geocoder_delay')},
+            },
+            'runs': {},
+        }
+        with tempfile.TemporaryDirectory() as tmp, throwaway_database(tmp), override_settings(
+            DEBUG=False,
+            GEOCODING={**settings.GEOCODING, 'BACKEND': 'ride_sharing.geocoding.FakeGeocoder',
+                       'OPTIONS': {'delay': options['geocoder_delay']}, 'ASYNC': False,
+                       # Every ping reaches the (slow) backend, as with points spread across a city.
+                       'CACHE_SIZE': 0 if options['geocoder_delay'] else settings.GEOCODING['CACHE_SIZE'],
+                       'CITY_BOUNDARIES': None},
+            DRIVER_PRESENCE={**settings.DRIVER_PRESENCE, 'TTL': 24 * 60 * 60},
+        ):
+            for interface in interfaces:
+                # Every interface starts from the same seeded population.
+                Ride.objects.all().delete()
+                User.objects.all().delete()
+                get_heatmap().clear()
+                rider_ids, driver_ids, open_rides = seed_population(
+                    options['riders'], options['drivers'], options['rides'], seed=options['seed'])
+                runner, async_views = INTERFACES[interface]
+                workload = Workload(rider_ids, driver_ids, open_rides, mix=mix, seed=options['seed'],
+                                    label=f'load-{interface}', async_views=async_views)
+                samples, elapsed = RUNNERS[runner](workload, options['requests'], options['concurrency'])
+                report['runs'][interface] = summarize(samples, elapsed)
+
+        document = json.dumps(report, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(document)
+        if options['json']:
+            self.stdout.write(document)
+        else:
+            self.write_report(report)
+        if baseline:
+            self.write_comparison(compare(report, baseline))
+
+    def write_report(self, report):
+        meta = report['meta']
+        self.stdout.write(f"commit {meta['commit']}  {meta['vendor']}  "
+                          f"concurrency {meta['options']['concurrency']}")
+        for interface, run in report['runs'].items():
+            overall = run['overall']
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{interface}: {overall['requests']} requests in {run['elapsed_s']}s, "
+                f"{overall['throughput_rps']} req/s, {overall['errors']} errors"))
+            self.stdout.write(f"  {'endpoint':<10}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+                              f"{'req/s':>9}{'queries':>9}  status")
+            for name, stats in run['endpoints'].items():
+                latency = stats['latency_ms']
+                codes = ' '.join(f'{code}:{count}' for code, count in stats['status_codes'].items())
+                self.stdout.write(f"  {name:<10}{stats['requests']:>7}{latency['p50']:>10.2f}"
+                                  f"{latency['p95']:>10.2f}{latency['p99']:>10.2f}"
+                                  f"{stats['throughput_rps']:>9.1f}"
+                                  f"{stats['queries_per_request']['mean']:>9.1f}  {codes}")
+
+    def write_comparison(self, rows):
+        self.stdout.write(self.style.MIGRATE_HEADING("against baseline"))
+        for interface, endpoint, metric, before, after, change in rows:
+            delta = 'n/a' if change is None else f'{change:+.1f}%'
+            self.stdout.write(f"  {interface:<5} {endpoint:<10} {metric:<15} {before} -> {after} ({delta})")
@@ -0,0 +1,76 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ride_sharing.driver_index import DriverIndex
+from ride_sharing.geo import haversine_km
+from ride_sharing.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = "Compare DriverIndex nearest lookups with the full-table ORM driver scan."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10_000, 100_000, 1_000_000])
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--cell-size', type=float, default=0.005, help="Grid cell size in degrees.")
+        parser.add_argument('--skip-orm', action='store_true',
+                            help="Only time the in-memory paths; seeding 1M users takes a while.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        for size in options['sizes']:
+            # Drivers spread over a ~50km square around a city centre.
+            positions = [(rng.uniform(77.4, 77.9), rng.uniform(12.7, 13.2)) for _ in range(size)]
+            queries = [(rng.uniform(77.4, 77.9), rng.uniform(12.7, 13.2)) for _ in range(options['queries'])]
+
+            index = DriverIndex(cell_size_deg=options['cell_size'])
+            started = time.perf_counter()
+            for driver_id, (lng, lat) in enumerate(positions):
+                index.update(driver_id, lng, lat)
+            build_s = time.perf_counter() - started
+
+            started = time.perf_counter()
+            for lng, lat in queries:
+                index.nearest(lng, lat, k=options['k'])
+            index_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+            scan_queries = queries[:max(1, len(queries) // 20)]
+            started = time.perf_counter()
+            for lng, lat in scan_queries:
+                sorted(range(size), key=lambda i: haversine_km(lng, lat, *positions[i]))[:options['k']]
+            scan_ms = (time.perf_counter() - started) * 1000 / len(scan_queries)
+
+            self.stdout.write(
+                f"{size:>9} drivers  build {build_s:.2f}s  "
+                f"index {index_ms:.3f}ms/query  linear scan {scan_ms:.1f}ms/query"
+            )
+            if not options['skip_orm']:
+                orm_ms = self._time_orm_scan(size, len(scan_queries))
+                self.stdout.write(f"{'':>9}          orm scan {orm_ms:.1f}ms/query")
+
+    def _time_orm_scan(self, size, repeats):
+        # Seed throwaway drivers and roll them back once timed.
+        with transaction.atomic():
+            batch = 10_000
+            for start in range(0, size, batch):
+                users = User.objects.bulk_create([
+                    User(username=f'bench-driver-{n}', password='!')
+                    for n in range(start, min(size, start + batch))
+                ])
+                UserProfile.objects.bulk_create([UserProfile(user=u, role='DRIVER') for u in users])
+            started = time.perf_counter()
+            for _ in range(repeats):
+                drivers = User.objects.filter(is_active=True, profile__role='DRIVER')
+                drivers.first() if drivers.exists() else None
+                # A location-aware ORM match has to pull every driver row.
+                for _row in drivers.values_list('id').iterator(chunk_size=5000):
+                    pass
+            elapsed_ms = (time.perf_counter() - started) * 1000 / repeats
+            transaction.set_rollback(True)
+        return elapsed_ms
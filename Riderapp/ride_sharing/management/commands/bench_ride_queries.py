@@ -0,0 +1,139 @@
+import json
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ride_sharing.models import ACTIVE_STATUSES, Ride, UserProfile
+
+CITIES = ['Bengaluru', 'Mumbai', 'Delhi', 'Chennai', 'Pune', 'Hyderabad', 'Kolkata', 'Kochi']
+# Mostly finished history with a thin layer of live rides, as in production.
+STATUS_WEIGHTS = {'COMPLETED': 80, 'CANCELLED': 12, 'REQUESTED': 4, 'ACCEPTED': 2, 'IN_PROGRESS': 2}
+
+
+@contextmanager
+def explicit_created_at():
+    """Let bulk_create keep the seeded created_at values instead of now()."""
+    field = Ride._meta.get_field('created_at')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = ("Seed rides into a rolled-back transaction and record latency and EXPLAIN plans "
+            "of the endpoint queries with and without the Ride indexes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rides', type=int, default=1_000_000)
+        parser.add_argument('--users', type=int, default=20_000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--json', action='store_true', help="Print one JSON document instead of a report.")
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            existing = connection.introspection.get_constraints(cursor, Ride._meta.db_table)
+        missing = [index.name for index in Ride._meta.indexes if index.name not in existing]
+        if missing:
+            raise CommandError(f"Ride indexes missing ({', '.join(missing)}); run migrate first.")
+        rng = random.Random(options['seed'])
+        report = {'vendor': connection.vendor, 'rides': options['rides'], 'phases': {}}
+        with transaction.atomic():
+            riders, drivers = self.seed(rng, options['rides'], options['users'])
+            probe_rider, probe_driver = rng.choice(riders), rng.choice(drivers)
+            queries = self.queries(probe_rider, probe_driver)
+
+            report['phases']['indexed'] = self.measure(queries, options['repeat'], 'indexed')
+            # Plain DROP INDEX is transactional on SQLite and PostgreSQL, so
+            # the rollback below restores the indexes.
+            with connection.cursor() as cursor:
+                for index in Ride._meta.indexes:
+                    cursor.execute(f"DROP INDEX {connection.ops.quote_name(index.name)}")
+            report['phases']['unindexed'] = self.measure(queries, options['repeat'], 'unindexed')
+            transaction.set_rollback(True)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for name in queries:
+            indexed = report['phases']['indexed'][name]
+            unindexed = report['phases']['unindexed'][name]
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(f"  median {unindexed['median_ms']:.2f}ms -> {indexed['median_ms']:.2f}ms with indexes")
+            self.stdout.write(f"  before: {unindexed['plan']}")
+            self.stdout.write(f"  after:  {indexed['plan']}")
+
+    def seed(self, rng, ride_count, user_count):
+        users = User.objects.bulk_create([
+            User(username=f'bench-user-{n}', password='!') for n in range(user_count)
+        ])
+        split = user_count * 4 // 5
+        riders, drivers = users[:split], users[split:]
+        UserProfile.objects.bulk_create(
+            [UserProfile(user=u, role='RIDER') for u in riders]
+            + [UserProfile(user=u, role='DRIVER') for u in drivers]
+        )
+        statuses, weights = zip(*STATUS_WEIGHTS.items())
+        now = timezone.now()
+        with explicit_created_at():
+            for start in range(0, ride_count, 10_000):
+                batch = []
+                for _ in range(min(10_000, ride_count - start)):
+                    ride_status = rng.choices(statuses, weights)[0]
+                    created_at = now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+                    batch.append(Ride(
+                        rider=rng.choice(riders),
+                        driver=None if ride_status == 'REQUESTED' else rng.choice(drivers),
+                        pickup_location='A', dropoff_location='B', status=ride_status,
+                        city=rng.choice(CITIES), created_at=created_at, updated_at=created_at,
+                    ))
+                Ride.objects.bulk_create(batch)
+        return riders, drivers
+
+    def queries(self, rider, driver):
+        page = 51  # KeysetPagination.page_size + 1
+        recent = Ride.objects.order_by('-created_at', '-id')
+        return {
+            # .last() on the view's unordered queryset orders by -pk.
+            'match: rider latest REQUESTED': Ride.objects.filter(status='REQUESTED', rider=rider).order_by('-pk')[:1],
+            'list: first page': recent[:page],
+            'list: status filter': recent.filter(status='REQUESTED')[:page],
+            'list: city filter': recent.filter(city='Pune')[:page],
+            'accept: driver busy check': Ride.objects.filter(driver=driver, status__in=ACTIVE_STATUSES).values('id')[:1],
+            'cleanup: stale REQUESTED': Ride.objects.filter(
+                status='REQUESTED', created_at__lt=timezone.now() - timedelta(minutes=15)).values_list('id'),
+        }
+
+    def measure(self, queries, repeat, phase):
+        results = {}
+        for name, queryset in queries.items():
+            list(queryset.all())  # warm the page cache
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = {
+                'median_ms': statistics.median(timings),
+                'max_ms': max(timings),
+                'plan': self.explain(queryset, phase),
+            }
+        return results
+
+    def explain(self, queryset, phase):
+        # Tag the statement with the phase: SQLite reuses a cached EXPLAIN
+        # for identical SQL even after its indexes were dropped.
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql} /* {phase} */", params)
+            rows = cursor.fetchall()
+        return ' | '.join(' '.join(str(column) for column in row) for row in rows)
@@ -0,0 +1,96 @@
+import json
+import random
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from ride_sharing.loadtest import throwaway_database
+from ride_sharing.models import Ride, UserProfile
+from ride_sharing.renderers import FastJSONRenderer, orjson
+from ride_sharing.serializers import RideSerializer, render_rides, ride_rows
+
+STATUSES = ['REQUESTED', 'ACCEPTED', 'IN_PROGRESS', 'COMPLETED', 'CANCELLED']
+CITIES = ['Bengaluru', 'Mumbai', 'Delhi', 'Pune', None]
+
+
+class Command(BaseCommand):
+    help = ("Compare RideSerializer with the values_list() fast path (query + serialize, and JSON "
+            "encoding) at several result sizes, on rides seeded into a throwaway database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--json', action='store_true', help="Print one JSON document instead of a report.")
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        report = {'orjson': orjson is not None, 'sizes': {}}
+        with tempfile.TemporaryDirectory() as tmp, throwaway_database(tmp):
+            with transaction.atomic():
+                self.seed(random.Random(options['seed']), sizes[-1])
+            for size in sizes:
+                report['sizes'][size] = self.measure(size, options['repeat'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(f"{'rides':>8} {'serializer ms':>14} {'fast ms':>9} {'speedup':>8}"
+                          f" {'json ms':>9} {'fast json ms':>13}")
+        for size, result in report['sizes'].items():
+            self.stdout.write(
+                f"{size:>8} {result['serializer_ms']:>14.1f} {result['fast_ms']:>9.1f} "
+                f"{result['speedup']:>7.1f}x {result['json_ms']:>9.1f} {result['fast_json_ms']:>13.1f}")
+
+    def seed(self, rng, count):
+        users = User.objects.bulk_create([User(username=f'bench-ser-{n}', password='!') for n in range(200)])
+        UserProfile.objects.bulk_create([UserProfile(user=user, role='RIDER') for user in users[:150]]
+                                        + [UserProfile(user=user, role='DRIVER') for user in users[150:]])
+        riders, drivers = users[:150], users[150:]
+        batch = []
+        for _ in range(count):
+            ride_status = rng.choice(STATUSES)
+            ride = Ride(rider=rng.choice(riders), pickup_location='12 MG Road', dropoff_location='Airport',
+                        driver=None if ride_status == 'REQUESTED' else rng.choice(drivers),
+                        status=ride_status, city=rng.choice(CITIES))
+            if rng.random() < 0.8:
+                ride.set_location(round(rng.uniform(77.4, 77.8), 6), round(rng.uniform(12.8, 13.1), 6))
+            batch.append(ride)
+            if len(batch) == 10_000:
+                Ride.objects.bulk_create(batch)
+                batch = []
+        Ride.objects.bulk_create(batch)
+
+    def measure(self, size, repeat):
+        rides = Ride.objects.order_by('-created_at', '-id')
+
+        def serializer():
+            return RideSerializer(list(rides.with_related()[:size]), many=True).data
+
+        def fast():
+            return render_rides(ride_rows(rides)[:size])
+
+        slow_data, fast_data = serializer(), fast()
+        if json.loads(JSONRenderer().render(slow_data)) != json.loads(JSONRenderer().render(fast_data)):
+            raise AssertionError(f"Fast path output differs from RideSerializer at {size} rides")
+        serializer_ms = self.best(serializer, repeat)
+        fast_ms = self.best(fast, repeat)
+        return {
+            'serializer_ms': serializer_ms,
+            'fast_ms': fast_ms,
+            'speedup': round(serializer_ms / fast_ms, 2),
+            'json_ms': self.best(lambda: JSONRenderer().render(fast_data), repeat),
+            'fast_json_ms': self.best(lambda: FastJSONRenderer().render(fast_data), repeat),
+        }
+
+    def best(self, fn, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - started) * 1000)
+        return round(min(timings), 3)
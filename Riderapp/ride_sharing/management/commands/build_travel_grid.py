@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ride_sharing.estimates import build_grid
+
+
+class Command(BaseCommand):
+    help = ("Precompute a cell-to-cell travel time and distance grid over a bounding box from the "
+            "trails of completed rides, for RIDE_ESTIMATES['GRIDS'].")
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Grid file to write; replaced atomically.")
+        parser.add_argument('--bbox', type=float, nargs=4, required=True,
+                            metavar=('MIN_LNG', 'MIN_LAT', 'MAX_LNG', 'MAX_LAT'))
+        parser.add_argument('--cell-deg', type=float, default=0.01, help="Cell size in degrees (~1 km).")
+
+    def handle(self, *args, **options):
+        min_lng, min_lat, max_lng, max_lat = options['bbox']
+        if min_lng >= max_lng or min_lat >= max_lat or options['cell_deg'] <= 0:
+            raise CommandError("The bounding box must be non-empty and --cell-deg positive")
+        try:
+            known = build_grid(options['output'], min_lng, min_lat, max_lng, max_lat, options['cell_deg'])
+        except ValueError as exc:
+            raise CommandError(exc)
+        self.stdout.write(f"Wrote {options['output']} with {known} known cell pairs")
@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from ride_sharing.models import Ride
+from ride_sharing.ride_cache import invalidate_rides, ride_cache_settings
+
+
+class Command(BaseCommand):
+    help = "Cancel REQUESTED rides that have waited longer than --minutes, in a single UPDATE."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutes', type=int, default=15)
+
+    def handle(self, *args, **options):
+        older_than = timedelta(minutes=options['minutes'])
+        if ride_cache_settings()['ENABLED']:
+            # Cancel a known set of rides so exactly those leave the detail cache.
+            ride_ids = list(Ride.objects.stale_requests(older_than).values_list('pk', flat=True))
+            cancelled = Ride.objects.filter(pk__in=ride_ids).transition('CANCELLED')
+            invalidate_rides(ride_ids)
+        else:
+            cancelled = Ride.objects.cancel_stale_requests(older_than)
+        self.stdout.write(f"Cancelled {cancelled} stale ride requests")
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ride_sharing.ride_matching import MATCHING_STRATEGIES, batch_match_rides, get_matching_strategy
+
+
+class Command(BaseCommand):
+    help = "Match pending REQUESTED rides to nearby drivers in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--strategy', help=f"One of {', '.join(MATCHING_STRATEGIES)} or a dotted path; "
+                                               "defaults to settings.RIDE_MATCHING_STRATEGY.")
+        parser.add_argument('--window', type=int, default=0,
+                            help="Only consider rides requested in the last N seconds (0 = all pending).")
+        parser.add_argument('--max-distance-km', type=float)
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Keep running, matching a new batch every N seconds.")
+
+    def handle(self, *args, **options):
+        try:
+            strategy = get_matching_strategy(options['strategy'])
+        except ImportError as e:
+            raise CommandError(f"Unknown matching strategy: {e}")
+        while True:
+            started = time.perf_counter()
+            matched = batch_match_rides(
+                strategy=strategy,
+                window_seconds=options['window'],
+                max_distance_km=options['max_distance_km'],
+            )
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.stdout.write(f"Matched {len(matched)} rides in {elapsed_ms:.1f}ms")
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-18 19:01
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ride_sharing', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['rider', 'status', 'created_at'], name='ride_rider_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['driver', 'status'], name='ride_driver_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['-created_at', '-id'], name='ride_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['status', '-created_at', '-id'], name='ride_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['city', '-created_at', '-id'], name='ride_city_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(condition=models.Q(('status', 'REQUESTED')), fields=['created_at'], name='ride_requested_created_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+from ride_sharing.geo import geohash_encode, point_coordinates
+
+BATCH_SIZE = 2000
+
+
+def backfill_location_columns(apps, schema_editor):
+    Ride = apps.get_model('ride_sharing', 'Ride')
+    rides = Ride.objects.filter(current_location__isnull=False).only('id', 'current_location')
+    batch = []
+    for ride in rides.iterator(chunk_size=BATCH_SIZE):
+        coordinates = point_coordinates(ride.current_location)
+        if coordinates is None:
+            continue
+        ride.longitude, ride.latitude = coordinates
+        ride.geohash = geohash_encode(ride.longitude, ride.latitude)
+        batch.append(ride)
+        if len(batch) >= BATCH_SIZE:
+            Ride.objects.bulk_update(batch, ['latitude', 'longitude', 'geohash'])
+            batch = []
+    if batch:
+        Ride.objects.bulk_update(batch, ['latitude', 'longitude', 'geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ride_sharing', '0003_ride_location_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_location_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ride_sharing', '0004_backfill_ride_location_columns'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRide',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('pickup_location', models.CharField(max_length=255)),
+                ('dropoff_location', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('REQUESTED', 'Requested'), ('ACCEPTED', 'Accepted'), ('IN_PROGRESS', 'In Progress'), ('COMPLETED', 'Completed'), ('CANCELLED', 'Cancelled')], max_length=20)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('current_location', models.JSONField(blank=True, null=True)),
+                ('city', models.CharField(blank=True, max_length=100, null=True)),
+                ('latitude', models.FloatField(blank=True, null=True)),
+                ('longitude', models.FloatField(blank=True, null=True)),
+                ('geohash', models.CharField(blank=True, max_length=12, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('driver', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_rides_as_driver', to=settings.AUTH_USER_MODEL)),
+                ('rider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_rides_as_rider', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['rider', '-created_at'], name='archivedride_rider_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ride_sharing', '0005_archived_ride'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RideTrailSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ride_id', models.BigIntegerField()),
+                ('start_ms', models.BigIntegerField()),
+                ('last_lat', models.IntegerField()),
+                ('last_lng', models.IntegerField()),
+                ('last_ms', models.BigIntegerField()),
+                ('count', models.PositiveIntegerField()),
+                ('points', models.BinaryField()),
+                ('closed', models.BooleanField(default=False)),
+                ('simplified', models.BooleanField(default=False)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ride_id', 'id'], name='trailsegment_ride_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('closed', False)), fields=('ride_id',), name='trailsegment_one_open_per_ride')],
+            },
+        ),
+    ]
@@ -1,7 +1,14 @@
 # ride_sharing/models.py
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from .geo import geohash_encode, point_coordinates
+from .instrumentation import timed
+
+# Statuses during which the assigned driver is on the trip and cannot take another.
+ACTIVE_STATUSES = ('ACCEPTED', 'IN_PROGRESS')
 
 class UserProfile(models.Model):
     ROLE_CHOICES = (
@@ -14,6 +21,68 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.role}"
 
+def invert_transitions(transitions):
+    sources = {status: [] for status in transitions}
+    for source, targets in transitions.items():
+        for target in targets:
+            sources[target].append(source)
+    return {target: tuple(statuses) for target, statuses in sources.items()}
+
+
+class RideQuerySet(models.QuerySet):
+    def within_bbox(self, min_lng, min_lat, max_lng, max_lat):
+        """Rides whose last known position lies in the box; min_lng > max_lng wraps the antimeridian."""
+        rides = self.filter(latitude__gte=min_lat, latitude__lte=max_lat)
+        if min_lng <= max_lng:
+            return rides.filter(longitude__gte=min_lng, longitude__lte=max_lng)
+        return rides.filter(models.Q(longitude__gte=min_lng) | models.Q(longitude__lte=max_lng))
+
+    def with_related(self):
+        """Load everything RideSerializer, Ride.__str__ and Ride.clean() touch in the same query."""
+        return self.select_related('rider', 'driver__profile')
+
+    def assign_driver(self, pk, driver, now=None):
+        """
+        Give the REQUESTED ride ``pk`` to ``driver`` in one conditional UPDATE.
+
+        Returns True only for the caller that won the ride. The driver's row is
+        locked first so concurrent assignments to the same driver serialise and
+        the busy check below cannot be raced.
+        """
+        busy = Ride.objects.filter(driver=driver, status__in=ACTIVE_STATUSES)
+        with transaction.atomic(using=self.db):
+            list(User.objects.using(self.db).select_for_update().filter(pk=driver.pk).values_list('pk'))
+            updated = self.filter(pk=pk, status='REQUESTED').exclude(rider=driver).filter(
+                ~models.Exists(busy)
+            ).update(driver=driver, status='ACCEPTED', updated_at=now or timezone.now())
+        return updated == 1
+
+    def transition(self, to_status, now=None):
+        """
+        Move every ride in this queryset that may legally reach ``to_status``
+        there, as one UPDATE. Rides in any other status are left alone.
+        Returns the number of rides changed.
+        """
+        return self._transitionable(to_status).update(status=to_status, updated_at=now or timezone.now())
+
+    async def atransition(self, to_status, now=None):
+        return await self._transitionable(to_status).aupdate(status=to_status, updated_at=now or timezone.now())
+
+    def _transitionable(self, to_status):
+        rides = self.filter(status__in=Ride.TRANSITION_SOURCES[to_status])
+        if to_status == 'ACCEPTED':
+            rides = rides.filter(driver__isnull=False)
+        return rides
+
+    def stale_requests(self, older_than):
+        """REQUESTED rides created more than ``older_than`` (a timedelta) ago."""
+        return self.filter(status='REQUESTED', created_at__lt=timezone.now() - older_than)
+
+    def cancel_stale_requests(self, older_than):
+        """Cancel REQUESTED rides created more than ``older_than`` (a timedelta) ago."""
+        return self.stale_requests(older_than).transition('CANCELLED')
+
+
 class Ride(models.Model):
     STATUS_CHOICES = (
         ('REQUESTED', 'Requested'),
@@ -22,7 +91,18 @@ class Ride(models.Model):
         ('COMPLETED', 'Completed'),
         ('CANCELLED', 'Cancelled'),
     )
-    
+    STATUS_VALUES = frozenset(dict(STATUS_CHOICES))
+    # Allowed lifecycle moves; COMPLETED and CANCELLED are final.
+    TRANSITIONS = {
+        'REQUESTED': ('ACCEPTED', 'CANCELLED'),
+        'ACCEPTED': ('IN_PROGRESS', 'CANCELLED'),
+        'IN_PROGRESS': ('COMPLETED',),
+        'COMPLETED': (),
+        'CANCELLED': (),
+    }
+    # Reverse of TRANSITIONS: the statuses a ride may be in to reach each status.
+    TRANSITION_SOURCES = invert_transitions(TRANSITIONS)
+
     rider = models.ForeignKey(User, on_delete=models.CASCADE, related_name='rides_as_rider')
     driver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='rides_as_driver', null=True, blank=True)
     pickup_location = models.CharField(max_length=255)
@@ -33,17 +113,123 @@ class Ride(models.Model):
     # current_location = models.CharField(max_length=255, blank=True, null=True)
     current_location = models.JSONField(null=True, blank=True)  # Store GeoJSON Point
     city = models.CharField(max_length=100, null=True, blank=True)  # Store city name
+    # Indexed copies of current_location so spatial filters run in the database.
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    geohash = models.CharField(max_length=12, null=True, blank=True, db_index=True)
+
+    objects = RideQuerySet.as_manager()
 
+    class Meta:
+        indexes = [
+            # RideMatchDriverView: the rider's latest REQUESTED ride.
+            models.Index(fields=['rider', 'status', 'created_at'], name='ride_rider_status_created_idx'),
+            # Driver busy check in assign_driver and the matchers.
+            models.Index(fields=['driver', 'status'], name='ride_driver_status_idx'),
+            # RideListView keyset pages, unfiltered and filtered by status or city.
+            models.Index(fields=['-created_at', '-id'], name='ride_created_id_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='ride_status_created_idx'),
+            models.Index(fields=['city', '-created_at', '-id'], name='ride_city_created_idx'),
+            # Radius and bounding-box ride queries.
+            models.Index(fields=['latitude', 'longitude'], name='ride_lat_lng_idx'),
+            # Pending rides only: batch matching and stale-request cleanup.
+            models.Index(fields=['created_at'], name='ride_requested_created_idx',
+                         condition=models.Q(status='REQUESTED')),
+        ]
+
+    # Columns written whenever the ride's position changes.
+    LOCATION_FIELDS = ['current_location', 'latitude', 'longitude', 'geohash']
+
+    def sync_location_columns(self):
+        """Copy current_location into the indexed latitude/longitude/geohash columns."""
+        coordinates = point_coordinates(self.current_location)
+        if coordinates is None:
+            self.latitude = self.longitude = self.geohash = None
+        else:
+            self.longitude, self.latitude = coordinates
+            self.geohash = geohash_encode(self.longitude, self.latitude)
+
+    def set_location(self, lng, lat):
+        self.current_location = {'type': 'Point', 'coordinates': [lng, lat]}
+        self.sync_location_columns()
 
     def clean(self):
-        if self.rider == self.driver and self.driver is not None:
+        if self.rider_id == self.driver_id and self.driver_id is not None:
             raise ValidationError("Rider and driver cannot be the same user.")
         if self.driver and not self.driver.profile.role == 'DRIVER':
             raise ValidationError("Only users with the 'Driver' role can be assigned as drivers.")
 
     def save(self, *args, **kwargs):
-        self.clean()
-        super().save(*args, **kwargs)
+        with timed('ride.clean'):
+            self.clean()
+        self.sync_location_columns()
+        with timed('ride.save'):
+            super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Ride {self.id} - {self.rider.username} to {self.dropoff_location}"
+
+
+# Statuses a ride never leaves; only these are moved to the archive.
+FINAL_STATUSES = ('COMPLETED', 'CANCELLED')
+
+
+class ArchivedRide(models.Model):
+    """
+    A finished ride moved out of the Ride table by ride_sharing.archive. It
+    keeps the ride's id and every column, so reads by id can fall back here.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    rider = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_rides_as_rider')
+    driver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_rides_as_driver',
+                               null=True, blank=True)
+    pickup_location = models.CharField(max_length=255)
+    dropoff_location = models.CharField(max_length=255)
+    status = models.CharField(max_length=20, choices=Ride.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    current_location = models.JSONField(null=True, blank=True)
+    city = models.CharField(max_length=100, null=True, blank=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    geohash = models.CharField(max_length=12, null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    # Columns copied from Ride, in Ride's order.
+    RIDE_FIELDS = [field.attname for field in Ride._meta.concrete_fields]
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['rider', '-created_at'], name='archivedride_rider_created_idx'),
+        ]
 
     def __str__(self):
-        return f"Ride {self.id} - {self.rider.username} to {self.dropoff_location}"
\ No newline at end of file
+        return f"Ride {self.id} - {self.rider.username} to {self.dropoff_location} (archived)"
+
+
+class RideTrailSegment(models.Model):
+    """
+    Up to RIDE_TRAILS['SEGMENT_POINTS'] consecutive GPS points of one ride,
+    packed by ride_sharing.trails into ``points``. ``ride_id`` is a plain
+    column so trails outlive the ride row when it is archived.
+    """
+    ride_id = models.BigIntegerField()
+    start_ms = models.BigIntegerField()
+    # The last point, so appending does not have to decode ``points``.
+    last_lat = models.IntegerField()
+    last_lng = models.IntegerField()
+    last_ms = models.BigIntegerField()
+    count = models.PositiveIntegerField()
+    points = models.BinaryField()
+    closed = models.BooleanField(default=False)
+    simplified = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ride_id', 'id'], name='trailsegment_ride_idx'),
+        ]
+        constraints = [
+            # Appends go to the single open segment of a ride.
+            models.UniqueConstraint(fields=['ride_id'], condition=models.Q(closed=False),
+                                    name='trailsegment_one_open_per_ride'),
+        ]
@@ -0,0 +1,210 @@
+# ride_sharing/presence.py
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .driver_index import DriverIndex
+from .heatmap import get_heatmap
+from .models import ACTIVE_STATUSES
+
+ONLINE = 'ONLINE'
+BUSY = 'BUSY'
+OFFLINE = 'OFFLINE'
+STATES = (ONLINE, BUSY, OFFLINE)
+
+DEFAULTS = {
+    'BACKEND': 'ride_sharing.presence.InMemoryPresenceRegistry',
+    # Seconds a heartbeat keeps a driver present.
+    'TTL': 30,
+}
+
+
+class Presence:
+    __slots__ = ('driver_id', 'lng', 'lat', 'state', 'expires_at')
+
+    def __init__(self, driver_id, lng, lat, state, expires_at):
+        self.driver_id = driver_id
+        self.lng = lng
+        self.lat = lat
+        self.state = state
+        self.expires_at = expires_at
+
+    @property
+    def position(self):
+        return (self.lng, self.lat)
+
+
+class PresenceRegistry:
+    """
+    Where drivers are and whether they can take a ride.
+
+    Entries are written by driver heartbeats and expire ``ttl`` seconds
+    after the last one, so a driver whose app goes quiet drops out of
+    matching without any explicit sign-off. Backends shared between
+    processes implement the same methods.
+    """
+
+    def heartbeat(self, driver_id, lng, lat, state=ONLINE):
+        raise NotImplementedError
+
+    def set_state(self, driver_id, state):
+        raise NotImplementedError
+
+    def get(self, driver_id):
+        raise NotImplementedError
+
+    def nearest_available(self, lng, lat, k=1, exclude=(), max_radius_km=None):
+        raise NotImplementedError
+
+    def available(self, limit=1, exclude=()):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class InMemoryPresenceRegistry(PresenceRegistry):
+    """Per-process registry; only ONLINE drivers are kept in the spatial index."""
+
+    def __init__(self, ttl, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = {}
+        self._index = DriverIndex()
+        self._lock = threading.Lock()
+        self._next_purge = clock() + ttl
+
+    def __len__(self):
+        return len(self._entries)
+
+    def heartbeat(self, driver_id, lng, lat, state=ONLINE):
+        if state == OFFLINE:
+            self._drop(driver_id)
+            return None
+        now = self.clock()
+        if now >= self._next_purge:
+            # Sweep drivers that stopped sending heartbeats once per TTL.
+            self._next_purge = now + self.ttl
+            self.purge_expired()
+        presence = Presence(driver_id, lng, lat, state, now + self.ttl)
+        with self._lock:
+            self._entries[driver_id] = presence
+        if state == ONLINE:
+            self._index.update(driver_id, lng, lat)
+        else:
+            self._index.remove(driver_id)
+        return presence
+
+    def set_state(self, driver_id, state):
+        """Change a present driver's state without extending their TTL."""
+        if state == OFFLINE:
+            self._drop(driver_id)
+            return
+        with self._lock:
+            presence = self._entries.get(driver_id)
+            if presence is None:
+                return
+            presence.state = state
+        if state == ONLINE:
+            self._index.update(driver_id, presence.lng, presence.lat)
+        else:
+            self._index.remove(driver_id)
+
+    def get(self, driver_id):
+        presence = self._entries.get(driver_id)
+        if presence is None:
+            return None
+        if presence.expires_at <= self.clock():
+            self._drop(driver_id)
+            return None
+        return presence
+
+    def nearest_available(self, lng, lat, k=1, exclude=(), max_radius_km=None):
+        """Return up to k (driver_id, distance_km) for ONLINE, unexpired drivers."""
+        while True:
+            found = self._index.nearest(lng, lat, k=k, exclude=exclude, max_radius_km=max_radius_km)
+            now = self.clock()
+            expired = [driver_id for driver_id, _ in found
+                       if (presence := self._entries.get(driver_id)) is None or presence.expires_at <= now]
+            if not expired:
+                return found
+            # Drop stale drivers lazily and look again; each pass shrinks the index.
+            for driver_id in expired:
+                self._drop(driver_id)
+
+    def available(self, limit=1, exclude=()):
+        """ONLINE drivers regardless of position, most recently seen first."""
+        now = self.clock()
+        with self._lock:
+            present = [presence for presence in self._entries.values()
+                       if presence.state == ONLINE and presence.expires_at > now
+                       and presence.driver_id not in exclude]
+        present.sort(key=lambda presence: presence.expires_at, reverse=True)
+        return [presence.driver_id for presence in present[:limit]]
+
+    def purge_expired(self):
+        now = self.clock()
+        with self._lock:
+            expired = [driver_id for driver_id, presence in self._entries.items() if presence.expires_at <= now]
+        for driver_id in expired:
+            self._drop(driver_id)
+        return len(expired)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        self._index.clear()
+
+    def _drop(self, driver_id):
+        with self._lock:
+            self._entries.pop(driver_id, None)
+        self._index.remove(driver_id)
+
+
+def presence_settings():
+    return {**DEFAULTS, **getattr(settings, 'DRIVER_PRESENCE', {})}
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_presence_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                config = presence_settings()
+                _registry = import_string(config['BACKEND'])(ttl=config['TTL'])
+    return _registry
+
+
+def set_driver_state(driver_id, state):
+    """
+    Move a driver to ``state`` in the registry. A driver who is no longer
+    ONLINE also stops counting as heatmap supply at once; going back ONLINE
+    counts again from their next heartbeat, which carries the city.
+    """
+    get_presence_registry().set_state(driver_id, state)
+    if state != ONLINE:
+        get_heatmap().record_driver(driver_id, None, None, available=False)
+
+
+def sync_driver_state(driver_id, ride_status):
+    """After commit, mark the ride's driver BUSY while the trip is active and ONLINE once it ends."""
+    if driver_id is None:
+        return
+    state = BUSY if ride_status in ACTIVE_STATUSES else ONLINE
+    transaction.on_commit(lambda: set_driver_state(driver_id, state))
+
+
+@receiver(setting_changed)
+def reset_presence_registry(*, setting, **kwargs):
+    global _registry
+    if setting == 'DRIVER_PRESENCE':
+        _registry = None
@@ -0,0 +1,219 @@
+# ride_sharing/registration.py
+"""
+Bulk user registration for partner fleet onboarding and test seeding.
+
+Records arrive as CSV or NDJSON and are handled CHUNK_SIZE at a time: each
+chunk is validated with one query for already-taken usernames and emails,
+its passwords are hashed in a process pool, and its users and profiles are
+inserted with two bulk_create calls in one transaction. A bad record is
+reported with its line number and never stops the rest of the stream.
+"""
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models import Q
+
+from .models import UserProfile
+
+DEFAULTS = {
+    'CHUNK_SIZE': 1000,
+    # Hashing processes; None means one per CPU, 0 hashes in the calling process.
+    'HASH_WORKERS': None,
+}
+
+FIELDS = ('username', 'email', 'password', 'role')
+ROLES = dict(UserProfile.ROLE_CHOICES)
+
+_username_field = User._meta.get_field('username')
+
+
+def registration_settings():
+    return {**DEFAULTS, **getattr(settings, 'BULK_REGISTRATION', {})}
+
+
+def _text_lines(stream):
+    for line in stream:
+        yield line.decode('utf-8') if isinstance(line, bytes) else line
+
+
+def read_csv(stream):
+    """(line number, record) pairs from a CSV stream with a header row naming FIELDS."""
+    reader = csv.DictReader(_text_lines(stream))
+    for record in reader:
+        yield reader.line_num, record
+
+
+def read_ndjson(stream):
+    """(line number, record) pairs from one JSON object per line; blank lines are skipped."""
+    for number, line in enumerate(_text_lines(stream), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield number, record
+
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson}
+
+
+def clean_record(record):
+    """
+    The record as a dict of FIELDS, and the field errors, using the same
+    rules as UserSerializer. ``role`` may also come nested as
+    ``{"profile": {"role": ...}}`` like the single-user endpoint takes it.
+    """
+    if not isinstance(record, dict):
+        return None, {'non_field_errors': ["Record must be an object"]}
+    profile = record.get('profile')
+    role = record.get('role') or (profile.get('role') if isinstance(profile, dict) else None)
+    values = {
+        'username': str(record.get('username') or '').strip(),
+        'email': str(record.get('email') or '').strip(),
+        'password': str(record.get('password') or ''),
+        'role': role,
+    }
+    errors = {}
+    if not values['username']:
+        errors['username'] = ["This field is required."]
+    else:
+        try:
+            _username_field.run_validators(values['username'])
+        except ValidationError as e:
+            errors['username'] = e.messages
+    if not values['email']:
+        errors['email'] = ["Email cannot be empty"]
+    else:
+        try:
+            validate_email(values['email'])
+        except ValidationError as e:
+            errors['email'] = e.messages
+    if not values['password']:
+        errors['password'] = ["This field is required."]
+    if values['role'] not in ROLES:
+        errors['role'] = [f"Role must be one of {', '.join(ROLES)}"]
+    return values, errors
+
+
+def _setup_worker():
+    # Spawned workers start without Django; forked ones already have it.
+    if not apps.ready:
+        django.setup()
+
+
+class BulkRegistrar:
+    """
+    Registers users from (line number, record) pairs. Use as a context
+    manager so the hashing pool is started once and shut down afterwards.
+    """
+
+    def __init__(self, chunk_size=None, workers=None):
+        config = registration_settings()
+        self.chunk_size = chunk_size or config['CHUNK_SIZE']
+        self.workers = config['HASH_WORKERS'] if workers is None else workers
+        if self.workers is None:
+            self.workers = os.cpu_count() or 1
+        self._pool = None
+
+    def __enter__(self):
+        if self.workers > 0:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_setup_worker)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def hash_passwords(self, passwords):
+        if self._pool is None:
+            return [make_password(password) for password in passwords]
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return list(self._pool.map(make_password, passwords, chunksize=chunksize))
+
+    def register(self, records):
+        """Returns {'created': n, 'errors': [{'line': n, 'errors': {...}}, ...]}."""
+        result = {'created': 0, 'errors': []}
+        records = iter(records)
+        while True:
+            chunk = list(islice(records, self.chunk_size))
+            if not chunk:
+                return result
+            created, errors = self.register_chunk(chunk)
+            result['created'] += created
+            result['errors'].extend(errors)
+
+    def register_chunk(self, chunk):
+        errors = []
+        cleaned = []
+        for line, record in chunk:
+            values, field_errors = clean_record(record)
+            if field_errors:
+                errors.append({'line': line, 'errors': field_errors})
+            else:
+                cleaned.append((line, values))
+
+        # One query for every username and email this chunk wants; earlier
+        # chunks are already inserted so they are caught here too.
+        usernames = {values['username'] for _, values in cleaned}
+        emails = {values['email'] for _, values in cleaned}
+        taken_usernames, taken_emails = set(), set()
+        for username, email in User.objects.filter(
+                Q(username__in=usernames) | Q(email__in=emails)).values_list('username', 'email'):
+            taken_usernames.add(username)
+            taken_emails.add(email)
+
+        accepted = []
+        for line, values in cleaned:
+            field_errors = {}
+            if values['username'] in taken_usernames:
+                field_errors['username'] = ["A user with that username already exists."]
+            if values['email'] in taken_emails:
+                field_errors['email'] = ["This email is already in use"]
+            if field_errors:
+                errors.append({'line': line, 'errors': field_errors})
+                continue
+            # Later duplicates within the chunk lose to the first occurrence.
+            taken_usernames.add(values['username'])
+            taken_emails.add(values['email'])
+            accepted.append(values)
+        errors.sort(key=lambda error: error['line'])
+        if not accepted:
+            return 0, errors
+
+        hashes = self.hash_passwords([values['password'] for values in accepted])
+        users = [User(username=values['username'], email=values['email'], password=password)
+                 for values, password in zip(accepted, hashes)]
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            if any(user.pk is None for user in users):
+                # Backends that cannot return ids from bulk inserts.
+                ids = dict(User.objects.filter(username__in=[user.username for user in users])
+                           .values_list('username', 'id'))
+                for user in users:
+                    user.pk = ids[user.username]
+            UserProfile.objects.bulk_create([UserProfile(user=user, role=values['role'])
+                                             for user, values in zip(users, accepted)])
+        return len(users), errors
+
+
+def register_users(records, chunk_size=None, workers=None):
+    with BulkRegistrar(chunk_size=chunk_size, workers=workers) as registrar:
+        return registrar.register(records)
+
+
+def register_stream(stream, fmt, chunk_size=None, workers=None):
+    """Register users from a CSV or NDJSON text or bytes stream."""
+    return register_users(READERS[fmt](stream), chunk_size=chunk_size, workers=workers)
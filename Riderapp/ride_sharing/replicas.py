@@ -0,0 +1,146 @@
+# ride_sharing/replicas.py
+"""
+Read-replica routing with read-your-writes stickiness.
+
+Only views that opt in with ``ReplicaReadMixin`` (or call
+``read_from_replicas``) read from the aliases in READ_REPLICAS['DATABASES'];
+every other query, and every read inside a transaction or after a write in
+the same request, goes to the primary. A request that writes pins its user
+to the primary for STICKY_SECONDS, longer than replication normally lags,
+so a client never reads a replica that has not yet seen its own change.
+Pins live in a Django cache and are only shared between processes through
+a shared backend.
+
+``ReplicaRoutingMiddleware`` scopes the routing state to one request.
+"""
+import contextvars
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.functional import LazyObject
+
+DEFAULTS = {
+    # Aliases in DATABASES that replicate DEFAULT_DB_ALIAS.
+    'DATABASES': [],
+    'STICKY_SECONDS': 5,
+    'CACHE': 'default',
+}
+
+KEY_PREFIX = 'replica-pin:'
+
+_state = contextvars.ContextVar('replica_routing', default=None)
+
+
+def replica_settings():
+    return {**DEFAULTS, **getattr(settings, 'READ_REPLICAS', {})}
+
+
+class RoutingState:
+    """What the router may do for the current request."""
+
+    def __init__(self):
+        self.replica_reads = False
+        self.wrote = False
+
+
+def pin_to_primary(user_id):
+    config = replica_settings()
+    caches[config['CACHE']].set(f'{KEY_PREFIX}{user_id}', True, config['STICKY_SECONDS'])
+
+
+def is_pinned(user_id):
+    config = replica_settings()
+    return caches[config['CACHE']].get(f'{KEY_PREFIX}{user_id}', False)
+
+
+def read_from_replicas(user):
+    """Let the rest of this request read from replicas, unless ``user`` wrote recently."""
+    state = _state.get()
+    if state is not None and replica_settings()['DATABASES'] and not is_pinned(user.pk):
+        state.replica_reads = True
+
+
+def reading_from_replicas():
+    """Whether reads outside a transaction may go to a replica right now."""
+    state = _state.get()
+    return state is not None and state.replica_reads and not state.wrote
+
+
+class ReplicaReadMixin:
+    """For read-only APIViews: queries after authentication may go to a replica."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        read_from_replicas(request.user)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not reading_from_replicas():
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # Whatever the transaction reads must be consistent with what it writes.
+            return None
+        return self.replica(replica_settings()['DATABASES'])
+
+    def replica(self, aliases):
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        databases = {DEFAULT_DB_ALIAS, *replica_settings()['DATABASES']}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary.
+        return False if db in replica_settings()['DATABASES'] else None
+
+
+class ReplicaRoutingMiddleware:
+    """Gives each request its own routing state and pins users whose request wrote to the primary."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state = RoutingState()
+        token = _state.set(state)
+        try:
+            return self.get_response(request)
+        finally:
+            _state.reset(token)
+            self.pin_writer(request, state)
+
+    async def __acall__(self, request):
+        state = RoutingState()
+        token = _state.set(state)
+        try:
+            return await self.get_response(request)
+        finally:
+            _state.reset(token)
+            self.pin_writer(request, state)
+
+    def pin_writer(self, request, state):
+        user = getattr(request, 'user', None)
+        # A still-lazy user was never authenticated by a view (JWT views
+        # replace it); resolving it would cost a session query.
+        if state.wrote and user is not None and not isinstance(user, LazyObject) and user.is_authenticated:
+            pin_to_primary(user.pk)
@@ -0,0 +1,173 @@
+# ride_sharing/ride_cache.py
+"""
+Conditional GETs and an optional response cache for the ride detail views.
+
+Validators come from ``Ride.updated_at``: every write path bumps it, so an
+unchanged value means an unchanged ride. With ``RIDE_DETAIL_CACHE['ENABLED']``
+the rendered ride is also kept in a Django cache under its id; ``save()``
+and deletes drop it through the signals below, and code that writes rides
+with ``update()``/``bulk_update()`` calls ``invalidate_rides`` itself.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+
+from .archive import aread_through, read_through
+from .models import Ride
+from .replicas import reading_from_replicas
+from .serializers import ride_renderer, ride_rows
+
+DEFAULTS = {
+    'ENABLED': False,
+    # Alias in CACHES. Invalidation reaches other processes only through a
+    # shared backend; with a per-process one TIMEOUT bounds staleness.
+    'CACHE': 'default',
+    'TIMEOUT': 30,
+}
+
+KEY_PREFIX = 'ride-detail:'
+
+NOT_FOUND = {"error": "Ride not found"}
+
+
+def ride_cache_settings():
+    return {**DEFAULTS, **getattr(settings, 'RIDE_DETAIL_CACHE', {})}
+
+
+def _cache(config):
+    return caches[config['CACHE']] if config['ENABLED'] else None
+
+
+def get_cached_ride(pk):
+    """(updated_at, data) for the ride if it is cached, else None."""
+    cache = _cache(ride_cache_settings())
+    return None if cache is None else cache.get(f'{KEY_PREFIX}{pk}')
+
+
+def cache_ride(pk, updated_at, data):
+    config = ride_cache_settings()
+    cache = _cache(config)
+    if cache is not None:
+        cache.set(f'{KEY_PREFIX}{pk}', (updated_at, data), config['TIMEOUT'])
+
+
+async def aget_cached_ride(pk):
+    cache = _cache(ride_cache_settings())
+    return None if cache is None else await cache.aget(f'{KEY_PREFIX}{pk}')
+
+
+async def acache_ride(pk, updated_at, data):
+    config = ride_cache_settings()
+    cache = _cache(config)
+    if cache is not None:
+        await cache.aset(f'{KEY_PREFIX}{pk}', (updated_at, data), config['TIMEOUT'])
+
+
+def invalidate_rides(pks):
+    cache = _cache(ride_cache_settings())
+    if cache is None:
+        return
+    keys = [f'{KEY_PREFIX}{pk}' for pk in pks]
+    cache.delete_many(keys)
+    # Again after commit, in case a concurrent read cached the old row
+    # before this transaction finished.
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_ride(pk):
+    invalidate_rides([pk])
+
+
+def ride_validators(pk, updated_at):
+    """(ETag, Last-Modified timestamp) for a ride last written at ``updated_at``."""
+    return f'W/"{pk}-{int(updated_at.timestamp() * 1_000_000)}"', int(updated_at.timestamp())
+
+
+def not_modified_response(request, pk, updated_at):
+    """A 304 (or 412) if the request's conditional headers say so for this ride, else None."""
+    etag, last_modified = ride_validators(pk, updated_at)
+    headers = with_validators(HttpResponse(), pk, updated_at)
+    # Hands back ``headers`` itself when the conditions do not match.
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified, response=headers)
+    return None if response is headers else response
+
+
+def with_validators(response, pk, updated_at):
+    etag, last_modified = ride_validators(pk, updated_at)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def _is_conditional(request):
+    return 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+
+
+def _updated_at(model, pk):
+    return model.objects.filter(pk=pk).values_list('updated_at', flat=True)
+
+
+def _row(model, pk):
+    return ride_rows(model.objects.filter(pk=pk), named=True)
+
+
+def ride_detail_response(request, pk, respond):
+    """
+    The answer to a ride detail GET, with bodies built by ``respond(data,
+    status=...)``: a 304 when the client's copy is current, else the ride
+    with its validators. Finished rides may have been moved to the archive.
+    """
+    cached = get_cached_ride(pk)
+    if cached is None and _is_conditional(request):
+        # Answer a poll with a 304 from one indexed lookup, without loading
+        # or rendering the ride.
+        updated_at = read_through(lambda model: _updated_at(model, pk).first())
+        if updated_at is None:
+            return respond(NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
+        not_modified = not_modified_response(request, pk, updated_at)
+        if not_modified is not None:
+            return not_modified
+    if cached is None:
+        row = read_through(lambda model: _row(model, pk).first())
+        if row is None:
+            return respond(NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
+        cached = (row.updated_at, ride_renderer()(row))
+        # A replica may lag; only a row from the primary is safe to serve
+        # to everyone until TIMEOUT.
+        if not reading_from_replicas():
+            cache_ride(pk, *cached)
+    updated_at, data = cached
+    return not_modified_response(request, pk, updated_at) or with_validators(respond(data), pk, updated_at)
+
+
+async def aride_detail_response(request, pk, respond):
+    """``ride_detail_response`` on the async ORM and cache."""
+    cached = await aget_cached_ride(pk)
+    if cached is None and _is_conditional(request):
+        updated_at = await aread_through(lambda model: _updated_at(model, pk).afirst())
+        if updated_at is None:
+            return respond(NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
+        not_modified = not_modified_response(request, pk, updated_at)
+        if not_modified is not None:
+            return not_modified
+    if cached is None:
+        row = await aread_through(lambda model: _row(model, pk).afirst())
+        if row is None:
+            return respond(NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
+        cached = (row.updated_at, ride_renderer()(row))
+        if not reading_from_replicas():
+            await acache_ride(pk, *cached)
+    updated_at, data = cached
+    return not_modified_response(request, pk, updated_at) or with_validators(respond(data), pk, updated_at)
+
+
+@receiver(post_save, sender=Ride)
+@receiver(post_delete, sender=Ride)
+def invalidate_saved_ride(sender, instance, **kwargs):
+    invalidate_ride(instance.pk)
@@ -1,10 +1,238 @@
 # ride_sharing/ride_matching.py
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import Ride, UserProfile
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .events import publish_ride_event
+from .geo import haversine_km, point_coordinates
+from .heatmap import record_ride_event
+from .models import ACTIVE_STATUSES, Ride, UserProfile
+from .presence import BUSY, get_presence_registry, set_driver_state
+from .ride_cache import invalidate_rides
+from .serializers import render_ride
+
+# How many nearby drivers to pull from the index before checking them against
+# the database; inactive or re-roled drivers are skipped in distance order.
+MATCH_CANDIDATES = 10
 
-def match_ride_with_driver(ride):
-    available_drivers = User.objects.filter(
-        is_active=True, 
+
+def available_drivers_queryset(ride=None):
+    """Active drivers who are not on a trip (and are not the ride's own rider)."""
+    drivers = User.objects.filter(
+        is_active=True,
         profile__role='DRIVER'
-    ).exclude(id=ride.rider.id)
-    return available_drivers.first() if available_drivers.exists() else None
\ No newline at end of file
+    ).exclude(rides_as_driver__status__in=ACTIVE_STATUSES)
+    if ride is not None:
+        drivers = drivers.exclude(id=ride.rider_id)
+    return drivers.select_related('profile')
+
+
+def nearest_drivers(ride, k=MATCH_CANDIDATES, exclude=()):
+    """
+    Return up to k (driver_id, distance_km) pairs of ONLINE drivers closest
+    to the ride's current location; distance is None for unlocated rides.
+    """
+    registry = get_presence_registry()
+    exclude = {ride.rider_id, *exclude}
+    coordinates = point_coordinates(ride.current_location)
+    if coordinates is None:
+        return [(driver_id, None) for driver_id in registry.available(limit=k, exclude=exclude)]
+    lng, lat = coordinates
+    return registry.nearest_available(lng, lat, k=k, exclude=exclude)
+
+
+def match_ride_with_driver(ride, exclude=()):
+    """
+    Pick the nearest ONLINE driver for ``ride`` from the presence registry,
+    skipping driver ids in ``exclude``. Drivers without a live heartbeat are
+    never matched; busy ones are rejected again by Ride.objects.assign_driver.
+    """
+    candidates = [driver_id for driver_id, _ in nearest_drivers(ride, exclude=exclude)]
+    if not candidates:
+        return None
+    # Primary-key lookup only: role and trip state come from the registry.
+    drivers = User.objects.filter(is_active=True).in_bulk(candidates)
+    for driver_id in candidates:
+        if driver_id in drivers:
+            return drivers[driver_id]
+    return None
+
+
+class MatchingStrategy:
+    """
+    Solves one batch assignment.
+
+    ``assign`` receives a rides x drivers matrix of pickup distances (``None``
+    where a pairing is not allowed) and returns ``(ride_index, driver_index)``
+    pairs; each ride and each driver may appear at most once.
+    """
+
+    def assign(self, costs):
+        raise NotImplementedError
+
+
+class GreedyStrategy(MatchingStrategy):
+    """Repeatedly takes the globally shortest remaining pickup."""
+
+    def assign(self, costs):
+        pairs = sorted(
+            (cost, i, j)
+            for i, row in enumerate(costs)
+            for j, cost in enumerate(row)
+            if cost is not None
+        )
+        used_rides, used_drivers, result = set(), set(), []
+        for _, i, j in pairs:
+            if i in used_rides or j in used_drivers:
+                continue
+            used_rides.add(i)
+            used_drivers.add(j)
+            result.append((i, j))
+        return result
+
+
+class HungarianStrategy(MatchingStrategy):
+    """Minimises total pickup distance (Kuhn-Munkres, O(n^2 m))."""
+
+    def assign(self, costs):
+        if not costs or not costs[0]:
+            return []
+        transposed = len(costs) > len(costs[0])
+        if transposed:
+            costs = [list(column) for column in zip(*costs)]
+        finite = [cost for row in costs for cost in row if cost is not None]
+        if not finite:
+            return []
+        forbidden = (max(finite) + 1) * (len(costs) + 1)
+        n, m = len(costs), len(costs[0])
+        # Shortest augmenting path with row/column potentials, 1-indexed.
+        u, v = [0.0] * (n + 1), [0.0] * (m + 1)
+        owner, way = [0] * (m + 1), [0] * (m + 1)
+        for i in range(1, n + 1):
+            owner[0] = i
+            j0 = 0
+            min_to = [float('inf')] * (m + 1)
+            used = [False] * (m + 1)
+            while True:
+                used[j0] = True
+                i0, delta, j1 = owner[j0], float('inf'), 0
+                for j in range(1, m + 1):
+                    if used[j]:
+                        continue
+                    cost = costs[i0 - 1][j - 1]
+                    current = (forbidden if cost is None else cost) - u[i0] - v[j]
+                    if current < min_to[j]:
+                        min_to[j], way[j] = current, j0
+                    if min_to[j] < delta:
+                        delta, j1 = min_to[j], j
+                for j in range(m + 1):
+                    if used[j]:
+                        u[owner[j]] += delta
+                        v[j] -= delta
+                    else:
+                        min_to[j] -= delta
+                j0 = j1
+                if owner[j0] == 0:
+                    break
+            while j0:
+                j1 = way[j0]
+                owner[j0] = owner[j1]
+                j0 = j1
+        result = []
+        for j in range(1, m + 1):
+            i = owner[j]
+            if i and costs[i - 1][j - 1] is not None:
+                result.append((j - 1, i - 1) if transposed else (i - 1, j - 1))
+        return result
+
+
+MATCHING_STRATEGIES = {
+    'greedy': GreedyStrategy,
+    'hungarian': HungarianStrategy,
+}
+
+
+def get_matching_strategy(name=None):
+    """Resolve a strategy by registry name or dotted path, defaulting to settings.RIDE_MATCHING_STRATEGY."""
+    name = name or getattr(settings, 'RIDE_MATCHING_STRATEGY', 'greedy')
+    strategy_class = MATCHING_STRATEGIES.get(name) or import_string(name)
+    return strategy_class()
+
+
+def batch_match_rides(rides=None, strategy=None, window_seconds=None, max_distance_km=None,
+                      candidates_per_ride=MATCH_CANDIDATES):
+    """
+    Assign many REQUESTED rides to indexed drivers in one pass.
+
+    Rides without a current location cannot be placed and are left pending.
+    Returns the list of rides that were matched; all of them are written with
+    a single bulk_update.
+    """
+    if not isinstance(strategy, MatchingStrategy):
+        strategy = get_matching_strategy(strategy)
+    with transaction.atomic():
+        if rides is None:
+            rides = Ride.objects.filter(status='REQUESTED')
+            if window_seconds:
+                rides = rides.filter(created_at__gte=timezone.now() - timedelta(seconds=window_seconds))
+            rides = rides.select_related('rider').select_for_update(of=('self',)).order_by('created_at', 'id')
+        located = []
+        for ride in rides:
+            coordinates = point_coordinates(ride.current_location)
+            if coordinates is not None:
+                located.append((ride, coordinates))
+        if not located:
+            return []
+
+        # Only the few drivers nearest to some ride in the batch can win a
+        # pairing, so the matrix stays rides x (rides * candidates_per_ride).
+        candidate_ids = {}
+        registry = get_presence_registry()
+        for ride, (lng, lat) in located:
+            for driver_id, _ in registry.nearest_available(
+                    lng, lat, k=candidates_per_ride, exclude={ride.rider_id},
+                    max_radius_km=max_distance_km):
+                candidate_ids[driver_id] = None
+        if not candidate_ids:
+            return []
+        drivers = available_drivers_queryset().select_for_update(of=('self',)).in_bulk(list(candidate_ids))
+        driver_positions = [(driver_id, registry.get(driver_id)) for driver_id in candidate_ids
+                            if driver_id in drivers]
+        driver_positions = [(driver_id, presence.position) for driver_id, presence in driver_positions if presence]
+        if not driver_positions:
+            return []
+
+        costs = []
+        for ride, (lng, lat) in located:
+            row = []
+            for driver_id, (d_lng, d_lat) in driver_positions:
+                distance = haversine_km(lng, lat, d_lng, d_lat)
+                if driver_id == ride.rider_id or (max_distance_km is not None and distance > max_distance_km):
+                    distance = None
+                row.append(distance)
+            costs.append(row)
+
+        now = timezone.now()
+        matched = []
+        for ride_index, position_index in strategy.assign(costs):
+            ride = located[ride_index][0]
+            ride.driver = drivers[driver_positions[position_index][0]]
+            ride.status = 'ACCEPTED'
+            ride.updated_at = now
+            matched.append(ride)
+        Ride.objects.bulk_update(matched, ['driver', 'status', 'updated_at'])
+        invalidate_rides([ride.pk for ride in matched])
+        busy_driver_ids = [ride.driver_id for ride in matched]
+
+        def mark_busy():
+            for driver_id in busy_driver_ids:
+                set_driver_state(driver_id, BUSY)
+        transaction.on_commit(mark_busy)
+        for ride in matched:
+            record_ride_event('acceptance', ride)
+            # The same payload RideAcceptView publishes.
+            publish_ride_event(ride.pk, 'accepted', render_ride(ride))
+    return matched
@@ -1,5 +1,6 @@
 # ride_sharing/serializers.py
-from rest_framework import serializers
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 from django.contrib.auth.models import User
 from .models import UserProfile, Ride
 import json
@@ -74,4 +75,73 @@ class RideSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ride
         fields = ['id', 'rider', 'driver', 'pickup_location', 'dropoff_location', 
-                 'status', 'created_at', 'updated_at', 'current_location','city']
\ No newline at end of file
+                 'status', 'created_at', 'updated_at', 'current_location','city']
+
+# Fast path for ride responses: the same dicts RideSerializer produces, built
+# from .values_list() rows without model instances or per-field dispatch.
+RIDE_ROW_FIELDS = (
+    'id', 'rider__username', 'driver__username', 'pickup_location', 'dropoff_location',
+    'status', 'created_at', 'updated_at', 'current_location', 'city',
+)
+
+
+def ride_rows(queryset, *extra, named=False):
+    """``queryset`` as RIDE_ROW_FIELDS tuples, followed by any ``extra`` fields."""
+    return queryset.values_list(*RIDE_ROW_FIELDS, *extra, named=named)
+
+
+def datetime_renderer():
+    """
+    DateTimeField.to_representation for the active time zone. Aware values
+    in ISO 8601 mode skip DRF's generic path; everything else goes through it.
+    """
+    field = serializers.DateTimeField()
+    tz = field.default_timezone()
+    if tz is None or api_settings.DATETIME_FORMAT is None or api_settings.DATETIME_FORMAT.lower() != ISO_8601:
+        return field.to_representation
+
+    def render(value):
+        if value is None or value.tzinfo is None:
+            return field.to_representation(value)
+        text = value.astimezone(tz).isoformat()
+        return text[:-6] + 'Z' if text.endswith('+00:00') else text
+    return render
+
+
+def ride_renderer():
+    """
+    Return ``render(row)`` turning a RIDE_ROW_FIELDS tuple into the dict
+    RideSerializer would produce. Riders and drivers are rendered as their
+    username, which is what ``str(user)`` gives for the default User model.
+    """
+    render_datetime = datetime_renderer()
+
+    def render(row):
+        pk, rider, driver, pickup, dropoff, status, created_at, updated_at, location, city = row
+        return {
+            'id': pk,
+            'rider': rider,
+            'driver': driver,
+            'pickup_location': pickup,
+            'dropoff_location': dropoff,
+            'status': status,
+            'created_at': render_datetime(created_at),
+            'updated_at': render_datetime(updated_at),
+            'current_location': location,
+            'city': city,
+        }
+    return render
+
+
+def render_rides(rows):
+    render = ride_renderer()
+    return [render(row) for row in rows]
+
+
+def render_ride(ride):
+    """RideSerializer(ride).data for a loaded Ride instance, without the serializer machinery."""
+    return ride_renderer()((
+        ride.id, str(ride.rider), None if ride.driver_id is None else str(ride.driver),
+        ride.pickup_location, ride.dropoff_location, ride.status, ride.created_at,
+        ride.updated_at, ride.current_location, ride.city,
+    ))
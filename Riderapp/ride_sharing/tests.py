@@ -1,9 +1,51 @@
-from rest_framework.test import APITestCase
+from django.db import connection
+from django.db import OperationalError, close_old_connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient, APITestCase
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from django.urls import resolve
+from django.core.cache import cache
 from django.contrib.auth.models import User
-from ride_sharing.models import UserProfile, Ride
-from unittest.mock import patch
+from ride_sharing.models import ArchivedRide, RideTrailSegment, UserProfile, Ride
+from ride_sharing.authentication import get_cached_user, get_user_cache
+from ride_sharing.driver_index import DriverIndex
+from ride_sharing.presence import BUSY, InMemoryPresenceRegistry, get_presence_registry
+from ride_sharing.estimates import TravelGrid
+from ride_sharing.geo import geohash_encode, haversine_km, haversine_many, simplify_path
+from ride_sharing.heatmap import DemandHeatmap, SlidingWindowCounter, get_heatmap
+from ride_sharing.city_index import CityIndex
+from ride_sharing.events import InProcessBroker
+from ride_sharing.geocoding import CachedGeocoder, FakeGeocoder, get_geocoder
+from ride_sharing.ingest import finish_trail, get_location_buffer
+from ride_sharing.instrumentation import metrics, timed
+from ride_sharing.loadtest import (
+    Sample, Workload, parse_mix, percentile, run_asgi, run_wsgi, seed_population, summarize,
+)
+from ride_sharing.registration import register_stream
+from ride_sharing.replicas import ReplicaRouter, RoutingState, _state as routing_state, pin_to_primary
+from ride_sharing.ride_cache import get_cached_ride
+from ride_sharing.ttl_cache import TTLCache
+from ride_sharing.trails import append_trails, simplify_trail, trail_segments
+from ride_sharing.renderers import FastJSONRenderer
+from ride_sharing.serializers import RideSerializer, render_ride, render_rides, ride_rows
+from ride_sharing.ride_matching import (
+    GreedyStrategy, HungarianStrategy, batch_match_rides, match_ride_with_driver,
+)
+from unittest.mock import ANY, patch
+from datetime import timedelta
+from django.utils import timezone
+from django.core.management import call_command
+from asgiref.sync import sync_to_async
+from rest_framework_simplejwt.tokens import AccessToken
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+import time
 
 class UserRegistrationTests(APITestCase):
     def setUp(self):
@@ -33,4 +75,1235 @@ class UserRegistrationTests(APITestCase):
         user = User.objects.get(username='testuser')
         self.assertEqual(user.email, 'test@example.com')
 
-    
\ No newline at end of file
+    
+class DriverIndexTests(SimpleTestCase):
+    def test_nearest_orders_by_distance_and_honours_exclude(self):
+        index = DriverIndex()
+        index.update(1, 77.5946, 12.9716)
+        index.update(2, 77.6000, 12.9800)
+        index.update(3, 77.7000, 13.1000)
+        nearest = index.nearest(77.5950, 12.9720, k=2)
+        self.assertEqual([driver_id for driver_id, _ in nearest], [1, 2])
+        nearest = index.nearest(77.5950, 12.9720, k=2, exclude={1})
+        self.assertEqual([driver_id for driver_id, _ in nearest], [2, 3])
+
+    def test_update_moves_driver_between_cells(self):
+        index = DriverIndex()
+        index.update(1, 77.5946, 12.9716)
+        index.update(1, 72.8777, 19.0760)
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.nearest(72.88, 19.07, k=1)[0][0], 1)
+        self.assertEqual(index.nearest(77.59, 12.97, k=1, max_radius_km=5), [])
+
+
+class RideMatchingTests(TestCase):
+    def setUp(self):
+        self.rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=self.rider, role='RIDER')
+        self.far_driver = User.objects.create_user(username='far', password='test123')
+        UserProfile.objects.create(user=self.far_driver, role='DRIVER')
+        self.near_driver = User.objects.create_user(username='near', password='test123')
+        UserProfile.objects.create(user=self.near_driver, role='DRIVER')
+        self.ride = Ride.objects.create(
+            rider=self.rider, pickup_location='A', dropoff_location='B',
+            current_location={'type': 'Point', 'coordinates': [77.5946, 12.9716]},
+        )
+
+    def tearDown(self):
+        get_presence_registry().clear()
+
+    def test_match_prefers_nearest_online_driver(self):
+        registry = get_presence_registry()
+        registry.heartbeat(self.far_driver.id, 77.70, 13.10)
+        registry.heartbeat(self.near_driver.id, 77.60, 12.98)
+        with self.assertNumQueries(1):
+            self.assertEqual(match_ride_with_driver(self.ride), self.near_driver)
+        registry.set_state(self.near_driver.id, BUSY)
+        self.assertEqual(match_ride_with_driver(self.ride), self.far_driver)
+
+    def test_offline_drivers_are_not_matched(self):
+        self.assertIsNone(match_ride_with_driver(self.ride))
+
+
+class BatchMatchingTests(TestCase):
+    def setUp(self):
+        self.drivers = []
+        for n in range(2):
+            driver = User.objects.create_user(username=f'driver{n}', password='test123')
+            UserProfile.objects.create(user=driver, role='DRIVER')
+            self.drivers.append(driver)
+        self.rides = []
+        for n, lng in enumerate([77.590, 77.600]):
+            rider = User.objects.create_user(username=f'rider{n}', password='test123')
+            UserProfile.objects.create(user=rider, role='RIDER')
+            self.rides.append(Ride.objects.create(
+                rider=rider, pickup_location='A', dropoff_location='B',
+                current_location={'type': 'Point', 'coordinates': [lng, 12.97]},
+            ))
+
+    def tearDown(self):
+        get_presence_registry().clear()
+
+    def test_hungarian_beats_greedy_on_total_distance(self):
+        costs = [[1, 2], [2, 100]]
+        self.assertEqual(sorted(GreedyStrategy().assign(costs)), [(0, 0), (1, 1)])
+        self.assertEqual(sorted(HungarianStrategy().assign(costs)), [(0, 1), (1, 0)])
+        self.assertEqual(HungarianStrategy().assign([[None, 3]]), [(0, 1)])
+
+    def test_batch_match_assigns_each_driver_once(self):
+        get_presence_registry().heartbeat(self.drivers[0].id, 77.591, 12.97)
+        get_presence_registry().heartbeat(self.drivers[1].id, 77.601, 12.97)
+        with patch('ride_sharing.ride_matching.publish_ride_event') as publish, \
+                self.assertNumQueries(5):  # savepoint, rides, drivers, bulk_update, release
+            matched = batch_match_rides(strategy='hungarian')
+        self.assertEqual(len(matched), 2)
+        self.rides[0].refresh_from_db()
+        self.rides[1].refresh_from_db()
+        self.assertEqual(self.rides[0].driver, self.drivers[0])
+        self.assertEqual(self.rides[1].driver, self.drivers[1])
+        self.assertEqual(self.rides[1].status, 'ACCEPTED')
+        # Subscribers get the same ride dict as from RideAcceptView.
+        publish.assert_any_call(self.rides[1].pk, 'accepted',
+                                render_ride(Ride.objects.with_related().get(pk=self.rides[1].pk)))
+
+
+class RideListTests(APITestCase):
+    def setUp(self):
+        self.rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=self.rider, role='RIDER')
+        for n in range(5):
+            Ride.objects.create(rider=self.rider, pickup_location=f'P{n}', dropoff_location='D',
+                                city='Pune' if n % 2 else 'Delhi')
+        self.client.force_authenticate(user=self.rider)
+
+    def test_keyset_pages_cover_every_ride_once(self):
+        seen = []
+        url = '/api/rides/list/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(ride['id'] for ride in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, sorted(Ride.objects.values_list('id', flat=True), reverse=True))
+
+    def test_filters_and_ndjson_export(self):
+        response = self.client.get('/api/rides/list/', {'city': 'Pune', 'status': 'REQUESTED'})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(self.client.get('/api/rides/list/', {'status': 'NOPE'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/rides/list/', {'export': 'ndjson', 'city': 'Delhi'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['city'] for line in lines], ['Delhi'] * 3)
+
+
+class RideQueryCountTests(APITestCase):
+    """Each ride endpoint must cost a fixed number of queries, however many rides exist."""
+
+    def setUp(self):
+        self.rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=self.rider, role='RIDER')
+        self.driver = User.objects.create_user(username='driver1', password='test123')
+        UserProfile.objects.create(user=self.driver, role='DRIVER')
+
+    def seed(self, count):
+        # Free the driver from the previous round's trip.
+        Ride.objects.filter(status='ACCEPTED').update(status='COMPLETED')
+        Ride.objects.bulk_create([
+            Ride(rider=self.rider, driver=self.driver, pickup_location='A', dropoff_location='B', status='COMPLETED')
+            for _ in range(count)
+        ])
+        return Ride.objects.create(rider=self.rider, pickup_location='A', dropoff_location='B')
+
+    def authenticate(self, user):
+        # A fresh instance per request, as JWT authentication would load it.
+        self.client.force_authenticate(user=User.objects.get(pk=user.pk))
+
+    def count_queries(self, method, url, user, data=None):
+        self.authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 300, response.content)
+        return len(queries)
+
+    def assert_constant(self, expected, method, url_for, user, data=None):
+        for count in (1, 20):
+            ride = self.seed(count)
+            self.assertEqual(self.count_queries(method, url_for(ride), user, data), expected)
+
+    def test_list(self):
+        self.assert_constant(1, 'get', lambda ride: '/api/rides/list/', self.rider)
+
+    def test_detail(self):
+        self.assert_constant(1, 'get', lambda ride: f'/api/rides/{ride.pk}/', self.rider)
+
+    def test_accept(self):
+        # ride, profile, then savepoint / driver lock / conditional update / release
+        self.assert_constant(6, 'post', lambda ride: f'/api/rides/{ride.pk}/accept/', self.driver)
+
+    def test_status_update(self):
+        self.assert_constant(2, 'patch', lambda ride: f'/api/rides/{ride.pk}/update_status/', self.rider,
+                             {'status': 'CANCELLED'})
+
+    def test_match(self):
+        def url_for(ride):
+            Ride.objects.filter(status='REQUESTED').exclude(pk=ride.pk).update(status='CANCELLED')
+            get_presence_registry().heartbeat(self.driver.id, 77.59, 12.97)
+            return '/api/rides/match_driver/'
+        self.addCleanup(get_presence_registry().clear)
+        self.assert_constant(6, 'post', url_for, self.rider)
+
+
+FAKE_GEOCODING = {'BACKEND': 'ride_sharing.geocoding.FakeGeocoder', 'OPTIONS': {'city': 'Bengaluru'}}
+
+
+class GeocodingTests(SimpleTestCase):
+    def test_cache_keys_on_rounded_coordinates(self):
+        geocoder = CachedGeocoder(FakeGeocoder(), maxsize=10, ttl=60, precision=3)
+        geocoder.reverse(77.59461, 12.97161)
+        geocoder.reverse(77.59464, 12.97158)
+        self.assertEqual(geocoder.backend.calls, 1)
+        self.assertEqual(geocoder.cache.hit_rate, 0.5)
+
+    def test_async_reverse_shares_the_cache(self):
+        geocoder = CachedGeocoder(FakeGeocoder(delay=0.01), maxsize=10, ttl=60, precision=3)
+        self.assertEqual(asyncio.run(geocoder.areverse(77.59461, 12.97161)), 'Testville')
+        self.assertEqual(geocoder.reverse(77.59464, 12.97158), 'Testville')
+        self.assertEqual(geocoder.backend.calls, 1)
+
+    def test_ttl_cache_expires_and_evicts(self):
+        cache = TTLCache(maxsize=1, ttl=0)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+        cache = TTLCache(maxsize=1, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 2)
+
+
+class RideLocationUpdateTests(APITestCase):
+    def setUp(self):
+        self.rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=self.rider, role='RIDER')
+        self.ride = Ride.objects.create(rider=self.rider, pickup_location='A', dropoff_location='B')
+        self.client.force_authenticate(user=self.rider)
+        self.url = f'/api/rides/location/{self.ride.pk}'
+        self.point = {'current_location': {'type': 'Point', 'coordinates': [77.5946, 12.9716]}}
+
+    @override_settings(GEOCODING=FAKE_GEOCODING)
+    def test_city_resolved_inline_through_cache(self):
+        for _ in range(2):
+            response = self.client.post(self.url, self.point, format='json')
+            self.assertEqual(response.data['city'], 'Bengaluru')
+        self.assertEqual(get_geocoder().backend.calls, 1)
+
+    @override_settings(GEOCODING={**FAKE_GEOCODING, 'ASYNC': True})
+    def test_async_mode_defers_uncached_lookup(self):
+        with patch('ride_sharing.views.get_city_resolver') as resolver:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(self.url, self.point, format='json')
+        self.assertIsNone(response.data['city'])
+        resolver.return_value.submit.assert_called_once_with(self.ride.pk, 77.5946, 12.9716)
+
+
+CITY_BOUNDARIES = {
+    'type': 'FeatureCollection',
+    'features': [{
+        'type': 'Feature',
+        'properties': {'name': 'Squareville'},
+        'geometry': {'type': 'Polygon', 'coordinates': [
+            [[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]],
+            [[4, 4], [6, 4], [6, 6], [4, 6], [4, 4]],
+        ]},
+    }],
+}
+
+
+class CityIndexTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cities.geojson')
+        with open(self.path, 'w') as f:
+            json.dump(CITY_BOUNDARIES, f)
+
+    def test_point_in_polygon_respects_holes(self):
+        index = CityIndex.from_geojson(CITY_BOUNDARIES)
+        self.assertEqual(index.lookup(1, 1), 'Squareville')
+        self.assertIsNone(index.lookup(5, 5))
+        self.assertIsNone(index.lookup(11, 1))
+
+    def test_load_writes_and_reuses_pickle(self):
+        CityIndex.load(self.path)
+        self.assertTrue(os.path.exists(self.path + '.pickle'))
+        self.assertEqual(CityIndex.load(self.path).lookup(1, 1), 'Squareville')
+
+    def test_geocoder_answers_service_cities_offline(self):
+        with override_settings(GEOCODING={**FAKE_GEOCODING, 'CITY_BOUNDARIES': self.path}):
+            geocoder = get_geocoder()
+            self.assertEqual(geocoder.reverse(1, 1), 'Squareville')
+            self.assertEqual(geocoder.reverse(20, 20), 'Bengaluru')
+            self.assertEqual(geocoder.backend.calls, 1)
+
+
+@override_settings(
+    GEOCODING=FAKE_GEOCODING,
+    LOCATION_INGEST={'MAX_BATCH': 100, 'MAX_DELAY': 60, 'BACKGROUND_FLUSH': False},
+)
+class LocationBatchTests(APITestCase):
+    def setUp(self):
+        self.rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=self.rider, role='RIDER')
+        self.driver = User.objects.create_user(username='driver1', password='test123')
+        UserProfile.objects.create(user=self.driver, role='DRIVER')
+        self.ride = Ride.objects.create(rider=self.rider, driver=self.driver, pickup_location='A',
+                                        dropoff_location='B', status='ACCEPTED')
+        self.other = Ride.objects.create(rider=self.rider, pickup_location='A', dropoff_location='B')
+        self.client.force_authenticate(user=self.driver)
+
+    def tearDown(self):
+        get_presence_registry().clear()
+
+    def test_buffers_and_flushes_latest_position(self):
+        ts = int(time.time())
+        response = self.client.post('/api/rides/locations/batch/', {'points': [
+            {'ride_id': self.ride.pk, 'lng': 77.60, 'lat': 12.98, 'ts': ts},
+            {'ride_id': self.ride.pk, 'lng': 77.50, 'lat': 12.90, 'ts': ts - 1},
+            {'ride_id': self.other.pk, 'lng': 77.50, 'lat': 12.90, 'ts': ts - 1},
+            {'ride_id': self.ride.pk, 'lng': 500, 'lat': 12.90},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data, {'accepted': 2, 'rejected': 2})
+        presence = get_presence_registry().get(self.driver.id)
+        self.assertEqual((presence.position, presence.state), ((77.60, 12.98), BUSY))
+        # Rides: one read, one bulk update. Trails: savepoint, read, insert, release.
+        with patch('ride_sharing.ingest.get_city_resolver') as resolver, \
+                patch('ride_sharing.ingest.publish_ride_event') as publish, self.assertNumQueries(6):
+            self.assertEqual(get_location_buffer().flush(), 1)
+        resolver.return_value.submit.assert_called_once_with(self.ride.pk, 77.60, 12.98)
+        publish.assert_called_once_with(self.ride.pk, 'location',
+                                        render_ride(Ride.objects.with_related().get(pk=self.ride.pk)))
+        self.ride.refresh_from_db()
+        self.assertEqual(self.ride.current_location['coordinates'], [77.60, 12.98])
+        self.assertEqual(list(trail_segments(self.ride.pk)), [[(77.5, 12.9, ts - 1), (77.6, 12.98, ts)]])
+
+    def test_rejects_timestamps_outside_the_window(self):
+        self.addCleanup(get_location_buffer().clear)
+        ts = int(time.time())
+        response = self.client.post('/api/rides/locations/batch/', {'points': [
+            {'ride_id': self.ride.pk, 'lng': 77.50, 'lat': 12.90, 'ts': 'nan'},
+            {'ride_id': self.ride.pk, 'lng': 77.50, 'lat': 12.90, 'ts': 'inf'},
+            {'ride_id': self.ride.pk, 'lng': 77.50, 'lat': 12.90, 'ts': 0},
+            {'ride_id': self.ride.pk, 'lng': 77.50, 'lat': 12.90, 'ts': ts + 3600},
+            {'ride_id': self.ride.pk, 'lng': 77.60, 'lat': 12.98, 'ts': ts},
+        ]}, format='json')
+        self.assertEqual(response.data, {'accepted': 1, 'rejected': 4})
+        with patch('ride_sharing.ingest.get_city_resolver'):
+            self.assertEqual(get_location_buffer().flush(), 1)
+        self.assertEqual(list(trail_segments(self.ride.pk)), [[(77.6, 12.98, ts)]])
+
+    def test_finishing_a_trail_flushes_only_that_ride(self):
+        buffer = get_location_buffer()
+        self.addCleanup(buffer.clear)
+        buffer.add([(self.ride.pk, 77.60, 12.98, 1), (self.other.pk, 77.50, 12.90, 1)])
+        with patch('ride_sharing.ingest.get_city_resolver'), \
+                patch('ride_sharing.ingest.get_trail_executor') as executor:
+            finish_trail(self.ride.pk)
+        executor.return_value.submit.assert_called_once()
+        self.assertEqual(list(trail_segments(self.ride.pk)), [[(77.6, 12.98, 1.0)]])
+        self.assertEqual(list(trail_segments(self.other.pk)), [])
+        self.assertEqual(len(buffer), 1)
+
+
+class RideEventStreamTests(APITestCase):
+    def setUp(self):
+        self.rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=self.rider, role='RIDER')
+        self.driver = User.objects.create_user(username='driver1', password='test123')
+        UserProfile.objects.create(user=self.driver, role='DRIVER')
+        self.ride = Ride.objects.create(rider=self.rider, pickup_location='A', dropoff_location='B')
+
+    def accept(self):
+        self.client.force_authenticate(user=self.driver)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/rides/{self.ride.pk}/accept/')
+
+    async def test_stream_pushes_accept_event(self):
+        token = str(AccessToken.for_user(self.rider))
+        response = await self.async_client.get(f'/api/rides/{self.ride.pk}/events/', {'token': token})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        await sync_to_async(self.accept)()
+        chunk = (await anext(stream)).decode()
+        self.assertTrue(chunk.startswith('event: accepted\n'))
+        self.assertEqual(json.loads(chunk.split('data: ', 1)[1])['data']['driver'], 'driver1')
+        await stream.aclose()
+
+    async def test_stream_rejects_other_users(self):
+        token = str(AccessToken.for_user(self.driver))
+        response = await self.async_client.get(f'/api/rides/{self.ride.pk}/events/', {'token': token})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = await self.async_client.get(f'/api/rides/{self.ride.pk}/events/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class InProcessBrokerTests(SimpleTestCase):
+    def test_fans_out_across_threads_and_drops_oldest_when_full(self):
+        broker = InProcessBroker()
+
+        async def scenario():
+            first = broker.subscribe('ride:1', maxsize=2)
+            second = broker.subscribe('ride:1', maxsize=2)
+            await sync_to_async(broker.publish, thread_sensitive=False)('ride:1', 'a')
+            for event in ('b', 'c'):
+                broker.publish('ride:1', event)
+            await asyncio.sleep(0)
+            received = [await first.get(timeout=1), await first.get(timeout=1)]
+            self.assertEqual(await second.get(timeout=1), 'b')
+            first.close()
+            second.close()
+            return received
+
+        self.assertEqual(asyncio.run(scenario()), ['b', 'c'])
+        self.assertEqual(broker.subscriber_count('ride:1'), 0)
+
+
+class RideAcceptRaceTests(TransactionTestCase):
+    """Many drivers accepting the same ride at once must produce exactly one winner."""
+    drivers = 8
+
+    def setUp(self):
+        self.rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=self.rider, role='RIDER')
+        self.driver_users = []
+        for n in range(self.drivers):
+            driver = User.objects.create_user(username=f'driver{n}', password='test123')
+            UserProfile.objects.create(user=driver, role='DRIVER')
+            self.driver_users.append(driver)
+        self.ride = Ride.objects.create(rider=self.rider, pickup_location='A', dropoff_location='B')
+
+    def test_concurrent_accepts_have_one_winner(self):
+        if connection.vendor == 'sqlite':
+            if connection.is_in_memory_db():
+                # Shared-cache connections fail on a table lock at once
+                # rather than waiting for it, so contention cannot be told
+                # apart from a broken accept.
+                self.skipTest("Needs a database whose connections wait on locks")
+            # Take the write lock at BEGIN; a deferred transaction that reads
+            # and then writes fails with "database is locked" instead of waiting.
+            options = connection.settings_dict['OPTIONS']
+            if 'transaction_mode' not in options:
+                options['transaction_mode'] = 'IMMEDIATE'
+                self.addCleanup(options.pop, 'transaction_mode')
+        barrier = threading.Barrier(self.drivers)
+        results = []
+        lock_errors = []
+
+        def accept(driver):
+            client = APIClient()
+            client.force_authenticate(user=driver)
+            barrier.wait()
+            try:
+                results.append(client.post(f'/api/rides/{self.ride.pk}/accept/').status_code)
+            except OperationalError as e:
+                lock_errors.append(e)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=accept, args=(driver,)) for driver in self.driver_users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Writers wait on the lock; none may fail on it.
+        self.assertEqual(lock_errors, [])
+        self.assertEqual(results.count(status.HTTP_200_OK), 1)
+        self.assertEqual(results.count(status.HTTP_200_OK) + results.count(status.HTTP_409_CONFLICT)
+                         + results.count(status.HTTP_400_BAD_REQUEST), self.drivers)
+        self.ride.refresh_from_db()
+        self.assertEqual(self.ride.status, 'ACCEPTED')
+        self.assertIn(self.ride.driver, self.driver_users)
+
+    def test_busy_driver_cannot_take_second_ride(self):
+        other = Ride.objects.create(rider=self.rider, pickup_location='C', dropoff_location='D')
+        driver = self.driver_users[0]
+        self.assertTrue(Ride.objects.assign_driver(self.ride.pk, driver))
+        self.assertFalse(Ride.objects.assign_driver(other.pk, driver))
+        self.assertFalse(Ride.objects.assign_driver(self.ride.pk, self.driver_users[1]))
+
+
+class RideStatusTransitionTests(APITestCase):
+    def setUp(self):
+        self.rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=self.rider, role='RIDER')
+        self.ride = Ride.objects.create(rider=self.rider, pickup_location='A', dropoff_location='B')
+        self.client.force_authenticate(user=self.rider)
+        self.url = f'/api/rides/{self.ride.pk}/update_status/'
+
+    def test_final_statuses_cannot_be_left(self):
+        self.assertEqual(self.client.patch(self.url, {'status': 'CANCELLED'}).status_code, status.HTTP_200_OK)
+        response = self.client.patch(self.url, {'status': 'REQUESTED'})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.ride.refresh_from_db()
+        self.assertEqual(self.ride.status, 'CANCELLED')
+
+    def test_accepted_requires_a_driver(self):
+        response = self.client.patch(self.url, {'status': 'ACCEPTED'})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_cancel_stale_requests_is_one_update(self):
+        fresh = Ride.objects.create(rider=self.rider, pickup_location='A', dropoff_location='B')
+        Ride.objects.filter(pk=self.ride.pk).update(created_at=self.ride.created_at - timedelta(hours=1))
+        with self.assertNumQueries(1):
+            self.assertEqual(Ride.objects.cancel_stale_requests(timedelta(minutes=15)), 1)
+        call_command('cancel_stale_rides', minutes=15, stdout=io.StringIO())
+        self.assertEqual(Ride.objects.get(pk=self.ride.pk).status, 'CANCELLED')
+        self.assertEqual(Ride.objects.get(pk=fresh.pk).status, 'REQUESTED')
+
+
+class RideSpatialQueryTests(APITestCase):
+    def setUp(self):
+        self.rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=self.rider, role='RIDER')
+        self.rides = {}
+        for name, lng, lat in [('centre', 77.5946, 12.9716), ('near', 77.6100, 12.9716),
+                               ('far', 77.7500, 12.9716), ('mumbai', 72.8777, 19.0760)]:
+            self.rides[name] = Ride.objects.create(
+                rider=self.rider, pickup_location=name, dropoff_location='B',
+                current_location={'type': 'Point', 'coordinates': [lng, lat]},
+            )
+        self.client.force_authenticate(user=self.rider)
+
+    def test_location_columns_follow_current_location(self):
+        ride = self.rides['centre']
+        self.assertEqual((ride.longitude, ride.latitude), (77.5946, 12.9716))
+        self.assertEqual(ride.geohash, 'tdr1v9qtj')
+        self.assertEqual(geohash_encode(10.40744, 57.64911, 11), 'u4pruydqqvj')
+
+    def test_nearby_orders_by_distance_within_radius(self):
+        response = self.client.get('/api/rides/nearby/', {'lat': 12.9716, 'lng': 77.5946, 'radius_km': 5})
+        self.assertEqual([ride['pickup_location'] for ride in response.data], ['centre', 'near'])
+        self.assertAlmostEqual(response.data[1]['distance_km'], 1.669, places=2)
+
+    def test_bounding_box(self):
+        response = self.client.get('/api/rides/within/', {
+            'min_lng': 77.5, 'min_lat': 12.9, 'max_lng': 77.7, 'max_lat': 13.0,
+        })
+        self.assertEqual({ride['pickup_location'] for ride in response.data['results']}, {'centre', 'near'})
+        response = self.client.get('/api/rides/within/', {'min_lng': 77.5, 'min_lat': 12.9})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DriverPresenceTests(APITestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.registry = InMemoryPresenceRegistry(ttl=30, clock=lambda: self.now)
+
+    def test_heartbeats_expire_after_ttl(self):
+        self.registry.heartbeat(1, 77.59, 12.97)
+        self.assertEqual(self.registry.nearest_available(77.59, 12.97, k=1)[0][0], 1)
+        self.now += 31
+        self.assertEqual(self.registry.nearest_available(77.59, 12.97, k=1), [])
+        self.assertIsNone(self.registry.get(1))
+
+    def test_busy_and_offline_drivers_are_unavailable(self):
+        self.registry.heartbeat(1, 77.59, 12.97, state=BUSY)
+        self.registry.heartbeat(2, 77.59, 12.97)
+        self.registry.heartbeat(2, 77.59, 12.97, state='OFFLINE')
+        self.assertEqual(self.registry.nearest_available(77.59, 12.97, k=2), [])
+        self.assertEqual(self.registry.available(limit=5), [])
+
+    def test_heartbeat_endpoint_requires_driver_role(self):
+        self.addCleanup(get_presence_registry().clear)
+        rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=rider, role='RIDER')
+        driver = User.objects.create_user(username='driver1', password='test123')
+        UserProfile.objects.create(user=driver, role='DRIVER')
+        self.client.force_authenticate(user=rider)
+        response = self.client.post('/api/drivers/heartbeat/', {'lng': 77.59, 'lat': 12.97}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=driver)
+        response = self.client.post('/api/drivers/heartbeat/', {'lng': 77.59, 'lat': 12.97}, format='json')
+        self.assertEqual(response.data, {'state': 'ONLINE', 'expires_in': 30})
+        self.assertEqual(get_presence_registry().get(driver.id).state, 'ONLINE')
+
+
+class DemandHeatmapTests(APITestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.heatmap = DemandHeatmap(window=60, buckets=6, cell_precision=6, clock=lambda: self.now)
+
+    def test_counter_forgets_events_older_than_window(self):
+        counter = SlidingWindowCounter(window=60, buckets=6)
+        counter.add(1000.0)
+        counter.add(1035.0, amount=2)
+        self.assertEqual(counter.total(1040.0), 3)
+        self.assertEqual(counter.total(1065.0), 2)
+        self.assertEqual(counter.total(1100.0), 0)
+
+    def test_snapshot_reports_open_requests_per_driver(self):
+        for _ in range(3):
+            self.heatmap.record_request('Bengaluru', 77.59, 12.97)
+        self.heatmap.record_acceptance('Bengaluru', 77.59, 12.97)
+        self.heatmap.record_driver(1, 77.59, 12.97, available=True)
+        self.heatmap.record_driver(2, 77.59, 12.97, available=False)
+        [cell] = self.heatmap.snapshot(level='cell')
+        self.assertEqual(cell['city'], 'Bengaluru')
+        self.assertEqual((cell['open_requests'], cell['available_drivers'], cell['demand_ratio']), (2, 1, 2.0))
+        [city] = self.heatmap.snapshot(level='city')
+        self.assertEqual((city['city'], city['requested'], city['accepted']), ('Bengaluru', 3, 1))
+        self.assertEqual(self.heatmap.snapshot(level='city', city='Mumbai'), [])
+
+    def test_drivers_move_between_cells_and_expire(self):
+        self.heatmap.record_driver(1, 77.59, 12.97, available=True)
+        self.heatmap.record_driver(1, 72.87, 19.07, available=True)
+        cells = {row['cell']: row['available_drivers'] for row in self.heatmap.snapshot()}
+        self.assertEqual(cells, {self.heatmap.cell(72.87, 19.07): 1})
+        self.now += 61
+        self.assertEqual(self.heatmap.snapshot(), [])
+
+    def test_endpoint_counts_created_and_accepted_rides(self):
+        get_heatmap().clear()
+        self.addCleanup(get_heatmap().clear)
+        self.addCleanup(get_presence_registry().clear)
+        rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=rider, role='RIDER')
+        driver = User.objects.create_user(username='driver1', password='test123')
+        UserProfile.objects.create(user=driver, role='DRIVER')
+        self.client.force_authenticate(user=rider)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/rides/', {
+                'pickup_location': 'A', 'dropoff_location': 'B', 'city': 'Bengaluru',
+                'current_location': {'type': 'Point', 'coordinates': [77.59, 12.97]},
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.client.force_authenticate(user=driver)
+        self.client.post('/api/drivers/heartbeat/', {'lng': 77.59, 'lat': 12.97}, format='json')
+        [cell] = self.client.get('/api/heatmap/').data['areas']
+        self.assertEqual(cell['available_drivers'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/api/rides/{response.data['id']}/accept/")
+        # The accepted driver stops counting as supply without waiting for their next ping.
+        [cell] = self.client.get('/api/heatmap/').data['areas']
+        self.assertEqual(cell['available_drivers'], 0)
+        response = self.client.get('/api/heatmap/', {'level': 'city'})
+        self.assertEqual(response.data['areas'], [{
+            'city': 'Bengaluru', 'requested': 1, 'accepted': 1, 'open_requests': 0,
+            'available_drivers': 0, 'demand_ratio': 0.0,
+        }])
+        self.assertEqual(self.client.get('/api/heatmap/', {'level': 'street'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+
+class LoadTestSummaryTests(SimpleTestCase):
+    def test_percentiles_use_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual([percentile(values, p) for p in (50, 95, 99, 100)], [50, 95, 99, 100])
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summary_groups_samples_by_endpoint(self):
+        samples = [Sample('list', 200, 10.0, 2), Sample('list', 200, 30.0, 2), Sample('accept', 500, 5.0, 4)]
+        report = summarize(samples, elapsed=2.0)
+        self.assertEqual(report['overall']['requests'], 3)
+        self.assertEqual(report['overall']['errors'], 1)
+        self.assertEqual(report['endpoints']['list']['latency_ms']['p50'], 10.0)
+        self.assertEqual(report['endpoints']['list']['throughput_rps'], 1.0)
+        self.assertEqual(report['endpoints']['accept']['queries_per_request'], {'mean': 4.0, 'max': 4})
+
+    def test_mix_rejects_unknown_operations(self):
+        self.assertEqual(parse_mix('list=3, accept'), {'list': 3, 'accept': 1})
+        with self.assertRaises(ValueError):
+            parse_mix('delete=1')
+
+
+@override_settings(GEOCODING=FAKE_GEOCODING)
+class LoadTestRunTests(TransactionTestCase):
+    def test_wsgi_and_asgi_runs_replay_the_mix(self):
+        self.addCleanup(get_presence_registry().clear)
+        self.addCleanup(get_heatmap().clear)
+        get_user_cache().clear()
+        self.addCleanup(get_user_cache().clear)
+        rider_ids, driver_ids, open_rides = seed_population(riders=5, drivers=5, rides=40)
+        # Authenticate every user once so the runs below only ever hit the user cache.
+        for user_id in (*rider_ids, *driver_ids):
+            get_cached_user(user_id)
+        for runner in (run_wsgi, run_asgi):
+            workload = Workload(rider_ids, driver_ids, open_rides, mix={'list': 1, 'create': 1, 'location': 1},
+                                label=runner.__name__)
+            samples, elapsed = runner(workload, requests=12, concurrency=1)
+            report = summarize(samples, elapsed)
+            self.assertEqual(report['overall']['requests'], 12)
+            self.assertEqual(report['overall']['errors'], 0)
+            # The page query alone; authentication is answered from the user cache.
+            self.assertEqual(report['endpoints']['list']['queries_per_request'], {'mean': 1.0, 'max': 1})
+
+    def test_asgi_run_against_async_views(self):
+        self.addCleanup(get_presence_registry().clear)
+        self.addCleanup(get_heatmap().clear)
+        rider_ids, driver_ids, open_rides = seed_population(riders=5, drivers=5, rides=40)
+        workload = Workload(rider_ids, driver_ids, open_rides, mix={'create': 1, 'location': 1, 'accept': 1},
+                            async_views=True)
+        self.assertTrue(workload.next_call().path.startswith('/api/async/rides/'))
+        samples, elapsed = run_asgi(workload, requests=12, concurrency=3)
+        self.assertEqual(summarize(samples, elapsed)['overall']['errors'], 0)
+
+
+@override_settings(GEOCODING=FAKE_GEOCODING, INSTRUMENTATION={'ENABLED': True, 'PROFILE_TOKEN': 'let-me-profile'})
+class InstrumentationTests(APITestCase):
+    def setUp(self):
+        metrics.clear()
+        self.addCleanup(metrics.clear)
+        self.rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=self.rider, role='RIDER')
+        self.ride = Ride.objects.create(rider=self.rider, pickup_location='A', dropoff_location='B')
+        self.client.force_authenticate(user=self.rider)
+        self.url = f'/api/rides/location/{self.ride.pk}'
+        self.point = {'current_location': {'type': 'Point', 'coordinates': [77.5946, 12.9716]}}
+
+    def test_records_view_sql_and_sections(self):
+        response = self.client.post(self.url, self.point, format='json')
+        timing = response['Server-Timing']
+        for section in ('total;', 'db;', 'geocode;', 'ride-save;', 'serialize;'):
+            self.assertIn(section, timing)
+        view = (('view', 'ride-location-update'),)
+        self.assertEqual(metrics.value('ride_http_requests_total',
+                                       (*view, ('method', 'POST'), ('status', 200))), 1)
+        self.assertEqual(metrics.value('ride_section_duration_seconds', (*view, ('section', 'ride.clean'))), 1)
+
+        body = self.client.get('/api/metrics/').content.decode()
+        self.assertIn('# TYPE ride_http_request_duration_seconds histogram', body)
+        self.assertIn('ride_http_requests_total{view="ride-location-update",method="POST",status="200"} 1', body)
+        self.assertIn('ride_db_queries_per_request_bucket{view="ride-location-update",le="+Inf"} 1', body)
+
+    def test_metrics_endpoint_is_local_only(self):
+        response = self.client.get('/api/metrics/', REMOTE_ADDR='10.0.0.8')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_profile_header_needs_the_token(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.settings(INSTRUMENTATION={'ENABLED': True, 'PROFILE_TOKEN': 'let-me-profile',
+                                                'PROFILE_DIR': directory}):
+                client = APIClient()
+                client.force_authenticate(user=self.rider)
+                refused = client.post(self.url, self.point, format='json', HTTP_X_PROFILE='guess')
+                profiled = client.post(self.url, self.point, format='json', HTTP_X_PROFILE='let-me-profile')
+            self.assertNotIn('X-Profile-File', refused)
+            self.assertEqual(os.listdir(directory), [profiled['X-Profile-File']])
+
+    @override_settings(DEBUG=True)
+    def test_profile_header_without_a_token_is_ignored_even_under_debug(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.settings(INSTRUMENTATION={'ENABLED': True, 'PROFILE_DIR': directory}):
+                client = APIClient()
+                client.force_authenticate(user=self.rider)
+                response = client.post(self.url, self.point, format='json', HTTP_X_PROFILE='1')
+            self.assertNotIn('X-Profile-File', response)
+            self.assertEqual(os.listdir(directory), [])
+
+    @override_settings(INSTRUMENTATION={'ENABLED': False})
+    def test_disabled_middleware_adds_nothing(self):
+        response = self.client.post(self.url, self.point, format='json')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(metrics.render().count('ride_http_requests_total{'), 0)
+        with timed('anything') as section:
+            self.assertIsNone(section)
+
+
+class CachedJWTAuthenticationTests(APITestCase):
+    def setUp(self):
+        get_user_cache().clear()
+        self.addCleanup(get_user_cache().clear)
+        self.addCleanup(get_presence_registry().clear)
+        self.addCleanup(get_heatmap().clear)
+        self.rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=self.rider, role='RIDER')
+        self.driver = User.objects.create_user(username='driver1', password='test123')
+        UserProfile.objects.create(user=self.driver, role='DRIVER')
+
+    def obtain(self, username):
+        response = self.client.post('/api/api/token/', {'username': username, 'password': 'test123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def auth(self, access):
+        return {'HTTP_AUTHORIZATION': f'Bearer {access}'}
+
+    def test_token_carries_role_claim(self):
+        self.assertEqual(AccessToken(self.obtain('driver1')['access'])['role'], 'DRIVER')
+
+    def test_role_gated_endpoints_skip_auth_queries_once_cached(self):
+        rider_token = self.obtain('rider1')['access']
+        driver_token = self.obtain('driver1')['access']
+        ride = {'pickup_location': 'A', 'dropoff_location': 'B'}
+        self.client.post('/api/rides/', ride, format='json', **self.auth(rider_token))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/rides/', ride, format='json', **self.auth(rider_token))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([q['sql'] for q in queries.captured_queries if q['sql'].startswith('SELECT')], [])
+
+        heartbeat = {'lng': 77.59, 'lat': 12.97}
+        self.client.post('/api/drivers/heartbeat/', heartbeat, format='json', **self.auth(driver_token))
+        with self.assertNumQueries(0):
+            response = self.client.post('/api/drivers/heartbeat/', heartbeat, format='json',
+                                        **self.auth(driver_token))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_role_change_invalidates_cache_and_token(self):
+        tokens = self.obtain('rider1')
+        self.client.post('/api/rides/', {'pickup_location': 'A', 'dropoff_location': 'B'},
+                         format='json', **self.auth(tokens['access']))
+        self.rider.profile.role = 'DRIVER'
+        self.rider.profile.save()
+        heartbeat = {'lng': 77.59, 'lat': 12.97}
+        response = self.client.post('/api/drivers/heartbeat/', heartbeat, format='json',
+                                    **self.auth(tokens['access']))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        refreshed = self.client.post('/api/api/token/refresh/', {'refresh': tokens['refresh']}).data['access']
+        self.assertEqual(AccessToken(refreshed)['role'], 'DRIVER')
+        response = self.client.post('/api/drivers/heartbeat/', heartbeat, format='json', **self.auth(refreshed))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_deactivated_user_is_rejected_immediately(self):
+        access = self.obtain('driver1')['access']
+        heartbeat = {'lng': 77.59, 'lat': 12.97}
+        self.client.post('/api/drivers/heartbeat/', heartbeat, format='json', **self.auth(access))
+        self.driver.is_active = False
+        self.driver.save()
+        response = self.client.post('/api/drivers/heartbeat/', heartbeat, format='json', **self.auth(access))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class FastRideRenderingTests(APITestCase):
+    def setUp(self):
+        self.rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=self.rider, role='RIDER')
+        self.driver = User.objects.create_user(username='driver1', password='test123')
+        UserProfile.objects.create(user=self.driver, role='DRIVER')
+        placed = Ride(rider=self.rider, driver=self.driver, pickup_location='MG Road',
+                      dropoff_location='Airport \u2028 T1', status='ACCEPTED', city='Bengaluru')
+        placed.set_location(77.5946, 12.9716)
+        placed.save()
+        Ride.objects.create(rider=self.rider, pickup_location='A', dropoff_location='B')
+
+    def test_rows_and_instances_match_ride_serializer(self):
+        rides = Ride.objects.with_related().order_by('id')
+        expected = RideSerializer(rides, many=True).data
+        self.assertEqual(render_rides(ride_rows(rides)), expected)
+        self.assertEqual([render_ride(ride) for ride in rides], expected)
+        self.assertEqual(FastJSONRenderer().render(expected), JSONRenderer().render(expected))
+
+    def test_list_endpoint_matches_ride_serializer(self):
+        self.client.force_authenticate(user=self.rider)
+        response = self.client.get('/api/rides/list/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = RideSerializer(Ride.objects.order_by('-created_at', '-id'), many=True).data
+        self.assertEqual(json.loads(response.content)['results'], json.loads(JSONRenderer().render(expected)))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BulkRegistrationTests(APITestCase):
+    csv_body = (
+        'username,email,password,role\n'
+        'driver1,d1@example.com,secret1,DRIVER\n'
+        'taken,existing@example.com,secret2,DRIVER\n'
+        'driver3,d3@example.com,secret3,PILOT\n'
+        'driver4,d1@example.com,secret4,DRIVER\n'
+        'rider5,r5@example.com,secret5,RIDER\n'
+    )
+
+    def setUp(self):
+        User.objects.create_user(username='existing', email='existing@example.com', password='x')
+
+    def test_csv_chunks_reject_bad_and_duplicate_rows(self):
+        with CaptureQueriesContext(connection) as queries:
+            result = register_stream(io.StringIO(self.csv_body), 'csv', chunk_size=3, workers=0)
+        # Per chunk: one uniqueness query, then the user and profile inserts.
+        self.assertEqual([q['sql'].split()[0] for q in queries.captured_queries if 'SAVEPOINT' not in q['sql']],
+                         ['SELECT', 'INSERT', 'INSERT'] * 2)
+        self.assertEqual(result['created'], 2)
+        self.assertEqual({error['line']: sorted(error['errors']) for error in result['errors']},
+                         {3: ['email'], 4: ['role'], 5: ['email']})
+        rider = User.objects.select_related('profile').get(username='rider5')
+        self.assertEqual(rider.profile.role, 'RIDER')
+        self.assertTrue(rider.check_password('secret5'))
+
+    def test_ndjson_hashes_in_a_process_pool(self):
+        lines = [json.dumps({'username': f'd{n}', 'email': f'd{n}@example.com', 'password': f'pw{n}',
+                             'profile': {'role': 'DRIVER'}}) for n in range(6)]
+        result = register_stream(io.StringIO('\n'.join(lines + ['not json'])), 'ndjson', workers=2)
+        self.assertEqual(result['created'], 6)
+        self.assertEqual([error['line'] for error in result['errors']], [7])
+        self.assertTrue(User.objects.get(username='d4').check_password('pw4'))
+
+    def test_endpoint_is_staff_only(self):
+        user = User.objects.create_user(username='ops', password='x')
+        self.client.force_authenticate(user=user)
+        response = self.client.post('/api/users/register/bulk/', self.csv_body, content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        user.is_staff = True
+        with patch('ride_sharing.registration.ProcessPoolExecutor') as pool:
+            response = self.client.post('/api/users/register/bulk/', self.csv_body, content_type='text/csv')
+        pool.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['created'], response.data['rejected']), (2, 3))
+        response = self.client.post('/api/users/register/bulk/', {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_command_reads_a_file(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as handle:
+            handle.write(self.csv_body)
+        self.addCleanup(os.unlink, handle.name)
+        out, err = io.StringIO(), io.StringIO()
+        call_command('register_users', handle.name, '--workers', '0', stdout=out, stderr=err)
+        self.assertIn('Registered 2 users, rejected 3', out.getvalue())
+        self.assertIn('line 4: {"role"', err.getvalue())
+
+
+class RideDetailConditionalTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(get_presence_registry().clear)
+        self.addCleanup(get_heatmap().clear)
+        self.rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=self.rider, role='RIDER')
+        self.driver = User.objects.create_user(username='driver1', password='test123')
+        UserProfile.objects.create(user=self.driver, role='DRIVER')
+        self.ride = Ride.objects.create(rider=self.rider, pickup_location='A', dropoff_location='B')
+        self.url = f'/api/rides/{self.ride.pk}/'
+        self.client.force_authenticate(user=self.rider)
+
+    def test_unchanged_ride_answers_304_from_one_query(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.force_authenticate(user=self.driver)
+        self.client.post(f'{self.url}accept/')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'ACCEPTED')
+        self.assertNotEqual(response['ETag'], etag)
+
+    @override_settings(RIDE_DETAIL_CACHE={'ENABLED': True}, GEOCODING=FAKE_GEOCODING)
+    def test_cache_is_invalidated_by_every_write_path(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/rides/location/{self.ride.pk}', {'current_location': {
+                'type': 'Point', 'coordinates': [77.5946, 12.9716]}}, format='json')
+        self.assertEqual(self.client.get(self.url).data['current_location']['coordinates'], [77.5946, 12.9716])
+
+        self.client.force_authenticate(user=self.driver)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'{self.url}accept/')
+        self.assertEqual(self.client.get(self.url).data['driver'], 'driver1')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'{self.url}update_status/', {'status': 'IN_PROGRESS'}, format='json')
+        self.assertEqual(self.client.get(self.url).data['status'], 'IN_PROGRESS')
+
+
+class RideArchiveTests(APITestCase):
+    def setUp(self):
+        self.rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=self.rider, role='RIDER')
+        self.rides = {}
+        for name, ride_status in [('old_done', 'COMPLETED'), ('old_cancelled', 'CANCELLED'),
+                                  ('old_open', 'REQUESTED'), ('new_done', 'COMPLETED')]:
+            ride = Ride(rider=self.rider, pickup_location='A', dropoff_location='B', status=ride_status)
+            ride.set_location(77.5946, 12.9716)
+            ride.save()
+            self.rides[name] = ride
+        Ride.objects.exclude(pk=self.rides['new_done'].pk).update(
+            updated_at=timezone.now() - timedelta(days=40))
+        self.client.force_authenticate(user=self.rider)
+
+    def test_archives_old_finished_rides_in_chunks(self):
+        url = f"/api/rides/{self.rides['old_done'].pk}/"
+        before = self.client.get(url)
+        out = io.StringIO()
+        call_command('archive_rides', '--chunk-size', '1', '--pause', '0', stdout=out)
+        self.assertIn('Archived 2 finished rides', out.getvalue())
+        self.assertEqual(set(ArchivedRide.objects.values_list('pk', flat=True)),
+                         {self.rides['old_done'].pk, self.rides['old_cancelled'].pk})
+        self.assertEqual(set(Ride.objects.values_list('pk', flat=True)),
+                         {self.rides['old_open'].pk, self.rides['new_done'].pk})
+
+        # Reads by id fall back to the archive with the same body and validators.
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, before.data)
+        self.assertEqual(response['ETag'], before['ETag'])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.client.get('/api/rides/999999/').status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(RIDE_TRAILS={'SEGMENT_POINTS': 4, 'SIMPLIFY_TOLERANCE_M': 5.0},
+                   GEOCODING=FAKE_GEOCODING)
+class RideTrailTests(APITestCase):
+    def setUp(self):
+        self.addCleanup(get_presence_registry().clear)
+        self.addCleanup(get_heatmap().clear)
+        self.rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=self.rider, role='RIDER')
+        self.driver = User.objects.create_user(username='driver1', password='test123')
+        UserProfile.objects.create(user=self.driver, role='DRIVER')
+        self.ride = Ride.objects.create(rider=self.rider, driver=self.driver, pickup_location='A',
+                                        dropoff_location='B', status='IN_PROGRESS')
+
+    def test_simplify_path_keeps_corners(self):
+        line = ([(77.0 + n * 0.001, 12.0, n) for n in range(5)]
+                + [(77.004, 12.0 + n * 0.001, 5 + n) for n in range(1, 4)])
+        self.assertEqual(simplify_path(line, 5.0), [line[0], line[4], line[-1]])
+
+    def test_appends_fill_segments_and_round_trip(self):
+        points = [(round(77.5 + n * 0.0001, 6), round(12.9 + n * 0.0002, 6), 1_700_000_000 + n * 1.5) for n in range(6)]
+        append_trails({self.ride.pk: points[:3]})
+        with self.assertNumQueries(5):
+            append_trails({self.ride.pk: points[3:]})
+        segments = list(RideTrailSegment.objects.filter(ride_id=self.ride.pk).order_by('id'))
+        self.assertEqual([(segment.count, segment.closed) for segment in segments], [(4, True), (2, False)])
+        self.assertEqual(len(segments[0].points), 4 * 3 * 4)
+        self.assertEqual([point for segment in trail_segments(self.ride.pk) for point in segment], points)
+
+    def test_completion_simplifies_and_endpoint_streams(self):
+        self.client.force_authenticate(user=self.driver)
+        for n in range(6):
+            self.client.post(f'/api/rides/location/{self.ride.pk}', {'current_location': {
+                'type': 'Point', 'coordinates': [77.5 + n * 0.001, 12.9]}}, format='json')
+        self.assertEqual(sum(RideTrailSegment.objects.values_list('count', flat=True)), 6)
+        with patch('ride_sharing.ingest.get_trail_executor') as executor, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/rides/{self.ride.pk}/update_status/', {'status': 'COMPLETED'},
+                                         format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Simplification is handed to the background thread, not run in the request.
+        executor.return_value.submit.assert_called_once_with(ANY, self.ride.pk)
+        self.assertFalse(RideTrailSegment.objects.filter(ride_id=self.ride.pk, simplified=True).exists())
+        simplify_trail(self.ride.pk)
+        self.assertTrue(RideTrailSegment.objects.get(ride_id=self.ride.pk).simplified)
+
+        response = self.client.get(f'/api/rides/{self.ride.pk}/trail/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        trail = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(point['lng'], point['lat']) for point in trail], [(77.5, 12.9), (77.505, 12.9)])
+
+        outsider = User.objects.create_user(username='rider2', password='test123')
+        self.client.force_authenticate(user=outsider)
+        self.assertEqual(self.client.get(f'/api/rides/{self.ride.pk}/trail/').status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(GEOCODING=FAKE_GEOCODING)
+class AsyncRideViewTests(APITestCase):
+    def setUp(self):
+        self.addCleanup(get_presence_registry().clear)
+        self.addCleanup(get_heatmap().clear)
+        self.rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=self.rider, role='RIDER')
+        self.driver = User.objects.create_user(username='driver1', password='test123')
+        UserProfile.objects.create(user=self.driver, role='DRIVER')
+
+    def headers(self, user):
+        return {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+
+    async def test_create_and_detail_match_the_sync_views(self):
+        response = await self.async_client.post('/api/async/rides/', {
+            'pickup_location': 'A', 'dropoff_location': 'B',
+            'current_location': {'type': 'Point', 'coordinates': [77.59, 12.97]},
+        }, content_type='application/json', headers=self.headers(self.rider))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        ride = await Ride.objects.aget(pk=response.json()['id'])
+        self.assertEqual(ride.latitude, 12.97)
+        self.assertEqual(response.json(), render_ride(await Ride.objects.with_related().aget(pk=ride.pk)))
+
+        url = f'/api/async/rides/{ride.pk}/'
+        response = await self.async_client.get(url, headers=self.headers(self.rider))
+        sync_response = await sync_to_async(self.client.get)(f'/api/rides/{ride.pk}/',
+                                                              headers=self.headers(self.rider))
+        self.assertEqual(response.content, sync_response.content)
+        self.assertEqual(response['ETag'], sync_response['ETag'])
+        response = await self.async_client.get(url, headers={**self.headers(self.rider),
+                                                             'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = await self.async_client.post('/api/async/rides/', {'pickup_location': 'A'},
+                                                 content_type='application/json', headers=self.headers(self.driver))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = await self.async_client.get('/api/async/rides/0/', headers=self.headers(self.rider))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_location_accept_and_status(self):
+        ride = await Ride.objects.acreate(rider=self.rider, pickup_location='A', dropoff_location='B')
+        response = await self.async_client.post(f'/api/async/rides/location/{ride.pk}', {
+            'current_location': {'type': 'Point', 'coordinates': [77.59, 12.97]},
+        }, content_type='application/json', headers=self.headers(self.rider))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['city'], 'Bengaluru')
+        self.assertEqual(await RideTrailSegment.objects.filter(ride_id=ride.pk).acount(), 1)
+
+        accept_url = f'/api/async/rides/{ride.pk}/accept/'
+        response = await self.async_client.post(accept_url, headers=self.headers(self.rider))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = await self.async_client.post(accept_url, headers=self.headers(self.driver))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.json()['status'], response.json()['driver']), ('ACCEPTED', 'driver1'))
+        response = await self.async_client.post(accept_url, headers=self.headers(self.driver))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        status_url = f'/api/async/rides/{ride.pk}/update_status/'
+        response = await self.async_client.patch(status_url, {'status': 'COMPLETED'},
+                                                 content_type='application/json', headers=self.headers(self.driver))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        response = await self.async_client.patch(status_url, {'status': 'IN_PROGRESS'},
+                                                 content_type='application/json', headers=self.headers(self.driver))
+        self.assertEqual(response.json()['status'], 'IN_PROGRESS')
+        await ride.arefresh_from_db()
+        self.assertEqual(ride.status, 'IN_PROGRESS')
+
+
+@override_settings(READ_REPLICAS={'DATABASES': ['replica'], 'STICKY_SECONDS': 60}, GEOCODING=FAKE_GEOCODING)
+class ReplicaRoutingTests(TransactionTestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(get_presence_registry().clear)
+        self.addCleanup(get_heatmap().clear)
+        self.rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=self.rider, role='RIDER')
+        self.other = User.objects.create_user(username='rider2', password='test123')
+        self.ride = Ride.objects.create(rider=self.rider, pickup_location='A', dropoff_location='B')
+
+    def test_read_only_views_use_replicas_until_the_user_writes(self):
+        # The mirror is the primary itself; only the routing decision is under test.
+        with patch.object(ReplicaRouter, 'replica', return_value='default') as replica:
+            self.client.force_authenticate(user=self.rider)
+            self.client.get(f'/api/rides/{self.ride.pk}/')
+            self.client.get('/api/rides/list/')
+            self.assertEqual(replica.call_count, 2)
+
+            replica.reset_mock()
+            response = self.client.post(f'/api/rides/location/{self.ride.pk}', {
+                'current_location': {'type': 'Point', 'coordinates': [77.59, 12.97]}}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.get(f'/api/rides/{self.ride.pk}/')
+            self.assertEqual(response.data['city'], 'Bengaluru')
+            self.assertFalse(replica.called)
+
+            self.client.force_authenticate(user=self.other)
+            self.client.get('/api/rides/list/')
+            self.assertTrue(replica.called)
+
+    @override_settings(RIDE_DETAIL_CACHE={'ENABLED': True})
+    def test_rides_read_from_a_replica_are_not_cached(self):
+        with patch.object(ReplicaRouter, 'replica', return_value='default'):
+            self.client.force_authenticate(user=self.rider)
+            self.assertEqual(self.client.get(f'/api/rides/{self.ride.pk}/').status_code, status.HTTP_200_OK)
+            self.assertIsNone(get_cached_ride(self.ride.pk))
+            pin_to_primary(self.rider.pk)
+            self.client.get(f'/api/rides/{self.ride.pk}/')
+            self.assertIsNotNone(get_cached_ride(self.ride.pk))
+
+    def test_reads_in_transactions_and_after_writes_use_the_primary(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Ride))
+        state = RoutingState()
+        state.replica_reads = True
+        token = routing_state.set(state)
+        self.addCleanup(routing_state.reset, token)
+        self.assertEqual(router.db_for_read(Ride), 'replica')
+        with transaction.atomic():
+            self.assertIsNone(router.db_for_read(Ride))
+        router.db_for_write(Ride)
+        self.assertIsNone(router.db_for_read(Ride))
+        self.assertFalse(router.allow_migrate('replica', 'ride_sharing'))
+
+    def test_sqlite_runs_in_wal_mode_only_when_asked(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("SQLite only")
+        wal = 'journal_mode=WAL' in connection.settings_dict['OPTIONS'].get('init_command', '')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0] == 'wal', wal)
+
+
+class RideEstimateTests(APITestCase):
+    def setUp(self):
+        self.rider = User.objects.create_user(username='rider1', password='test123')
+        UserProfile.objects.create(user=self.rider, role='RIDER')
+        self.client.force_authenticate(user=self.rider)
+
+    def point(self, lng, lat):
+        return {'type': 'Point', 'coordinates': [lng, lat]}
+
+    @override_settings(RIDE_ESTIMATES={'MAX_BATCH': 3})
+    def test_haversine_fallback_single_and_batch(self):
+        response = self.client.post('/api/rides/estimate/', {
+            'pickup': self.point(77.59, 12.97), 'dropoff': self.point(77.64, 12.97)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['source'], 'haversine')
+        km = haversine_km(77.59, 12.97, 77.64, 12.97) * 1.3
+        self.assertEqual(response.data['distance_km'], round(km, 2))
+        self.assertEqual(response.data['duration_seconds'], round(km / 25 * 3600))
+        self.assertEqual(response.data['fare'], round(50 + 12 * km + 1.5 * km / 25 * 60, 2))
+
+        pairs = [{'pickup': self.point(77.59, 12.97), 'dropoff': self.point(77.59 + n / 100, 12.97)} for n in range(2)]
+        response = self.client.post('/api/rides/estimate/', {'pairs': [pairs[0], {'pickup': 'A'}, pairs[1]]},
+                                    format='json')
+        estimates = response.data['estimates']
+        self.assertEqual([estimate['fare'] for estimate in (estimates[0], estimates[2])], [80.0, 80.0])
+        self.assertIn('error', estimates[1])
+        response = self.client.post('/api/rides/estimate/', {'pairs': pairs * 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(haversine_many([(77.59, 12.97, 77.64, 12.97)] * 20),
+                         [haversine_km(77.59, 12.97, 77.64, 12.97)] * 20)
+
+    def test_grid_built_from_trails_answers_first(self):
+        ride = Ride.objects.create(rider=self.rider, pickup_location='A', dropoff_location='B', status='COMPLETED')
+        append_trails({ride.pk: [(77.505, 12.905, 1_700_000_000), (77.525, 12.905, 1_700_000_300),
+                                 (77.525, 12.925, 1_700_000_900)]})
+        simplify_trail(ride.pk)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'grid.bin')
+            call_command('build_travel_grid', path, '--bbox', '77.5', '12.9', '77.6', '13.0', stdout=io.StringIO())
+            grid = TravelGrid(path)
+            self.addCleanup(grid.close)
+            self.assertEqual((grid.cols, grid.rows), (10, 10))
+            with override_settings(RIDE_ESTIMATES={'GRIDS': [path]}):
+                response = self.client.post('/api/rides/estimate/', {'pairs': [
+                    {'pickup': self.point(77.501, 12.901), 'dropoff': self.point(77.529, 12.929)},
+                    {'pickup': self.point(77.529, 12.929), 'dropoff': self.point(77.501, 12.901)},
+                ]}, format='json')
+        there, back = response.data['estimates']
+        self.assertEqual((there['source'], there['duration_seconds']), ('grid', 900))
+        trail_km = haversine_km(77.505, 12.905, 77.525, 12.905) + haversine_km(77.525, 12.905, 77.525, 12.925)
+        self.assertAlmostEqual(there['distance_km'], trail_km, places=2)
+        self.assertEqual(back['source'], 'haversine')
+
+    def test_create_response_carries_the_estimate(self):
+        response = self.client.post('/api/rides/', {
+            'pickup_location': 'A', 'dropoff_location': 'B', 'current_location': self.point(77.59, 12.97),
+            'dropoff_point': self.point(77.64, 12.99)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['estimate']['source'], 'haversine')
+        response = self.client.post('/api/rides/', {'pickup_location': 'A', 'dropoff_location': 'B'}, format='json')
+        self.assertNotIn('estimate', response.data)
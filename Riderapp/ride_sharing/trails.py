@@ -0,0 +1,141 @@
+# ride_sharing/trails.py
+"""
+Per-ride GPS trails stored as packed segments.
+
+A RideTrailSegment holds a run of points as little-endian int32 triples
+(lat, lng, time) in microdegrees and milliseconds, each a delta from the
+previous point; the first point is relative to (0, 0, start_ms). Appending
+extends the open segment's blob without decoding it, so a batch of pings for
+many rides costs one read and two bulk writes. When a trip completes its
+trail is Douglas–Peucker simplified and re-packed into closed segments.
+"""
+import sys
+from array import array
+
+from django.conf import settings
+from django.db import transaction
+
+from .geo import simplify_path
+from .models import RideTrailSegment
+
+DEFAULTS = {
+    'SEGMENT_POINTS': 512,
+    # Points closer than this to the simplified route are dropped on completion.
+    'SIMPLIFY_TOLERANCE_M': 5.0,
+}
+
+SCALE = 1_000_000
+INT32_MAX = 2 ** 31 - 1
+
+
+def trail_settings():
+    return {**DEFAULTS, **getattr(settings, 'RIDE_TRAILS', {})}
+
+
+def _pack(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _unpack(blob):
+    values = array('i')
+    values.frombytes(bytes(blob))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def decode_segment(segment):
+    """The segment's points as a list of (lng, lat, ts) with ts in epoch seconds."""
+    values = _unpack(segment.points)
+    points = []
+    lat = lng = 0
+    ms = segment.start_ms
+    for index in range(0, len(values), 3):
+        lat += values[index]
+        lng += values[index + 1]
+        ms += values[index + 2]
+        points.append((lng / SCALE, lat / SCALE, ms / 1000))
+    return points
+
+
+def _new_segment(ride_id, ms):
+    return RideTrailSegment(ride_id=ride_id, start_ms=ms, last_lat=0, last_lng=0, last_ms=ms,
+                            count=0, points=b'')
+
+
+def _append(segment, ride_id, points, segment_points):
+    """
+    Pack (lng, lat, ts) ``points`` after ``segment`` (None to start a new
+    one), opening further segments as each fills up. Returns every segment
+    written to, oldest first; all but the last are closed.
+    """
+    touched = []
+    values = None
+    for lng, lat, ts in points:
+        lat_e6, lng_e6, ms = round(lat * SCALE), round(lng * SCALE), round(ts * 1000)
+        if segment is None or segment.count >= segment_points or abs(ms - segment.last_ms) > INT32_MAX:
+            if values is not None:
+                segment.points = bytes(segment.points) + _pack(values)
+            if segment is not None:
+                segment.closed = True
+                if not touched:
+                    touched.append(segment)
+            segment = _new_segment(ride_id, ms)
+            values = array('i')
+            touched.append(segment)
+        elif values is None:
+            values = array('i')
+            touched.append(segment)
+        values.extend((lat_e6 - segment.last_lat, lng_e6 - segment.last_lng, ms - segment.last_ms))
+        segment.last_lat, segment.last_lng, segment.last_ms = lat_e6, lng_e6, ms
+        segment.count += 1
+    if values is not None:
+        segment.points = bytes(segment.points) + _pack(values)
+    return touched
+
+
+def append_trails(points_by_ride):
+    """Append {ride_id: [(lng, lat, ts), ...]} to the rides' trails."""
+    if not points_by_ride:
+        return
+    segment_points = trail_settings()['SEGMENT_POINTS']
+    with transaction.atomic():
+        open_segments = {
+            segment.ride_id: segment for segment in RideTrailSegment.objects.select_for_update()
+            .filter(ride_id__in=list(points_by_ride), closed=False)
+        }
+        changed, created = [], []
+        for ride_id, points in points_by_ride.items():
+            points = sorted(points, key=lambda point: point[2])
+            for segment in _append(open_segments.get(ride_id), ride_id, points, segment_points):
+                (changed if segment.pk is not None else created).append(segment)
+        # Close full segments before inserting their successors; a ride has one open segment.
+        RideTrailSegment.objects.bulk_update(changed, ['points', 'count', 'last_lat', 'last_lng', 'last_ms',
+                                                       'closed'])
+        RideTrailSegment.objects.bulk_create(created)
+
+
+def trail_segments(ride_id, chunk_size=16):
+    """The ride's trail as decoded segments, oldest first, loading ``chunk_size`` segments at a time."""
+    segments = RideTrailSegment.objects.filter(ride_id=ride_id).order_by('id')
+    for segment in segments.only('start_ms', 'points').iterator(chunk_size=chunk_size):
+        yield decode_segment(segment)
+
+
+def simplify_trail(ride_id):
+    """Douglas–Peucker simplify the ride's whole trail in place; returns the points kept."""
+    config = trail_settings()
+    with transaction.atomic():
+        segments = list(RideTrailSegment.objects.select_for_update().filter(ride_id=ride_id).order_by('id'))
+        if not segments or all(segment.simplified for segment in segments):
+            return sum(segment.count for segment in segments)
+        points = [point for segment in segments for point in decode_segment(segment)]
+        kept = simplify_path(points, config['SIMPLIFY_TOLERANCE_M'])
+        packed = _append(None, ride_id, kept, config['SEGMENT_POINTS'])
+        for segment in packed:
+            segment.closed = segment.simplified = True
+        RideTrailSegment.objects.filter(pk__in=[segment.pk for segment in segments]).delete()
+        RideTrailSegment.objects.bulk_create(packed)
+    return len(kept)
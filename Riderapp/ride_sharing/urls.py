@@ -3,7 +3,17 @@ from django.urls import path
 #     UserRegisterView, RideCreateView, RideListView, RideDetailView,
 #     RideStatusUpdateView, RideLocationUpdateView, RideAcceptView, RideMatchDriverView
 # )
-from .views import UserRegisterView,RideCreateView, RideListView,RideLocationUpdateView, RideDetailView,RideStatusUpdateView,  RideAcceptView, RideMatchDriverView
+from .views import (
+    UserRegisterView, RideCreateView, RideListView, RideLocationUpdateView, RideDetailView,
+    RideStatusUpdateView, RideAcceptView, RideMatchDriverView, RideLocationBatchView,
+    RideEventStreamView, RideNearbyView, RideBoundingBoxView, DriverHeartbeatView,
+    HeatmapView, UserBulkRegisterView, RideTrailView, RideEstimateView,
+)
+from .async_views import (
+    AsyncRideAcceptView, AsyncRideCreateView, AsyncRideDetailView, AsyncRideLocationUpdateView,
+    AsyncRideStatusUpdateView,
+)
+from .instrumentation import MetricsView
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -11,15 +21,32 @@ from rest_framework_simplejwt.views import (
 
 urlpatterns = [
     path('users/register/', UserRegisterView.as_view(), name='user-register'),
+    path('users/register/bulk/', UserBulkRegisterView.as_view(), name='user-register-bulk'),
     path('rides/', RideCreateView.as_view(), name='ride-create'),
+    path('rides/estimate/', RideEstimateView.as_view(), name='ride-estimate'),
     path('rides/list/', RideListView.as_view(), name='ride-list'),
+    path('rides/nearby/', RideNearbyView.as_view(), name='ride-nearby'),
+    path('rides/within/', RideBoundingBoxView.as_view(), name='ride-within'),
     path('rides/<int:pk>/', RideDetailView.as_view(), name='ride-detail'),
     path('rides/<int:pk>/update_status/', RideStatusUpdateView.as_view(), name='ride-status-update'),
     # path('rides/update_location/<int:pk>', RideLocationUpdateView.as_view(), name='ride-location-update'),
     path('rides/location/<int:pk>', RideLocationUpdateView.as_view(), name='ride-location-update'),
+    path('rides/locations/batch/', RideLocationBatchView.as_view(), name='ride-location-batch'),
 
+    path('rides/<int:pk>/trail/', RideTrailView.as_view(), name='ride-trail'),
+    path('rides/<int:pk>/events/', RideEventStreamView.as_view(), name='ride-events'),
     path('rides/<int:pk>/accept/', RideAcceptView.as_view(), name='ride-accept'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('heatmap/', HeatmapView.as_view(), name='heatmap'),
+    path('drivers/heartbeat/', DriverHeartbeatView.as_view(), name='driver-heartbeat'),
     path('rides/match_driver/', RideMatchDriverView.as_view(), name='ride-match-driver'),
+    # The same ride endpoints as async views, for ASGI deployments.
+    path('async/rides/', AsyncRideCreateView.as_view(), name='async-ride-create'),
+    path('async/rides/<int:pk>/', AsyncRideDetailView.as_view(), name='async-ride-detail'),
+    path('async/rides/<int:pk>/update_status/', AsyncRideStatusUpdateView.as_view(),
+         name='async-ride-status-update'),
+    path('async/rides/location/<int:pk>', AsyncRideLocationUpdateView.as_view(), name='async-ride-location-update'),
+    path('async/rides/<int:pk>/accept/', AsyncRideAcceptView.as_view(), name='async-ride-accept'),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 ]
\ No newline at end of file
@@ -1,15 +1,36 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import generics, status
-from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
-from .models import Ride
-from .serializers import UserSerializer, RideSerializer,RideLocationSerializer
+from .archive import read_through
+from .authentication import CachedJWTAuthentication, authenticate_request
+from .models import ACTIVE_STATUSES, Ride, UserProfile
+from .serializers import (
+    UserSerializer, RideSerializer, RideLocationSerializer, render_ride, render_rides, ride_renderer, ride_rows,
+)
 from .ride_matching import match_ride_with_driver
+from .geo import bounding_box, haversine_km
+from .estimates import estimate_settings, get_estimator, parse_pair, ride_estimate
+from .events import get_broker, publish_ride_event, ride_channel
+from .heatmap import get_heatmap, record_ride_event
+from .geocoding import geocoding_settings, get_city_resolver, get_geocoder
+from .ingest import finish_trail, ingest_points, parse_points
+from .instrumentation import timed
+from .pagination import KeysetPagination
+from .registration import READERS, register_stream
+from .replicas import ReplicaReadMixin
+from .presence import BUSY, ONLINE, STATES, get_presence_registry, presence_settings, sync_driver_state
+from .ride_cache import invalidate_ride, ride_detail_response
+from .trails import append_trails, trail_segments
 
-import requests
-from django.conf import settings
+import heapq
+import json
+from django.db import transaction
+from django.utils import timezone
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
 class UserRegisterView(generics.CreateAPIView):
     serializer_class = UserSerializer
 # class UserRegisterView(APIView):
@@ -20,8 +41,29 @@ class UserRegisterView(generics.CreateAPIView):
 #             return Response(serializer.data, status=status.HTTP_201_CREATED)
 #         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class UserBulkRegisterView(APIView):
+    """
+    Staff-only bulk registration from a text/csv or application/x-ndjson
+    request body, validated and inserted in chunks; see registration.py.
+    Passwords are hashed in the request's own process: a hashing pool costs
+    more to start than an upload of this size saves, so large imports belong
+    to ``manage.py register_users``.
+    """
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAdminUser]
+    content_types = {'text/csv': 'csv', 'application/x-ndjson': 'ndjson'}
+
+    def post(self, request):
+        fmt = self.content_types.get(request.content_type.split(';')[0].strip())
+        if fmt not in READERS:
+            return Response({"error": "Send text/csv or application/x-ndjson"},
+                            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        result = register_stream(request.stream or [], fmt, workers=0)
+        return Response({"created": result['created'], "rejected": len(result['errors']),
+                         "errors": result['errors']}, status=status.HTTP_201_CREATED)
+
 class RideCreateView(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
@@ -31,58 +73,238 @@ class RideCreateView(APIView):
                                status=status.HTTP_403_FORBIDDEN)
             serializer = RideSerializer(data=request.data)
             if serializer.is_valid():
-                serializer.save(rider=request.user)
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
+                ride = serializer.save(rider=request.user)
+                if ride.latitude is not None or ride.city:
+                    # Unplaced requests are counted on their first location fix.
+                    record_ride_event('request', ride)
+                data = render_ride(ride)
+                estimate = ride_estimate(request.data, ride)
+                if estimate is not None:
+                    data['estimate'] = estimate
+                return Response(data, status=status.HTTP_201_CREATED)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         except UserProfile.DoesNotExist:
             return Response({"error": "User profile not found"}, status=status.HTTP_400_BAD_REQUEST)
 
-class RideListView(APIView):
-    authentication_classes = [JWTAuthentication]
+class RideEstimateView(APIView):
+    """
+    Duration, distance and fare for {"pickup": Point, "dropoff": Point}, or
+    for each of up to RIDE_ESTIMATES['MAX_BATCH'] such pairs sent as
+    {"pairs": [...]}; invalid pairs get an error entry in their place.
+    """
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        data = request.data if isinstance(request.data, dict) else {}
+        if 'pairs' not in data:
+            pair = parse_pair(data)
+            if pair is None:
+                return Response({"error": "'pickup' and 'dropoff' must be GeoJSON Points"},
+                                status=status.HTTP_400_BAD_REQUEST)
+            return Response(get_estimator().estimate(*pair))
+        items = data['pairs']
+        max_batch = estimate_settings()['MAX_BATCH']
+        if not isinstance(items, list) or len(items) > max_batch:
+            return Response({"error": f"'pairs' must be a list of at most {max_batch} pairs"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        pairs = [parse_pair(item) for item in items]
+        estimates = iter(get_estimator().estimate_many([pair for pair in pairs if pair is not None]))
+        return Response({"estimates": [
+            {"error": "'pickup' and 'dropoff' must be GeoJSON Points"} if pair is None else next(estimates)
+            for pair in pairs
+        ]})
+
+class RideListView(ReplicaReadMixin, APIView):
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
+    pagination_class = KeysetPagination
+    export_chunk_size = 2000
+
     def get(self, request):
         rides = Ride.objects.all()
-      
-        serializer = RideSerializer(rides, many=True)
-        return Response(serializer.data)
+        filters = {}
+        status_value = request.query_params.get('status')
+        if status_value:
+            if status_value not in dict(Ride.STATUS_CHOICES):
+                return Response({"error": "Invalid status"}, status=status.HTTP_400_BAD_REQUEST)
+            filters['status'] = status_value
+        if request.query_params.get('city'):
+            filters['city'] = request.query_params['city']
+        for field in ('rider', 'driver'):
+            value = request.query_params.get(field)
+            if value:
+                if not value.isdigit():
+                    return Response({"error": f"Invalid {field} id"}, status=status.HTTP_400_BAD_REQUEST)
+                filters[f'{field}_id'] = int(value)
+        rides = rides.filter(**filters)
+
+        if request.query_params.get('export') == 'ndjson':
+            return self.export_ndjson(rides)
 
-class RideDetailView(APIView):
-    authentication_classes = [JWTAuthentication]
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(ride_rows(rides, named=True), request, view=self)
+        with timed('serialize'):
+            data = render_rides(page)
+        return paginator.get_paginated_response(data)
+
+    def export_ndjson(self, rides):
+        """Stream every matching ride as one JSON object per line in constant memory."""
+        rides = rides.order_by('-created_at', '-id')
+
+        def rows():
+            render = ride_renderer()
+            for row in ride_rows(rides).iterator(chunk_size=self.export_chunk_size):
+                yield json.dumps(render(row)) + '\n'
+
+        response = StreamingHttpResponse(rows(), content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="rides.ndjson"'
+        return response
+
+def parse_float_params(params, names):
+    """Read required float query parameters; returns (values, error_response)."""
+    values = []
+    for name in names:
+        try:
+            values.append(float(params[name]))
+        except (KeyError, TypeError, ValueError):
+            return None, Response({"error": f"'{name}' must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+    return values, None
+
+class RideNearbyView(APIView):
+    """Rides whose last known position is within radius_km of lat/lng, nearest first."""
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
+    max_radius_km = 50
+    max_results = 500
 
-    def get(self, request, pk):
+    def get(self, request):
+        values, error = parse_float_params(request.query_params, ('lat', 'lng', 'radius_km'))
+        if error:
+            return error
+        lat, lng, radius_km = values
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180 and 0 < radius_km <= self.max_radius_km):
+            return Response({"error": f"lat/lng out of range or radius_km not in (0, {self.max_radius_km}]"},
+                            status=status.HTTP_400_BAD_REQUEST)
         try:
-            ride = Ride.objects.get(pk=pk)
-            serializer = RideSerializer(ride)
-            return Response(serializer.data)
-        except Ride.DoesNotExist:
-            return Response({"error": "Ride not found"}, status=status.HTTP_404_NOT_FOUND)
+            limit = min(int(request.query_params.get('limit', 100)), self.max_results)
+        except ValueError:
+            return Response({"error": "'limit' must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # The bounding box is answered from the lat/lng index; only the rides
+        # inside it are checked against the exact radius here.
+        rides = Ride.objects.within_bbox(*bounding_box(lng, lat, radius_km))
+        if request.query_params.get('status'):
+            rides = rides.filter(status=request.query_params['status'])
+        nearby = []
+        for *row, ride_lng, ride_lat in ride_rows(rides, 'longitude', 'latitude').iterator(chunk_size=2000):
+            distance = haversine_km(lng, lat, ride_lng, ride_lat)
+            if distance <= radius_km:
+                nearby.append((distance, row))
+        nearby = heapq.nsmallest(limit, nearby, key=lambda item: item[0])
+        data = render_rides(row for _, row in nearby)
+        for item, (distance, _) in zip(data, nearby):
+            item['distance_km'] = round(distance, 3)
+        return Response(data)
+
+class RideBoundingBoxView(APIView):
+    """Rides whose last known position lies inside a bounding box, as keyset pages."""
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def get(self, request):
+        values, error = parse_float_params(request.query_params, ('min_lng', 'min_lat', 'max_lng', 'max_lat'))
+        if error:
+            return error
+        min_lng, min_lat, max_lng, max_lat = values
+        if min_lat > max_lat:
+            return Response({"error": "min_lat must not exceed max_lat"}, status=status.HTTP_400_BAD_REQUEST)
+        rides = Ride.objects.within_bbox(min_lng, min_lat, max_lng, max_lat)
+        if request.query_params.get('status'):
+            rides = rides.filter(status=request.query_params['status'])
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(ride_rows(rides, named=True), request, view=self)
+        return paginator.get_paginated_response(render_rides(page))
+
+def ride_accepted(ride, driver, now):
+    """Bookkeeping once ``driver`` has won ``ride`` at ``now``; returns the response body."""
+    ride.driver = driver
+    ride.status = 'ACCEPTED'
+    ride.updated_at = now
+    invalidate_ride(ride.pk)
+    data = render_ride(ride)
+    publish_ride_event(ride.pk, 'accepted', data)
+    sync_driver_state(ride.driver_id, ride.status)
+    record_ride_event('acceptance', ride)
+    return data
+
+def ride_status_changed(ride, status_value, now):
+    """Bookkeeping once ``ride`` has moved to ``status_value``; returns the response body."""
+    ride.status = status_value
+    ride.updated_at = now
+    invalidate_ride(ride.pk)
+    if status_value == 'COMPLETED':
+        transaction.on_commit(lambda: finish_trail(ride.pk))
+    data = render_ride(ride)
+    publish_ride_event(ride.pk, 'status', data)
+    sync_driver_state(ride.driver_id, ride.status)
+    return data
+
+def ride_located(ride, user, first_fix, resolve_later):
+    """Bookkeeping once ``user``'s location fix for ``ride`` is saved; returns the response body."""
+    lng, lat = ride.current_location['coordinates']
+    append_trails({ride.pk: [(lng, lat, ride.updated_at.timestamp())]})
+    if resolve_later:
+        transaction.on_commit(lambda: get_city_resolver().submit(ride.pk, lng, lat))
+    if ride.driver_id == user.id:
+        # A driver's location ping doubles as a presence heartbeat.
+        state = BUSY if ride.status in ACTIVE_STATUSES else ONLINE
+        get_presence_registry().heartbeat(user.id, lng, lat, state=state)
+        get_heatmap().record_driver(user.id, lng, lat, available=state == ONLINE, city=ride.city)
+    elif first_fix and ride.status == 'REQUESTED':
+        record_ride_event('request', ride)
+    with timed('serialize'):
+        data = render_ride(ride)
+    publish_ride_event(ride.pk, 'location', data)
+    return data
+
+class RideDetailView(ReplicaReadMixin, APIView):
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        return ride_detail_response(request, pk, Response)
 
 class RideStatusUpdateView(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def patch(self, request, pk):
         try:
-            ride = Ride.objects.get(pk=pk)
+            ride = Ride.objects.with_related().get(pk=pk)
             status_value = request.data.get('status')
-            if status_value not in dict(Ride.STATUS_CHOICES).keys():
+            if status_value not in Ride.STATUS_VALUES:
                 return Response({"error": "Invalid status"}, status=status.HTTP_400_BAD_REQUEST)
-            ride.status = status_value
-            ride.save()
-            serializer = RideSerializer(ride)
-            return Response(serializer.data)
+            # Enforced in the UPDATE itself, so a concurrent change to the
+            # ride cannot slip an illegal transition through.
+            now = timezone.now()
+            if not Ride.objects.filter(pk=pk).transition(status_value, now=now):
+                ride.refresh_from_db(fields=['status'])
+                return Response({"error": f"Cannot change status from {ride.status} to {status_value}"},
+                                status=status.HTTP_409_CONFLICT)
+            return Response(ride_status_changed(ride, status_value, now))
         except Ride.DoesNotExist:
             return Response({"error": "Ride not found"}, status=status.HTTP_404_NOT_FOUND)
 
 class RideLocationUpdateView(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def patch(self, request, pk):
         try:
-            ride = Ride.objects.get(pk=pk)
+            ride = Ride.objects.with_related().get(pk=pk)
             current_location = request.data.get('current_location')
             if not current_location:
                 return Response({"error": "Current location required"}, 
@@ -94,94 +316,221 @@ class RideLocationUpdateView(APIView):
         except Ride.DoesNotExist:
             return Response({"error": "Ride not found"}, status=status.HTTP_404_NOT_FOUND)
 class RideLocationUpdateView(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get_city_from_coordinates(self, longitude, latitude):
-        """Perform reverse geocoding using Geoapify API."""
-        try:
-            url = f"https://api.geoapify.com/v1/geocode/reverse?lat={latitude}&lon={longitude}&apiKey={settings.GEOAPIFY_API_KEY}"
-            response = requests.get(url, timeout=5)
-            response.raise_for_status()
-            data = response.json()
-            # Extract city from the first result
-            features = data.get('features', [])
-            if features:
-                city = features[0].get('properties', {}).get('city', '')
-                return city if city else 'Unknown'
-            return 'Unknown'
-        except requests.RequestException as e:
-            print(f"Reverse geocoding error: {e}")
-            return 'Unknown'
+        """Reverse geocode through the cached geocoding layer."""
+        return get_geocoder().reverse(longitude, latitude)
 
     def post(self, request, pk):
         try:
-            ride = Ride.objects.get(pk=pk)
+            ride = Ride.objects.with_related().get(pk=pk)
             
-            if ride.driver != request.user and ride.rider != request.user:
+            if ride.driver_id != request.user.id and ride.rider_id != request.user.id:
                 return Response({"error": "Unauthorized to update this ride"}, 
                               status=status.HTTP_403_FORBIDDEN)
             
             serializer = RideLocationSerializer(data=request.data)
             if serializer.is_valid():
+                first_fix = ride.latitude is None and not ride.city
                 current_location = serializer.validated_data['current_location']
                 # Update ride's current location
                 ride.current_location = current_location
                 # Get city name from coordinates
                 lng, lat = current_location['coordinates']
-                ride.city = self.get_city_from_coordinates(lng, lat)
-                ride.save()
-                
-                # Return serialized ride data
-                ride_serializer = RideSerializer(ride)
-                return Response(ride_serializer.data, status=status.HTTP_200_OK)
+                resolve_later = False
+                with timed('geocode'):
+                    if geocoding_settings()['ASYNC']:
+                        # Answer from the cache if we can; otherwise keep the old
+                        # city and let a background worker fill it in.
+                        city = get_geocoder().cached(lng, lat)
+                        if city is not None:
+                            ride.city = city
+                        resolve_later = city is None
+                    else:
+                        ride.city = self.get_city_from_coordinates(lng, lat)
+                # Only write the location columns so a concurrent status change
+                # is not overwritten with the status read above.
+                ride.save(update_fields=[*Ride.LOCATION_FIELDS, 'city', 'updated_at'])
+                data = ride_located(ride, request.user, first_fix, resolve_later)
+                return Response(data, status=status.HTTP_200_OK)
             
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
         except Ride.DoesNotExist:
             return Response({"error": "Ride not found"}, status=status.HTTP_404_NOT_FOUND)
 
+class RideLocationBatchView(APIView):
+    """
+    High-frequency GPS ingestion: accepts a batch of {ride_id, lng, lat, ts}
+    points and buffers them; positions reach the database in bulk.
+    """
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        raw_points = request.data.get('points') if isinstance(request.data, dict) else request.data
+        if not isinstance(raw_points, list):
+            return Response({"error": "A list of points is required"}, status=status.HTTP_400_BAD_REQUEST)
+        points = parse_points(raw_points)
+        accepted = ingest_points(request.user, points) if points else 0
+        return Response({"accepted": accepted, "rejected": len(raw_points) - accepted},
+                        status=status.HTTP_202_ACCEPTED)
+
+class DriverHeartbeatView(APIView):
+    """Drivers report position and ONLINE/BUSY/OFFLINE state; presence lapses after DRIVER_PRESENCE['TTL']."""
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        try:
+            if not request.user.profile.role == 'DRIVER':
+                return Response({"error": "Only users with the 'Driver' role can send heartbeats"},
+                                status=status.HTTP_403_FORBIDDEN)
+        except UserProfile.DoesNotExist:
+            return Response({"error": "User profile not found"}, status=status.HTTP_400_BAD_REQUEST)
+        state = request.data.get('state', ONLINE)
+        if state not in STATES:
+            return Response({"error": "Invalid state"}, status=status.HTTP_400_BAD_REQUEST)
+        values, error = parse_float_params(request.data, ('lng', 'lat'))
+        if error:
+            return error
+        lng, lat = values
+        if not (-180 <= lng <= 180 and -90 <= lat <= 90):
+            return Response({"error": "Invalid coordinates"}, status=status.HTTP_400_BAD_REQUEST)
+        get_presence_registry().heartbeat(request.user.id, lng, lat, state=state)
+        get_heatmap().record_driver(request.user.id, lng, lat, available=state == ONLINE,
+                                    city=get_geocoder().cached(lng, lat))
+        return Response({"state": state, "expires_in": presence_settings()['TTL']})
+
+class HeatmapView(APIView):
+    """Live open requests vs. available drivers per geocell (default) or per city."""
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        level = request.query_params.get('level', 'cell')
+        if level not in ('cell', 'city'):
+            return Response({"error": "level must be 'cell' or 'city'"}, status=status.HTTP_400_BAD_REQUEST)
+        heatmap = get_heatmap()
+        return Response({
+            'window_seconds': heatmap.window,
+            'level': level,
+            'areas': heatmap.snapshot(level=level, city=request.query_params.get('city')),
+        })
+
 class RideAcceptView(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request, pk):
         try:
-            ride = Ride.objects.get(pk=pk)
+            ride = Ride.objects.with_related().get(pk=pk)
             if ride.status != 'REQUESTED':
                 return Response({"error": "Ride cannot be accepted"}, 
                                status=status.HTTP_400_BAD_REQUEST)
-            if ride.rider == request.user:
+            if ride.rider_id == request.user.id:
                 return Response({"error": "Rider cannot accept their own ride"}, 
                                status=status.HTTP_400_BAD_REQUEST)
             if not request.user.profile.role == 'DRIVER':
                 return Response({"error": "Only users with the 'Driver' role can accept rides"}, 
                                status=status.HTTP_403_FORBIDDEN)
-            ride.driver = request.user
-            ride.status = 'ACCEPTED'
-            ride.save()
-            serializer = RideSerializer(ride)
-            return Response(serializer.data)
+            # The status check above is only a fast path; the conditional
+            # update decides the winner when several drivers race.
+            now = timezone.now()
+            if not Ride.objects.assign_driver(ride.pk, request.user, now=now):
+                ride.refresh_from_db(fields=['status'])
+                if ride.status != 'REQUESTED':
+                    return Response({"error": "Ride was accepted by another driver"},
+                                    status=status.HTTP_409_CONFLICT)
+                return Response({"error": "Driver is already on another trip"},
+                                status=status.HTTP_409_CONFLICT)
+            return Response(ride_accepted(ride, request.user, now))
         except Ride.DoesNotExist:
             return Response({"error": "Ride not found"}, status=status.HTTP_404_NOT_FOUND)
         except UserProfile.DoesNotExist:
             return Response({"error": "User profile not found"}, status=status.HTTP_400_BAD_REQUEST)
 
 class RideMatchDriverView(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
+    max_attempts = 3
 
     def post(self, request):
-        ride = Ride.objects.filter(status='REQUESTED', rider=request.user).last()
+        ride = Ride.objects.with_related().filter(status='REQUESTED', rider=request.user).last()
         if not ride:
             return Response({"error": "No pending ride requests"}, 
                            status=status.HTTP_400_BAD_REQUEST)
-        driver = match_ride_with_driver(ride)
-        if driver:
-            ride.driver = driver
-            ride.status = 'ACCEPTED'
-            ride.save()
-            serializer = RideSerializer(ride)
-            return Response(serializer.data)
+        tried = set()
+        for _ in range(self.max_attempts):
+            driver = match_ride_with_driver(ride, exclude=tried)
+            if not driver:
+                break
+            now = timezone.now()
+            if Ride.objects.assign_driver(ride.pk, driver, now=now):
+                return Response(ride_accepted(ride, driver, now))
+            ride.refresh_from_db(fields=['status'])
+            if ride.status != 'REQUESTED':
+                return Response({"error": "Ride was accepted by another driver"},
+                                status=status.HTTP_409_CONFLICT)
+            # That driver took another trip in the meantime; try the next one.
+            tried.add(driver.pk)
         return Response({"error": "No drivers available"}, 
-                       status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+                       status=status.HTTP_404_NOT_FOUND)
+
+
+class RideTrailView(APIView):
+    """A ride's GPS trail as NDJSON {lng, lat, ts} lines, decoded one stored segment at a time."""
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        ride = read_through(lambda model: model.objects.filter(pk=pk).values('rider_id', 'driver_id').first())
+        if ride is None:
+            return Response({"error": "Ride not found"}, status=status.HTTP_404_NOT_FOUND)
+        if request.user.id not in (ride['rider_id'], ride['driver_id']) and not request.user.is_staff:
+            return Response({"error": "Unauthorized to view this trail"}, status=status.HTTP_403_FORBIDDEN)
+
+        def lines():
+            for points in trail_segments(pk):
+                yield ''.join(json.dumps({'lng': lng, 'lat': lat, 'ts': ts}) + '\n' for lng, lat, ts in points)
+
+        return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+
+class RideEventStreamView(View):
+    """
+    Server-sent events for one ride: accept, status and location changes are
+    pushed as they commit. Serve under ASGI (Riderapp.asgi) so each open
+    stream costs a coroutine rather than a worker thread.
+    """
+    keepalive_seconds = 15
+
+    async def get(self, request, pk):
+        user = await sync_to_async(authenticate_request)(request, query_token=True)
+        if user is None:
+            return JsonResponse({"error": "Authentication credentials were not provided or are invalid"},
+                                status=status.HTTP_401_UNAUTHORIZED)
+        ride = await Ride.objects.filter(pk=pk).values('rider_id', 'driver_id').afirst()
+        if ride is None:
+            return JsonResponse({"error": "Ride not found"}, status=status.HTTP_404_NOT_FOUND)
+        if user.id not in (ride['rider_id'], ride['driver_id']):
+            return JsonResponse({"error": "Unauthorized to follow this ride"}, status=status.HTTP_403_FORBIDDEN)
+
+        subscription = get_broker().subscribe(ride_channel(pk))
+        response = StreamingHttpResponse(self.stream(subscription), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def stream(self, subscription):
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                event = await subscription.get(timeout=self.keepalive_seconds)
+                if event is None:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            subscription.close()